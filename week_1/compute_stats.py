@@ -3,33 +3,32 @@
 #                - added in example from class. 
 
 # import packages
+import os
 import sys
-import statistics as stats
 
-# grab input
-file = sys.stdin
+# the streaming reader and statistics of week 2: stdin, plain and compressed
+# files are read in blocks, and the median is selected from a spill file
+# instead of keeping the values in memory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'week_2'))
+from compute_stats2 import column_masks, file_stats
 
-# initialize list
-array = []
+# grab input: a file named on the command line, compressed or not, else stdin
+file = sys.argv[1] if len(sys.argv) > 1 else '-'
 
-# input values into list as float object
-for i in file:
-    array.append(float(i))
-
-# remove missing values
-#array.remove(-9999.0)
-
-# only keeping reasonable values
-array = array[array >= -273.15]
+# remove missing values and only keep reasonable values, one block at a
+# time; the input does not need to be sorted
+column = file_stats(file, [0], masks = column_masks([0]))[0]
+masked = column.sentinels + column.out_of_range
 
 # calculate statistics
-min = min(array)
-max = max(array)
-average = stats.mean(array)
-median = stats.median(array)
+if column.stats is not None:
+    min, max, average, median = column.stats
+
+    # print output
+    print("min:", min, "max:", max, "average:", average, "median:", median, "masked:", masked)
 
-# print output
-print("min:", min, "max:", max, "average:", average, "median:", median)
+else:
+    print("no values", "masked:", masked)
 
 # input method used for class (-273.15 is absolute zero)
 #array = [float(line) for line in sys.stdin if float(line) >= -273.15]
@@ -0,0 +1,80 @@
+""" Benchmark of the csv and fixed width column parsers of compute_stats2
+    and of reading the converted columnar form, on Data.txt repeated into a
+    bigger temporary file. Only parsing and masking are timed, not the
+    statistics or the one time conversion. Last, the approximate
+    statistics of the whole file are timed with it split into byte ranges
+    over 1, 2, 4, ... processes.
+
+    run with: python3 bench_compute_stats2.py [copies] [col_num]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import compute_stats2
+
+def time_parser(name, parse, rows):
+    ''' run parse() and print its time and row rate
+    '''
+    start = time.perf_counter()
+    parse()
+    seconds = time.perf_counter() - start
+    print(f'{name:>6}: {seconds:.3f} s, {rows / seconds / 1e6:.2f} M rows/s')
+    return seconds
+
+def main():
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    col_num = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Data.txt'), 'rb') as f:
+        data = f.read()
+
+    with tempfile.NamedTemporaryFile(suffix = '.txt', delete = False) as f:
+        f.write(data * copies)
+    try:
+        rows = data.count(b'\n') * copies
+        print(f'{os.path.getsize(f.name) / 1e6:.0f} MB, {rows} rows, column {col_num}')
+
+        mask, = compute_stats2.column_masks([col_num])
+
+        def parse(parser):
+            # parsed like main() and counted through the same mask
+            with open(f.name, 'rb') as file:
+                kept = 0
+                for block in compute_stats2.input_blocks(file, [col_num], parser):
+                    sentinel, out_of_range = mask.split(block[0])
+                    kept += len(block[0]) - int(np.count_nonzero(sentinel | out_of_range))
+                return kept
+
+        def read_columnar():
+            # memory mapped pages are only read when touched, so count the finite values
+            return sum(int(np.isfinite(chunk[0]).sum()) for chunk in compute_stats2.read_columnar(directory, [col_num]))
+
+        csv_seconds = time_parser('csv', lambda: parse('csv'), rows)
+        fixed_seconds = time_parser('fixed', lambda: parse('fixed'), rows)
+        print(f'speedup: {csv_seconds / fixed_seconds:.1f}x')
+
+        directory = compute_stats2.convert_file(f.name)
+        columnar_seconds = time_parser('binary', read_columnar, rows)
+        print(f'speedup: {csv_seconds / columnar_seconds:.1f}x')
+        shutil.rmtree(directory)
+
+        processes = 1
+        while processes <= os.cpu_count():
+            def split_stats():
+                return compute_stats2.split_files_stats([f.name], [col_num], 'fixed', processes)
+            seconds = time_parser(f'{processes}p', split_stats, rows)
+            if processes == 1:
+                one_seconds = seconds
+            print(f'speedup: {one_seconds / seconds:.1f}x')
+            processes *= 2
+    finally:
+        os.remove(f.name)
+        shutil.rmtree(f.name + compute_stats2.COLUMNAR_SUFFIX, ignore_errors = True)
+
+if __name__ == '__main__':
+    main()
@@ -1,60 +1,1309 @@
 # import packages
 import sys
 import csv
-import statistics as stats
+import argparse
+import bz2
+import collections
+import contextlib
+import glob
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import math
+import multiprocessing
+import os
+import re
+import tempfile
+import numpy as np
+
+# only keeping reasonable values (-273.15 is absolute zero)
+ABSOLUTE_ZERO = -273.15
+
+# missing value markers of the station files, masked in every column by default
+SENTINELS = (-9999.0, -99.0)
+
+# values per chunk handed to the streaming statistics
+CHUNK_SIZE = 65536
+
+# most values the exact median holds in memory at once
+SELECT_MEMORY = 1_000_000
+
+# histogram bins per pass of the exact median
+SELECT_BINS = 1024
+
+# relative accuracy of the approximate median
+SKETCH_ACCURACY = 0.01
+
+# bytes read at a time by the fixed width parser
+BLOCK_SIZE = 1 << 24
+
+# column of the YYYYMMDD dates in the station files
+DATE_COLUMN = 1
+
+# suffix of the sidecar cache of a data file
+CACHE_SUFFIX = '.stats.json'
+
+# format of the sidecar cache, bumped when it changes
+CACHE_VERSION = 2
+
+# bytes read at a time looking back from the end of a file for a newline
+TAIL_BYTES = 1 << 16
+
+# smallest byte range of a file parsed by one process
+RANGE_BYTES = 1 << 22
+
+# openers of compressed files by suffix, decompressing as they are read
+COMPRESSED = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+# suffix of the directory holding the columnar binary form of a data file
+COLUMNAR_SUFFIX = '.columns'
+
+# description of the columns in a columnar directory
+SCHEMA_FILE = 'schema.json'
+
+# format of the columnar directory, bumped when it changes
+COLUMNAR_VERSION = 1
+
+# periods of the grouped statistics
+PERIODS = ['day', 'week', 'month', 'year']
 
 def main():
+    # converting files to their columnar binary form
+    if sys.argv[1:2] == ['convert']:
+        return convert_main(sys.argv[2:])
+
     # inputs
+    parser = argparse.ArgumentParser(description = 'min, max, average and median of columns of whitespace separated files')
+    parser.add_argument('columns', type = column_list,
+                        help = 'columns to read (0 is the first), e.g. 10 or 5,10,17 or 5-9')
+    parser.add_argument('files', nargs = '*',
+                        help = '.txt files, .gz/.bz2/.xz compressed ones, or glob patterns (default: stdin); '
+                               'a file converted with '
+                               f'"compute_stats2.py convert" is read from its {COLUMNAR_SUFFIX} directory')
+    parser.add_argument('-m', '--median', choices = ['exact', 'approx'], default = None,
+                        help = 'exact median from a spill file (the default), or approximate median '
+                               f'within {SKETCH_ACCURACY:.0%} from a fixed size sketch')
+    parser.add_argument('-p', '--parser', choices = ['csv', 'fixed'], default = 'csv',
+                        help = 'split every row on whitespace, or cut the columns out of a fixed '
+                               'width file by the byte offsets of its first line (much faster)')
+    parser.add_argument('-j', '--jobs', type = int, default = 0,
+                        help = 'processes reading files at once (default 0: all cores); with approximate '
+                               'medians every file is also split into byte ranges read in parallel')
+    parser.add_argument('-s', '--sentinels', action = 'append', default = [],
+                        help = 'missing value markers to mask, [COL:]VALUE,... for one column or all; '
+                               'write -s=-9999,-99 for negative values, -s= for none '
+                               f'(default {",".join(f"{value:g}" for value in SENTINELS)})')
+    parser.add_argument('-r', '--range', action = 'append', default = [], dest = 'ranges',
+                        help = 'valid values, [COL:]LO:HI for one column or all, either end may be '
+                               f'empty (default {ABSOLUTE_ZERO}:)')
+    parser.add_argument('-g', '--group', choices = PERIODS, default = None,
+                        help = 'statistics of every day, week, month or year instead of the whole file')
+    parser.add_argument('-w', '--window', type = int, default = None,
+                        help = 'statistics of the last <window> days, for every date of the file')
+    parser.add_argument('--date-col', type = int, default = DATE_COLUMN,
+                        help = f'column of the YYYYMMDD dates (default {DATE_COLUMN})')
+    parser.add_argument('-c', '--cache', action = 'store_true', dest = 'cache',
+                        help = f'keep the summaries of each file in <file>{CACHE_SUFFIX} and only read '
+                               'rows appended since the last run (approximate medians)')
+    args = parser.parse_args()
 
-    col_num = int(sys.argv[1])
+    if args.cache:
+        if args.median == 'exact' or not args.files or args.group or args.window:
+            parser.error('--cache needs files and approximate medians, without --group or --window')
+        if any(is_compressed(file) for file in expand_files(args.files)):
+            parser.error('--cache cannot read compressed files')
+        args.median = 'approx'
+    elif args.median is None:
+        args.median = 'exact'
 
-    # this code will run if a .txt file is specified
-    if len(sys.argv) == 3:
-        file = sys.argv[2]
+    if args.window is not None and args.window < 1:
+        parser.error('--window must be at least one day')
 
-        array = []
+    try:
+        masks = column_masks(args.columns, args.sentinels, args.ranges)
+    except ValueError as e:
+        parser.error(str(e))
 
-        with open(file, "r") as f:
-            reader = csv.reader(f, delimiter = " ", skipinitialspace = True)
-            for row in reader:
-                array.append(float(row[col_num]))
+    # grouped and rolling statistics
+    if args.group or args.window:
+        files = expand_files(args.files) if args.files else ['-']
+        try:
+            if args.files:
+                series = files_series(files, args.columns, args.parser, args.group, args.window,
+                                      args.jobs or None, masks, args.date_col)
+            else:
+                series = [file_series('-', args.columns, args.parser, args.group, args.window, masks,
+                                      args.date_col)]
+        # rolling windows refuse rows out of date order
+        except ValueError as e:
+            parser.error(str(e))
+        print_series(files, args.columns, series, args.group, args.window)
+        return
+
+    # this code will run if .txt files are specified
+    if args.files:
+        files = expand_files(args.files)
+        results = files_stats(files, args.columns, args.parser, args.median, args.jobs or None, masks, args.cache)
 
     # this code will run if a .txt file is NOT specified; looks for stdin
     else:
-        file = sys.stdin
+        files = ['-']
+        results = [file_stats('-', args.columns, args.parser, args.median, masks)]
+
+    # printing out statistics, one line for one column of one file
+    if len(files) == 1 and len(args.columns) == 1:
+        print_stats(results[0][0])
+    else:
+        print_table(files, args.columns, results)
+
+def print_stats(column):
+    """ Prints the statistics and counts of one Column """
+    results = column.stats
+    if results is None:
+        print("no values", end = " ")
+    else:
+        print("min:", results[0], "max:", results[1], "average:", results[2], "median:", results[3], end = " ")
+    print("count:", column.count, "masked:", column.sentinels + column.out_of_range)
 
-        array = []
+def print_table(files, col_nums, results):
+    """ Prints one row of statistics and counts per column of every file """
+    width = max(len(file) for file in files + ["file"])
+    print(f"{'file':<{width}} {'col':>4} {'min':>12} {'max':>12} {'average':>12} {'median':>12}"
+          f" {'count':>10} {'sentinels':>10} {'range':>10}")
+    for file, file_results in zip(files, results):
+        for col_num, column in zip(col_nums, file_results):
+            values = " ".join(f"{value:>12.6g}" for value in column.stats) if column.stats is not None \
+                     else " ".join(f"{'-':>12}" for i in range(4))
+            print(f"{file:<{width}} {col_num:>4} {values}"
+                  f" {column.count:>10} {column.sentinels:>10} {column.out_of_range:>10}")
 
-        reader = csv.reader(file, delimiter = " ", skipinitialspace = True)
-        for row in reader:
-            array.append(float(row[col_num]))
+def print_series(files, col_nums, series, period = None, window = None):
+    """ Prints one row per period or rolling window of every column of
+        every file """
+    width = max(len(file) for file in files + ["file"])
+    print(f"{'file':<{width}} {'col':>4} {'series':>7} {'date':>9} {'count':>8} {'min':>12} {'max':>12} {'mean':>12}")
+    for file, file_series in zip(files, series):
+        for kind, name in [('period', period), ('window', f'{window}d')]:
+            for col_num, rows in zip(col_nums, file_series.get(kind, [])):
+                for date, count, low, high, mean in rows:
+                    values = " ".join(f"{value:>12.6g}" for value in (low, high, mean)) if count \
+                             else " ".join(f"{'-':>12}" for i in range(3))
+                    print(f"{file:<{width}} {col_num:>4} {name:>7} {date:>9} {count:>8} {values}")
 
-    # only keeping reasonable values (-273.15 is absolute zero)
-    array = [i for i in array if i >= -273.15]
+def column_list(text):
+    """ Parses column numbers like 10, 5,10,17 or 5-9 """
+    col_nums = []
+    for part in text.split(","):
+        first, dash, last = part.partition("-")
+        col_nums.extend(range(int(first), int(last) + 1) if dash else [int(first)])
+    return col_nums
 
-    # sort the array
-    array.sort()
+class ColumnMask:
+    """ Missing value markers and valid range [lo, hi] of one column """
+    __slots__ = ('sentinels', 'lo', 'hi')
 
-    # compute statisitics
-    results = compute_stats(array)
+    def __init__(self, sentinels = SENTINELS, lo = ABSOLUTE_ZERO, hi = math.inf):
+        self.sentinels = tuple(sentinels)
+        self.lo = lo
+        self.hi = hi
 
-    # printing out statistics
-    print("min:", results[0], "max:", results[1], "average:", results[2], "median:", results[3])
+    def __repr__(self):
+        return f"ColumnMask({self.sentinels}, {self.lo}, {self.hi})"
+
+    def split(self, values):
+        """ Returns boolean arrays of the sentinel values and of the other
+            values outside the valid range """
+        sentinel = np.zeros(len(values), dtype = bool)
+        for value in self.sentinels:
+            sentinel |= values == value
+        # NaN compares False, so it is out of range
+        out_of_range = ~sentinel & ~((values >= self.lo) & (values <= self.hi))
+        return sentinel, out_of_range
+
+def column_masks(col_nums, sentinel_specs = (), range_specs = ()):
+    """ Returns a ColumnMask for each of col_nums from [COL:]VALUE,... and
+        [COL:]LO:HI specs; specs without a column apply to every column,
+        and later specs win """
+    sentinels = {col_num: SENTINELS for col_num in col_nums}
+    ranges = {col_num: (ABSOLUTE_ZERO, math.inf) for col_num in col_nums}
+
+    for spec in sentinel_specs:
+        col, colon, values = spec.rpartition(":")
+        values = tuple(float(value) for value in values.split(",") if value)
+        for col_num in column_list(col) if colon else col_nums:
+            sentinels[col_num] = values
+
+    for spec in range_specs:
+        parts = spec.split(":")
+        if len(parts) not in (2, 3):
+            raise ValueError(f"range {spec!r} is not [COL:]LO:HI")
+        lo = float(parts[-2]) if parts[-2] else -math.inf
+        hi = float(parts[-1]) if parts[-1] else math.inf
+        for col_num in column_list(parts[0]) if len(parts) == 3 else col_nums:
+            ranges[col_num] = (lo, hi)
+
+    return [ColumnMask(sentinels[col_num], *ranges[col_num]) for col_num in col_nums]
+
+def expand_files(patterns):
+    """ Expands glob patterns, keeping names that match nothing so that
+        opening them reports the missing file """
+    files = []
+    for pattern in patterns:
+        files.extend(sorted(glob.glob(pattern)) or [pattern])
+    return files
+
+def file_stats(file, col_nums, parser = 'csv', median = 'exact', masks = None, cache = False):
+    """ Returns a Column for every column of one file, or of stdin if file
+        is '-', read in a single pass; masks defaults to column_masks()
+        and cache reads through cached_file_stats() """
+    if masks is None:
+        masks = column_masks(col_nums)
+
+    # the columnar form needs no parsing, nor a cache
+    columnar = columnar_path(file) if file != '-' else None
+    if columnar is not None:
+        return stream_column_stats(read_columnar(columnar, col_nums), masks, median)
+
+    if cache:
+        return cached_file_stats(file, col_nums, parser, masks)
+
+    with open_input(file) as f:
+        return stream_column_stats(input_blocks(f, col_nums, parser), masks, median)
+
+def run_file_stats(task):
+    """ file_stats of one (file, col_nums, parser, median, masks, cache) task """
+    return file_stats(*task)
+
+def files_stats(files, col_nums, parser = 'csv', median = 'exact', processes = 1, masks = None, cache = False):
+    """ Returns file_stats of every file, reading up to processes files at
+        once (None for all cores); approximate medians without a cache are
+        read by split_files_stats() """
+    if median == 'approx' and not cache and (processes or os.cpu_count()) > 1:
+        return split_files_stats(files, col_nums, parser, processes, masks)
+
+    tasks = [(file, col_nums, parser, median, masks, cache) for file in files]
+    if processes == 1 or len(files) == 1:
+        return list(map(run_file_stats, tasks))
+
+    with multiprocessing.Pool(min(processes or os.cpu_count(), len(files))) as pool:
+        return pool.map(run_file_stats, tasks, chunksize = 1)
+
+def split_files_stats(files, col_nums, parser = 'csv', processes = None, masks = None, range_bytes = RANGE_BYTES):
+    """ Like files_stats with approximate medians, with every file split
+        into line_ranges() that up to processes (None for all cores) read
+        at once
+
+        Each range is reduced to ColumnStats by range_stats(); the partial
+        summaries of a file are then merged in file order. """
+    processes = processes or os.cpu_count()
+    if masks is None:
+        masks = column_masks(col_nums)
+
+    tasks = []
+    owners = []
+    for i, file in enumerate(files):
+        # the columnar form needs no parsing and a compressed file cannot be
+        # entered in the middle, so neither is split
+        if columnar_path(file) is not None or is_compressed(file):
+            ranges = [(None, None)]
+        else:
+            ranges = line_ranges(file, processes, range_bytes)
+        for start, stop in ranges:
+            tasks.append((file, start, stop, col_nums, parser, masks))
+            owners.append(i)
+
+    if processes == 1 or len(tasks) == 1:
+        partials = list(map(range_stats, tasks))
+    else:
+        with multiprocessing.Pool(min(processes, len(tasks))) as pool:
+            partials = pool.map(range_stats, tasks, chunksize = 1)
+
+    merged = [None] * len(files)
+    for i, columns in zip(owners, partials):
+        if merged[i] is None:
+            merged[i] = columns
+        else:
+            for column, other in zip(merged[i], columns):
+                column.merge(other)
+    return [[column.column() for column in columns] for columns in merged]
+
+def line_ranges(file, parts, range_bytes = RANGE_BYTES):
+    """ Splits a file into up to parts (start, stop) byte ranges of about
+        equal size, but at least range_bytes, that each start at the
+        beginning of a line """
+    size = os.path.getsize(file)
+    parts = max(1, min(parts, size // range_bytes))
+    bounds = [0]
+    with open(file, "rb") as f:
+        for i in range(1, parts):
+            # the next line starts after the newline at or past the target
+            f.seek(max(size * i // parts, bounds[-1]) - 1)
+            f.readline()
+            start = f.tell()
+            if start >= size:
+                break
+            if start > bounds[-1]:
+                bounds.append(start)
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def range_stats(task):
+    """ Returns the approximate median ColumnStats of the lines of one
+        (file, start, stop, col_nums, parser, masks) task, or of the whole
+        file, or its columnar form, if start is None """
+    file, start, stop, col_nums, parser, masks = task
+    columns = [ColumnStats('approx', mask) for mask in masks]
+    columnar = columnar_path(file) if start is None else None
+    if columnar is not None:
+        update_columns(columns, read_columnar(columnar, col_nums))
+    elif start is None:
+        with open_input(file) as f:
+            update_columns(columns, input_blocks(f, col_nums, parser))
+    else:
+        with open(file, "rb") as f:
+            update_columns(columns, range_blocks(f, start, stop, col_nums, parser))
+    return columns
+
+def range_blocks(file, start, stop, col_nums, parser = 'csv'):
+    """ Yields the blocks of read_columns() or read_fixed_columns() for the
+        lines in the bytes [start, stop) of a binary file """
+    return input_blocks(io.BufferedReader(ByteRange(file, start, stop)), col_nums, parser)
+
+def update_columns(columns, blocks):
+    """ Adds every block, a list with one float64 array per column, to
+        the ColumnStats of its columns """
+    for block in blocks:
+        for column, chunk in zip(columns, block):
+            column.update(chunk)
+
+def file_series(file, col_nums, parser = 'csv', period = None, window = None, masks = None,
+                date_col = DATE_COLUMN):
+    """ Returns {'period': ..., 'window': ...} with, for each of period
+        and window that is given, a list of series rows per column, read
+        in a single pass
+
+        A series row is (YYYYMMDD, count, min, max, mean); period rows
+        start at the first day of each day, week, month or year, and
+        window rows end on each date of the file. masks defaults to
+        column_masks(). """
+    if masks is None:
+        masks = column_masks(col_nums)
+
+    columnar = columnar_path(file) if file != '-' else None
+    if columnar is not None:
+        return stream_series(read_columnar(columnar, col_nums + [date_col]), masks, period, window)
+
+    with open_input(file) as f:
+        return stream_series(input_blocks(f, col_nums + [date_col], parser), masks, period, window)
+
+@contextlib.contextmanager
+def open_input(file):
+    """ Opens a file for reading bytes: stdin if file is '-' (left open),
+        and decompressed as it is read if its suffix is in COMPRESSED """
+    if file == '-':
+        yield sys.stdin.buffer
+        return
+    with COMPRESSED.get(os.path.splitext(file)[1], open)(file, "rb") as f:
+        yield f
+
+def is_compressed(file):
+    """ True if file is read through a decompressor, so its byte offsets
+        are not those of the text """
+    return os.path.splitext(file)[1] in COMPRESSED
+
+def input_blocks(file, col_nums, parser = 'csv'):
+    """ Yields lists with the values of each of col_nums as float64 arrays
+        from a binary file of open_input(), parsed by read_columns() or,
+        for parser 'fixed', read_fixed_columns() """
+    if parser == 'fixed':
+        yield from read_fixed_columns(file, col_nums)
+        return
+    text = io.TextIOWrapper(file)
+    try:
+        yield from read_columns(text, col_nums)
+    finally:
+        # closing the text wrapper would close file, stdin included; a
+        # generator left behind by an error may only be closed after file
+        if not text.closed:
+            text.detach()
+
+def cached_file_stats(file, col_nums, parser = 'csv', masks = None, cache_file = None):
+    """ Like file_stats with approximate medians, but only reads the part of
+        the file appended since the last run
+
+        The mergeable summaries of every column (counts, RunningStats and
+        QuantileSketch) are kept in a sidecar cache, file + CACHE_SUFFIX by
+        default, with the length of the parsed prefix and a hash of it.
+        If the file still starts with that prefix, only the rows after it
+        are parsed and merged in; otherwise the whole file is read again.
+        The prefix is hashed whole on every run, an edit anywhere in it
+        must be caught, but hashing is far cheaper than parsing. A last
+        line without a newline is left for the next run. """
+    if masks is None:
+        masks = column_masks(col_nums)
+    if cache_file is None:
+        cache_file = file + CACHE_SUFFIX
+    key = repr((col_nums, masks))
+    entries = load_cache(cache_file)
+    entry = entries.get(key)
+
+    with open(file, "rb") as f:
+        end = complete_lines_end(f)
+        offset = min(entry['offset'], end) if entry is not None else 0
+        digest = hash_bytes(f, 0, offset)
+        if entry is not None and entry['offset'] <= end and digest.hexdigest() == entry['hash']:
+            start = entry['offset']
+            columns = [ColumnStats.from_dict(column, mask) for column, mask in zip(entry['columns'], masks)]
+        else:
+            start = 0
+            columns = [ColumnStats('approx', mask) for mask in masks]
+
+        # parse only [start, end)
+        update_columns(columns, range_blocks(f, start, end, col_nums, parser))
+
+        # the hash of the prefix only needs the bytes after it
+        hash_bytes(f, offset, end, digest)
+        entries[key] = {'offset': end, 'hash': digest.hexdigest(),
+                        'columns': [column.to_dict() for column in columns]}
+
+    save_cache(cache_file, entries)
+    return [column.column() for column in columns]
+
+def load_cache(cache_file):
+    """ Returns the entries of a sidecar cache, or {} if there is none or
+        it cannot be read """
+    try:
+        with open(cache_file, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict) or cache.get('version') != CACHE_VERSION:
+        return {}
+    return cache['entries']
+
+def save_cache(cache_file, entries):
+    """ Writes the entries of a sidecar cache, replacing the old one only
+        once the new one is complete """
+    temp_file = cache_file + '.tmp'
+    with open(temp_file, "w") as f:
+        json.dump({'version': CACHE_VERSION, 'entries': entries}, f)
+    os.replace(temp_file, cache_file)
+
+def complete_lines_end(file):
+    """ Returns the offset just past the last newline of a binary file, or
+        0 if it has none """
+    end = file.seek(0, os.SEEK_END)
+    while end > 0:
+        start = max(0, end - TAIL_BYTES)
+        file.seek(start)
+        newline = file.read(end - start).rfind(b'\n')
+        if newline >= 0:
+            return start + newline + 1
+        end = start
+    return 0
+
+def hash_bytes(file, start, stop, digest = None):
+    """ Returns a sha256 digest of the bytes [start, stop) of a binary
+        file, or digest updated with them """
+    if digest is None:
+        digest = hashlib.sha256()
+    file.seek(start)
+    while start < stop:
+        block = file.read(min(BLOCK_SIZE, stop - start))
+        if not block:
+            break
+        digest.update(block)
+        start += len(block)
+    return digest
+
+class ByteRange(io.RawIOBase):
+    """ Read only stream of the bytes [start, stop) of a binary file """
+
+    def __init__(self, file, start, stop):
+        file.seek(start)
+        self.file = file
+        self.left = stop - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        with memoryview(buffer) as view:
+            read = self.file.readinto(view[:min(len(view), self.left)])
+        self.left -= read
+        return read
+
+def run_file_series(task):
+    """ file_series of one (file, col_nums, parser, period, window, masks,
+        date_col) task """
+    return file_series(*task)
+
+def files_series(files, col_nums, parser = 'csv', period = None, window = None, processes = 1, masks = None,
+                 date_col = DATE_COLUMN):
+    """ Returns file_series of every file, reading up to processes files at
+        once (None for all cores) """
+    tasks = [(file, col_nums, parser, period, window, masks, date_col) for file in files]
+    if processes == 1 or len(files) == 1:
+        return list(map(run_file_series, tasks))
+
+    with multiprocessing.Pool(min(processes or os.cpu_count(), len(files))) as pool:
+        return pool.map(run_file_series, tasks, chunksize = 1)
+
+def compute_stats(array, quantiles = ()):
+    """ Takes in an array in any order and returns minimum, maximum,
+        average, and median values, followed by the value of each of
+        quantiles (0 <= q <= 1, e.g. 0.9 for p90)
+
+        The median and quantiles are selected by partitioning a float64
+        copy of the array, see quantile_values(). A 2D numpy array is taken
+        as one column per array column, and a list with the statistics of
+        each column is returned. """
+    if isinstance(array, np.ndarray) and array.ndim == 2:
+        return [compute_stats(column, quantiles) for column in array.T]
 
-def compute_stats(array):
-    """ Takes in a sorted array and returns minimum, maximum, average,
-        and median values """
     # calculate statistics
     if len(array):
-        o_min    = min(array)
-        o_max    = max(array)
-        o_avg    = stats.mean(array)
-        o_median = stats.median(array)
+        values = np.asarray(array)
+        if values.dtype.kind not in 'biuf':
+            raise TypeError(f'can not compute statistics of {values.dtype} values')
+        values = values.astype(np.float64)
+
+        o_min    = float(values.min())
+        o_max    = float(values.max())
+        o_avg    = float(values.mean())
+        o_median, *o_quantiles = quantile_values(values, (0.5, *quantiles))
+
+        return(o_min, o_max, o_avg, o_median, *o_quantiles)
+
+    else:
+        return None
+
+def quantile_values(values, quantiles):
+    """ Returns the value of each of quantiles (0 <= q <= 1) of a non empty
+        float64 array, interpolated between the two nearest values like
+        numpy.quantile, so 0.5 is the median of statistics.median
+
+        One np.partition (introselect) puts every needed rank in place in
+        O(n) instead of sorting the whole array. """
+    positions = []
+    for q in quantiles:
+        if not 0 <= q <= 1:
+            raise ValueError(f'quantile {q} is not between 0 and 1')
+        positions.append(q * (len(values) - 1))
+
+    ranks = sorted({math.floor(p) for p in positions} | {math.ceil(p) for p in positions})
+    selected = np.partition(values, ranks)
+    results = []
+    for p in positions:
+        fraction = p - math.floor(p)
+        lo, hi = float(selected[math.floor(p)]), float(selected[math.ceil(p)])
+        results.append(lo * (1 - fraction) + hi * fraction if fraction else lo)
+    return results
+
+def read_columns(file, col_nums, size = CHUNK_SIZE):
+    """ Yields lists with the values of each of col_nums as float64
+        arrays, for up to size rows of a whitespace separated file at a
+        time """
+    reader = csv.reader(file, delimiter = " ", skipinitialspace = True)
+    rows = []
+    for row in reader:
+        rows.append([float(row[col_num]) for col_num in col_nums])
+        if len(rows) == size:
+            yield list(np.array(rows, dtype = np.float64).T)
+            rows = []
+    if rows:
+        yield list(np.array(rows, dtype = np.float64).T)
+
+def field_offsets(line):
+    """ Returns the (start, stop) byte offsets of every field of a fixed
+        width line; a field starts where the previous one stops, so it
+        keeps its padding """
+    offsets = []
+    start = 0
+    for match in re.finditer(rb'\S+', line):
+        offsets.append((start, match.end()))
+        start = match.end()
+    return offsets
+
+def line_blocks(file, block_size = BLOCK_SIZE):
+    """ Yields uint8 arrays of whole lines, read from a binary file a block
+        at a time into one reused buffer; each array is only valid until
+        the next one is requested """
+    buffer = bytearray(block_size)
+    filled = 0
+    eof = False
+    while not eof:
+        # fill the buffer, pipes may return less than asked for
+        with memoryview(buffer) as view:
+            while filled < len(buffer):
+                read = file.readinto(view[filled:])
+                if not read:
+                    eof = True
+                    break
+                filled += read
+
+        # the last line may have no newline
+        if eof and filled and buffer[filled - 1] != 10:
+            if filled == len(buffer):
+                buffer = buffer + bytes(1)
+            buffer[filled] = 10
+            filled += 1
+
+        end = buffer.rfind(b'\n', 0, filled) + 1
+
+        # a line longer than the buffer: read more of it first
+        if not end and not eof:
+            buffer = buffer + bytes(len(buffer))
+            continue
+
+        if end:
+            yield np.frombuffer(buffer, dtype = np.uint8, count = end)
 
-        return(o_min, o_max, o_avg, o_median)
+        # move the partial last line to the front
+        buffer[:filled - end] = buffer[end:filled]
+        filled -= end
 
+def fixed_chars(buffer, offsets):
+    """ Returns, for every (start, stop) of offsets, a 2D uint8 array of
+        those bytes of every line of a uint8 array of whole lines """
+    newline = buffer == 10 # '\n'
+    record = int(newline.argmax()) + 1
+    stop = max(stop for start, stop in offsets)
+
+    # all lines the same length: one newline at the end of every record
+    if record > stop and len(buffer) % record == 0 \
+       and np.count_nonzero(newline) == len(buffer) // record and newline[record - 1::record].all():
+        lines = buffer.reshape(-1, record)
+        fields = [lines[:, start:stop] for start, stop in offsets]
+
+    # otherwise gather every line's bytes, skipping blank lines
     else:
+        line_ends = np.flatnonzero(newline)
+        line_starts = np.concatenate(([0], line_ends[:-1] + 1))
+        lengths = line_ends - line_starts
+        line_starts, lengths = line_starts[lengths > 0], lengths[lengths > 0]
+        if (lengths < stop).any():
+            raise ValueError(f'line shorter than {stop} bytes')
+        fields = [buffer[line_starts[:, None] + np.arange(start, stop)] for start, stop in offsets]
+    return fields
+
+def fixed_fields(buffer, offsets):
+    """ Returns, for every (start, stop) of offsets, the numbers at those
+        bytes of every line of a uint8 array of whole lines, converted by
+        numpy in bulk """
+    # fixed width byte strings convert like float(), padding and all
+    return [np.ascontiguousarray(chars).view(f'S{chars.shape[1]}').ravel().astype(np.float64)
+            for chars in fixed_chars(buffer, offsets)]
+
+def convert_main(argv):
+    """ Converts fixed width text files to their columnar binary form """
+    parser = argparse.ArgumentParser(prog = 'compute_stats2.py convert',
+                                     description = 'write every column of fixed width files to a memory mappable '
+                                                   f'binary file, in <file>{COLUMNAR_SUFFIX}/')
+    parser.add_argument('files', nargs = '+', help = '.txt files, .gz/.bz2/.xz compressed ones, or glob patterns')
+    args = parser.parse_args(argv)
+
+    for file in expand_files(args.files):
+        directory = convert_file(file)
+        schema = read_schema(directory)
+        print(f"{file} -> {directory} ({schema['rows']} rows, {len(schema['columns'])} columns)")
+
+def token_dtype(token, width):
+    """ Returns the numpy dtype of a column from its value on the first
+        line: int64, float64 or a byte string of the field width """
+    for dtype, convert in [('<i8', int), ('<f8', float)]:
+        try:
+            convert(token)
+            return dtype
+        except ValueError:
+            pass
+    return f'S{width}'
+
+def convert_file(file, directory = None, block_size = BLOCK_SIZE):
+    """ Converts a fixed width text file, compressed or not, to one raw
+        binary file per column in directory (file + COLUMNAR_SUFFIX by
+        default) and returns the directory
+
+        Column types come from the first line, see token_dtype(), and an
+        int64 column becomes float64 once a later row is not an integer. A
+        SCHEMA_FILE with the types, row count and size and modification
+        time of the text file is written last, so a directory without one
+        is never read. """
+    if directory is None:
+        directory = file + COLUMNAR_SUFFIX
+    os.makedirs(directory, exist_ok = True)
+    schema_file = os.path.join(directory, SCHEMA_FILE)
+    if os.path.exists(schema_file):
+        os.remove(schema_file)
+
+    stat = os.stat(file)
+    dtypes = []
+    rows = 0
+    with open_input(file) as f, contextlib.ExitStack() as stack:
+        for block in line_blocks(f, block_size):
+            if not dtypes:
+                first_line = block[:int((block == 10).argmax())].tobytes()
+                offsets = field_offsets(first_line)
+                dtypes = [token_dtype(first_line[start:stop].strip(), stop - start) for start, stop in offsets]
+                outputs = [stack.enter_context(open(os.path.join(directory, f'col_{col_num}.bin'), "wb"))
+                           for col_num in range(len(offsets))]
+
+            for col_num, (chars, output) in enumerate(zip(fixed_chars(block, offsets), outputs)):
+                values = np.ascontiguousarray(chars).view(f'S{chars.shape[1]}').ravel()
+                if dtypes[col_num].startswith('S'):
+                    values = np.char.strip(values)
+                try:
+                    output.write(values.astype(dtypes[col_num]).tobytes())
+                except (ValueError, OverflowError):
+                    if dtypes[col_num] != '<i8':
+                        raise
+                    promote_column(output)
+                    dtypes[col_num] = '<f8'
+                    output.write(values.astype('<f8').tobytes())
+            rows += len(chars)
+
+    schema = {'version': COLUMNAR_VERSION, 'source_size': stat.st_size, 'source_mtime_ns': stat.st_mtime_ns,
+              'rows': rows, 'columns': dtypes}
+    with open(schema_file + '.tmp', "w") as f:
+        json.dump(schema, f)
+    os.replace(schema_file + '.tmp', schema_file)
+    return directory
+
+def promote_column(output):
+    """ Rewrites the int64 values written so far to an open column file as
+        float64 """
+    output.flush()
+    values = np.fromfile(output.name, dtype = '<i8')
+    output.seek(0)
+    output.truncate()
+    output.write(values.astype('<f8').tobytes())
+
+def read_schema(directory):
+    """ Returns the schema of a columnar directory, or None if it has no
+        complete one """
+    try:
+        with open(os.path.join(directory, SCHEMA_FILE), "r") as f:
+            schema = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return schema if schema.get('version') == COLUMNAR_VERSION else None
+
+def columnar_path(file):
+    """ Returns the columnar directory to read for file: file itself if it
+        is one, else file + COLUMNAR_SUFFIX if it was converted from the
+        file as it is now, else None """
+    if os.path.isdir(file):
+        return file if read_schema(file) is not None else None
+
+    directory = file + COLUMNAR_SUFFIX
+    schema = read_schema(directory)
+    if schema is None:
+        return None
+    try:
+        stat = os.stat(file)
+    except OSError:
+        return None
+    if (stat.st_size, stat.st_mtime_ns) != (schema['source_size'], schema['source_mtime_ns']):
         return None
+    return directory
+
+def load_columns(directory, col_nums):
+    """ Returns col_nums of a columnar directory as read only np.memmap
+        arrays, without parsing or copying anything """
+    schema = read_schema(directory)
+    if schema is None:
+        raise ValueError(f'{directory} has no {SCHEMA_FILE}')
+
+    columns = []
+    for col_num in col_nums:
+        dtype = np.dtype(schema['columns'][col_num])
+        # an empty file cannot be memory mapped
+        if not schema['rows']:
+            columns.append(np.empty(0, dtype = dtype))
+        else:
+            columns.append(np.memmap(os.path.join(directory, f'col_{col_num}.bin'), dtype = dtype, mode = 'r',
+                                     shape = (schema['rows'],)))
+    return columns
+
+def read_columnar(directory, col_nums, size = CHUNK_SIZE * 16):
+    """ Yields lists with the values of each of col_nums of a columnar
+        directory as float64 arrays, size rows at a time """
+    columns = load_columns(directory, col_nums)
+    rows = len(columns[0]) if columns else 0
+    for start in range(0, rows, size):
+        # float64 columns are views of the memory map, others are converted
+        yield [np.asarray(column[start:start + size], dtype = np.float64) for column in columns]
+
+def read_fixed_columns(file, col_nums, block_size = BLOCK_SIZE):
+    """ Yields lists with the values of each of col_nums of a fixed width
+        binary file as float64 arrays, parsing a block of lines at a time
+        from the byte offsets of the first line """
+    offsets = None
+    for block in line_blocks(file, block_size):
+        if offsets is None:
+            first_line = block[:int((block == 10).argmax())].tobytes()
+            fields = field_offsets(first_line)
+            offsets = [fields[col_num] for col_num in col_nums]
+        yield fixed_fields(block, offsets)
+
+def stream_column_stats(blocks, masks, median = 'exact'):
+    """ Takes in a stream of lists with one float64 array per column and
+        returns a list with a Column for every column, each filtered by its
+        ColumnMask, in one pass
+
+        Only one block of values is held in memory. The exact median spills
+        the values to a temporary file and selects from it; the approximate
+        median keeps a QuantileSketch instead. """
+    with contextlib.ExitStack() as stack:
+        columns = [stack.enter_context(ColumnStats(median, mask)) for mask in masks]
+        update_columns(columns, blocks)
+        return [column.column() for column in columns]
+
+def stream_series(blocks, masks, period = None, window = None):
+    """ Like stream_column_stats for grouped and rolling statistics, from
+        a stream of lists with one float64 array per column followed by
+        the YYYYMMDD dates; returns the series of file_series """
+    groups = [GroupedStats() for mask in masks] if period else None
+    windows = [RollingWindow(window) for mask in masks] if window else None
+    window_rows = [[] for mask in masks]
+
+    for block in blocks:
+        days = date_days(block[-1])
+        keys = period_starts(days, period) if period else None
+        ordinals = days.astype(np.int64)
+
+        for i, (mask, chunk) in enumerate(zip(masks, block[:-1])):
+            sentinel, out_of_range = mask.split(chunk)
+            keep = ~(sentinel | out_of_range)
+            if groups:
+                groups[i].update(keys[keep], chunk[keep])
+            if windows:
+                window_rows[i].extend(windows[i].update(ordinals, chunk, keep))
+
+    series = {}
+    if groups:
+        series['period'] = [group.rows() for group in groups]
+    if windows:
+        series['window'] = [rows + rolling.finish() for rows, rolling in zip(window_rows, windows)]
+    return series
+
+def date_days(dates):
+    """ Converts YYYYMMDD numbers to numpy datetime64 days """
+    dates = dates.astype(np.int64)
+    months = (dates // 10000 - 1970) * 12 + dates // 100 % 100 - 1
+    return months.astype('datetime64[M]').astype('datetime64[D]') + (dates % 100 - 1)
+
+def yyyymmdd(days):
+    """ Converts numpy datetime64 days to YYYYMMDD numbers """
+    months = days.astype('datetime64[M]')
+    year = months.astype('datetime64[Y]').astype(np.int64) + 1970
+    month = months.astype(np.int64) % 12 + 1
+    day = (days - months.astype('datetime64[D]')).astype(np.int64) + 1
+    return year * 10000 + month * 100 + day
+
+def period_starts(days, period):
+    """ Returns the first day of the day, week (from Monday), month or year
+        of every datetime64 day """
+    if period == 'week':
+        # 1970-01-01, day 0, was a Thursday
+        ordinals = days.astype(np.int64)
+        return (ordinals - (ordinals + 3) % 7).astype('datetime64[D]')
+    if period == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    if period == 'year':
+        return days.astype('datetime64[Y]').astype('datetime64[D]')
+    return days
+
+# statistics (or None) of one column, with its count of kept values and
+# of values masked as sentinels or out of range
+Column = collections.namedtuple('Column', ['stats', 'count', 'sentinels', 'out_of_range'])
+
+class ColumnStats:
+    """ RunningStats and a median of one column, filtered by an optional
+        ColumnMask; use it in a with block so that the spill file of an
+        exact median is removed """
+
+    def __init__(self, median = 'exact', mask = None):
+        self.running = RunningStats()
+        self.medians = ExternalMedian() if median == 'exact' else QuantileSketch()
+        self.mask = mask
+        self.sentinels = 0
+        self.out_of_range = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.medians.__exit__(*exc)
+
+    def update(self, chunk):
+        """ Adds the values of a float64 array that the mask keeps """
+        if self.mask is not None:
+            sentinel, out_of_range = self.mask.split(chunk)
+            self.sentinels += int(np.count_nonzero(sentinel))
+            self.out_of_range += int(np.count_nonzero(out_of_range))
+            chunk = chunk[~(sentinel | out_of_range)]
+        self.running.update(chunk)
+        self.medians.update(chunk)
+
+    def merge(self, other):
+        """ Adds the counts and summaries of another approximate median
+            ColumnStats of the same column, e.g. of another part of the
+            file read by another process """
+        self.sentinels += other.sentinels
+        self.out_of_range += other.out_of_range
+        self.running.merge(other.running)
+        self.medians.merge(other.medians)
+
+    def results(self):
+        """ Returns minimum, maximum, average and median values, or None if
+            there are no values """
+        if not self.running.count:
+            return None
+        return (self.running.min, self.running.max, self.running.mean, self.medians.median())
+
+    def column(self):
+        """ Returns the results and counts as a Column """
+        return Column(self.results(), self.running.count, self.sentinels, self.out_of_range)
+
+    def to_dict(self):
+        """ Returns the counts and summaries of an approximate median
+            ColumnStats as a JSON ready dict """
+        return {'sentinels': self.sentinels, 'out_of_range': self.out_of_range,
+                'running': self.running.to_dict(), 'sketch': self.medians.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data, mask = None):
+        """ Rebuilds an approximate median ColumnStats from to_dict() """
+        column = cls('approx', mask)
+        column.sentinels = data['sentinels']
+        column.out_of_range = data['out_of_range']
+        column.running = RunningStats.from_dict(data['running'])
+        column.medians = QuantileSketch.from_dict(data['sketch'])
+        return column
+
+class RunningStats:
+    """ Count, minimum, maximum, mean and sum of squared deviations of
+        a stream, updated one chunk at a time (Welford / Chan et al.) """
+    __slots__ = ('count', 'min', 'max', 'mean', 'm2')
+
+    def __init__(self):
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, chunk):
+        """ Adds a float64 array of values """
+        if not len(chunk):
+            return
+        other = RunningStats()
+        other.count = len(chunk)
+        other.min = float(chunk.min())
+        other.max = float(chunk.max())
+        other.mean = float(chunk.mean())
+        other.m2 = float(((chunk - other.mean) ** 2).sum())
+        self.merge(other)
+
+    def merge(self, other):
+        """ Adds the values summarised by another RunningStats """
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        # weighted so that neither mean loses precision to the other
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def to_dict(self):
+        """ Returns the summary as a JSON ready dict """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Rebuilds a RunningStats from to_dict() """
+        running = cls()
+        for name in cls.__slots__:
+            setattr(running, name, data[name])
+        return running
+
+    @property
+    def variance(self):
+        """ Sample variance, or 0.0 with fewer than two values """
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+class ExternalMedian:
+    """ Exact median of a stream too big for memory
+
+        update() appends each chunk to a temporary file. median() then
+        narrows down the middle value with histogram passes over the
+        file until few enough candidates are left to select in memory. """
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+    def update(self, chunk):
+        """ Spills a float64 array of values """
+        if not len(chunk):
+            return
+        self.file.write(chunk.astype(np.float64).tobytes())
+        self.count += len(chunk)
+        self.min = min(self.min, float(chunk.min()))
+        self.max = max(self.max, float(chunk.max()))
+
+    def _chunks(self):
+        """ Reads the spilled values back one chunk at a time """
+        self.file.seek(0)
+        while True:
+            chunk = np.fromfile(self.file, dtype = np.float64, count = CHUNK_SIZE)
+            if not len(chunk):
+                return
+            yield chunk
+
+    def select(self, rank):
+        """ Returns the value at position rank (0 is the smallest) """
+        # candidates are the values in [lo, hi], or [lo, hi) if not closed
+        lo, hi, closed = self.min, self.max, True
+        count = self.count
+
+        while count > SELECT_MEMORY:
+            edges = np.linspace(lo, hi, SELECT_BINS + 1)
+            counts = np.zeros(SELECT_BINS, dtype = np.int64)
+            cand_min, cand_max = math.inf, -math.inf
+            for chunk in self._chunks():
+                chunk = chunk[(chunk >= lo) & ((chunk < hi) | (closed & (chunk == hi)))]
+                if len(chunk):
+                    counts += np.histogram(chunk, bins = edges)[0]
+                    cand_min = min(cand_min, float(chunk.min()))
+                    cand_max = max(cand_max, float(chunk.max()))
+
+            # all candidates are equal
+            if cand_min == cand_max:
+                return cand_min
+
+            # the bin holding rank; only the last bin includes its right edge
+            below = np.cumsum(counts)
+            b = int(np.searchsorted(below, rank, side = 'right'))
+            rank -= int(below[b - 1]) if b else 0
+            count = int(counts[b])
+            lo, hi, closed = edges[b], edges[b + 1], closed and b == SELECT_BINS - 1
+
+        values = [chunk[(chunk >= lo) & ((chunk < hi) | (closed & (chunk == hi)))]
+                  for chunk in self._chunks()]
+        return float(np.partition(np.concatenate(values), rank)[rank])
+
+    def median(self):
+        """ Returns the median, the mean of the middle two values if the
+            count is even, like statistics.median """
+        middle = self.count // 2
+        if self.count % 2:
+            return self.select(middle)
+        return (self.select(middle - 1) + self.select(middle)) / 2
+
+class QuantileSketch:
+    """ Approximate quantiles of a stream in bounded memory
+
+        Values are counted in logarithmic buckets (as in DDSketch), so
+        every quantile is returned within SKETCH_ACCURACY of its true
+        value relative to its size. Memory grows with the log of the
+        value range, not with the count, and sketches can be merged. """
+
+    def __init__(self, accuracy = SKETCH_ACCURACY):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def _add_keys(self, store, values):
+        """ Counts values (all > 0) into their buckets of store """
+        keys = np.ceil(np.log(values) / self.log_gamma).astype(np.int64)
+        for key, n in zip(*np.unique(keys, return_counts = True)):
+            store[int(key)] = store.get(int(key), 0) + int(n)
+
+    def update(self, chunk):
+        """ Adds a float64 array of values """
+        self._add_keys(self.positive, chunk[chunk > 0])
+        self._add_keys(self.negative, -chunk[chunk < 0])
+        self.zeros += int((chunk == 0).sum())
+        self.count += len(chunk)
+
+    def merge(self, other):
+        """ Adds the values counted by another sketch of the same accuracy """
+        for store, other_store in [(self.positive, other.positive), (self.negative, other.negative)]:
+            for key, n in other_store.items():
+                store[key] = store.get(key, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def to_dict(self):
+        """ Returns the sketch as a JSON ready dict """
+        return {'accuracy': self.accuracy, 'zeros': self.zeros, 'count': self.count,
+                'positive': self.positive, 'negative': self.negative}
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Rebuilds a QuantileSketch from to_dict() """
+        sketch = cls(data['accuracy'])
+        sketch.zeros = data['zeros']
+        sketch.count = data['count']
+        # JSON object keys are strings
+        sketch.positive = {int(key): n for key, n in data['positive'].items()}
+        sketch.negative = {int(key): n for key, n in data['negative'].items()}
+        return sketch
+
+    def _value(self, key):
+        """ Middle of the bucket key (relative error at most accuracy) """
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        """ Returns the approximate q quantile (0 <= q <= 1) """
+        rank = q * (self.count - 1)
+        seen = 0
+        # most negative values first, then zeros, then positive values
+        for key in sorted(self.negative, reverse = True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive))
+
+    def median(self):
+        """ Returns the approximate median """
+        return self.quantile(0.5)
+
+class GroupedStats:
+    """ RunningStats of one column for every period, updated a chunk at a
+        time with one numpy reduction per statistic """
+
+    def __init__(self):
+        self.groups = {}
+
+    def update(self, keys, values):
+        """ Adds float64 values to the periods of their datetime64 keys """
+        if not len(values):
+            return
+        order = np.argsort(keys, kind = 'stable')
+        keys, values = keys[order], values[order]
+
+        # reduce every run of equal keys
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        counts = np.diff(np.append(starts, len(keys)))
+        means = np.add.reduceat(values, starts) / counts
+        m2s = np.add.reduceat((values - np.repeat(means, counts)) ** 2, starts)
+        mins = np.minimum.reduceat(values, starts)
+        maxs = np.maximum.reduceat(values, starts)
+
+        for key, count, mean, m2, low, high in zip(keys[starts].tolist(), counts.tolist(), means.tolist(),
+                                                   m2s.tolist(), mins.tolist(), maxs.tolist()):
+            other = RunningStats()
+            other.count, other.mean, other.m2, other.min, other.max = count, mean, m2, low, high
+            self.groups.setdefault(key, RunningStats()).merge(other)
+
+    def rows(self):
+        """ Returns a (YYYYMMDD, count, min, max, mean) row per period in
+            date order """
+        keys = sorted(self.groups)
+        dates = yyyymmdd(np.array(keys, dtype = 'datetime64[D]')).tolist()
+        return [(date, self.groups[key].count, self.groups[key].min, self.groups[key].max, self.groups[key].mean)
+                for date, key in zip(dates, keys)]
+
+class RollingWindow:
+    """ Count, minimum, maximum and mean of the values of the last days
+        days, for rows in date order
+
+        Each value is added and dropped once: a running sum gives the mean
+        and monotonic deques give the minimum and maximum, so a row costs
+        O(1) amortized whatever the window size. """
+
+    def __init__(self, days):
+        self.days = days
+        self.values = collections.deque() # (day, value) in the window
+        self.mins = collections.deque() # increasing values, oldest first
+        self.maxs = collections.deque() # decreasing values, oldest first
+        self.total = 0.0
+        self.day = None
+
+    def add(self, day, value):
+        """ Adds a value of a day """
+        self.values.append((day, value))
+        self.total += value
+        while self.mins and self.mins[-1][1] >= value:
+            self.mins.pop()
+        self.mins.append((day, value))
+        while self.maxs and self.maxs[-1][1] <= value:
+            self.maxs.pop()
+        self.maxs.append((day, value))
+
+    def advance(self, day):
+        """ Moves the window to end on day, dropping older values """
+        first = day - self.days + 1
+        while self.values and self.values[0][0] < first:
+            self.total -= self.values.popleft()[1]
+        while self.mins and self.mins[0][0] < first:
+            self.mins.popleft()
+        while self.maxs and self.maxs[0][0] < first:
+            self.maxs.popleft()
+        # restart the sum rather than carry rounding errors along
+        if not self.values:
+            self.total = 0.0
+        self.day = day
+
+    def row(self):
+        """ Returns (YYYYMMDD, count, min, max, mean) of the window """
+        date = int(yyyymmdd(np.array([self.day], dtype = 'datetime64[D]'))[0])
+        if not self.values:
+            return (date, 0, None, None, None)
+        return (date, len(self.values), self.mins[0][1], self.maxs[0][1], self.total / len(self.values))
+
+    def update(self, days, values, keep):
+        """ Adds a chunk of rows, given as day numbers, float64 values and
+            a mask of the values to keep, and returns the rows of the
+            windows ending on each day finished by the chunk """
+        rows = []
+        for day, value, kept in zip(days.tolist(), values.tolist(), keep.tolist()):
+            if day != self.day:
+                if self.day is not None:
+                    if day < self.day:
+                        raise ValueError("rolling windows need the rows in date order")
+                    rows.append(self.row())
+                self.advance(day)
+            if kept:
+                self.add(day, value)
+        return rows
+
+    def finish(self):
+        """ Returns the row of the window ending on the last day, if any """
+        return [self.row()] if self.day is not None else []
 
 if __name__ == '__main__':
     main()
@@ -1,5 +1,17 @@
 # import packages
+import bz2
+import gzip
+import io
+import lzma
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
 import unittest
+from unittest import mock
+import numpy as np
 import compute_stats2
 
 # reminder: when running in command line type: python3 -m unittest test_compute_stats2
@@ -11,14 +23,16 @@ class TestComputeStats(unittest.TestCase):
         list = [1.1, 1.2, 1.3, 1.4, 1.5, 1.6]
         results = compute_stats2.compute_stats(list)
         # using assertAlmostEqual for floats
-        self.assertAlmostEqual(results, (1.1, 1.6, 1.35, 1.35))
+        for expected, actual in zip((1.1, 1.6, 1.35, 1.35), results):
+            self.assertAlmostEqual(expected, actual)
 
     # testing list with an odd number of elements
     def test_odd_number_list(self):
         list = [2.1 , 2.2, 2.3, 2.4, 2.5]
         results = compute_stats2.compute_stats(list)
         # using assertAlmostEqual for floats
-        self.assertAlmostEqual(results, (2.1, 2.5, 2.3, 2.3))
+        for expected, actual in zip((2.1, 2.5, 2.3, 2.3), results):
+            self.assertAlmostEqual(expected, actual)
 
     # testing an empty list
     def test_empty_list(self):
@@ -30,11 +44,438 @@ class TestComputeStats(unittest.TestCase):
     def test_single_element_list(self):
         list = [1.1]
         results = compute_stats2.compute_stats(list)
-        self.assertAlmostEqual(results, (1.1, 1.1, 1.1, 1.1))
+        for expected, actual in zip((1.1, 1.1, 1.1, 1.1), results):
+            self.assertAlmostEqual(expected, actual)
 
     # testing a list of strings
     def test_string_list(self):
         with self.assertRaises(TypeError):
-            # should get a TypeError on the mean() call of the function
+            # should get a TypeError for values that are not numbers
             list = ["Paul", "George", "John", "Ringo"]
             compute_stats2.compute_stats(list)
+
+    # the order of the values does not matter
+    def test_unsorted_list(self):
+        list = [2.5, 2.1, 2.4, 2.2, 2.3, 1.9]
+        self.assertEqual(compute_stats2.compute_stats(sorted(list)), compute_stats2.compute_stats(list))
+        self.assertEqual(statistics.median(list), compute_stats2.compute_stats(list)[3])
+
+    # quantiles are interpolated like numpy.quantile
+    def test_quantiles(self):
+        rng = np.random.default_rng(7)
+        for n in [1, 2, 11, 1000]:
+            array = rng.normal(10, 5, n)
+            results = compute_stats2.compute_stats(array, (0.9, 0.99, 0, 1))
+            expected = np.quantile(array, [0.5, 0.9, 0.99, 0, 1])
+            for value, actual in zip(expected, results[3:]):
+                self.assertAlmostEqual(value, actual)
+        with self.assertRaises(ValueError):
+            compute_stats2.compute_stats([1.0, 2.0], (1.5,))
+
+class TestStreamStats(unittest.TestCase):
+
+    # streaming results match compute_stats, whatever the blocks
+    def test_stream_matches_compute_stats(self):
+        list = [2.1, 2.5, 2.3, 2.2, 2.4, 2.2]
+        blocks = [[np.array(list[:4])], [np.array(list[4:])]]
+        column, = compute_stats2.stream_column_stats(iter(blocks), compute_stats2.column_masks([0]))
+        self.assertEqual(6, column.count)
+        for expected, actual in zip(compute_stats2.compute_stats(list), column.stats):
+            self.assertAlmostEqual(expected, actual)
+
+    # an empty stream gives None like an empty list
+    def test_empty_stream(self):
+        masks = compute_stats2.column_masks([0])
+        self.assertIsNone(compute_stats2.stream_column_stats(iter([]), masks)[0].stats)
+        self.assertIsNone(compute_stats2.stream_column_stats(iter([]), masks, median = 'approx')[0].stats)
+
+    # merged chunks give the same mean and variance as one pass
+    def test_running_stats(self):
+        rng = random.Random(1)
+        values = [rng.gauss(10, 3) for i in range(1000)]
+        running = compute_stats2.RunningStats()
+        for start in range(0, 1000, 300):
+            running.update(np.array(values[start:start + 300]))
+        self.assertEqual(1000, running.count)
+        self.assertEqual(min(values), running.min)
+        self.assertEqual(max(values), running.max)
+        self.assertAlmostEqual(statistics.mean(values), running.mean)
+        self.assertAlmostEqual(statistics.variance(values), running.variance)
+
+    # the exact median narrows down through several passes over the spill file
+    def test_external_median(self):
+        rng = random.Random(2)
+        for count in [5001, 5000]:
+            # rounded values repeat
+            values = [round(rng.uniform(-50, 50), 1) for i in range(count)]
+            with mock.patch.object(compute_stats2, 'SELECT_MEMORY', 100), \
+                 mock.patch.object(compute_stats2, 'SELECT_BINS', 8):
+                with compute_stats2.ExternalMedian() as medians:
+                    for start in range(0, count, 700):
+                        medians.update(np.array(values[start:start + 700]))
+                    self.assertEqual(statistics.median(values), medians.median())
+
+    # one value repeated more often than fits in memory
+    def test_external_median_repeated_value(self):
+        with mock.patch.object(compute_stats2, 'SELECT_MEMORY', 10):
+            with compute_stats2.ExternalMedian() as medians:
+                medians.update(np.array([1.0] * 100 + [2.0] * 50))
+                self.assertEqual(1.0, medians.median())
+
+    # the approximate median is within the sketch accuracy
+    def test_quantile_sketch(self):
+        rng = random.Random(3)
+        values = [rng.uniform(-30, 40) for i in range(20000)]
+        sketch = compute_stats2.QuantileSketch()
+        sketch.update(np.array(values[:10000]))
+        other = compute_stats2.QuantileSketch()
+        other.update(np.array(values[10000:]))
+        sketch.merge(other)
+        for q in [0.1, 0.5, 0.9]:
+            exact = np.quantile(values, q)
+            self.assertLessEqual(abs(sketch.quantile(q) - exact), 0.011 * abs(exact) + 0.05)
+
+class TestFixedWidth(unittest.TestCase):
+
+    # fields keep their padding and start where the previous one stops
+    def test_field_offsets(self):
+        offsets = compute_stats2.field_offsets(b'94075 20180101  2.423   -0.8')
+        self.assertEqual([(0, 5), (5, 14), (14, 21), (21, 28)], offsets)
+
+    # every column of Data.txt parses the same as the csv reader
+    def test_fixed_matches_csv(self):
+        for col_num in [0, 1, 5, 10, 17, 25]:
+            with open("Data.txt", "rb") as f:
+                expected = np.concatenate([block[0] for block in compute_stats2.input_blocks(f, [col_num])])
+            with open("Data.txt", "rb") as f:
+                actual = np.concatenate([block[0] for block in compute_stats2.input_blocks(f, [col_num], 'fixed')])
+            self.assertEqual(expected.tolist(), actual.tolist())
+
+    # blocks smaller than a line, blank lines and no final newline
+    def test_fixed_blocks(self):
+        with open("Data.txt", "rb") as f:
+            data = f.read()
+        expected = np.concatenate([block[0] for block in compute_stats2.input_blocks(io.BytesIO(data), [10], 'fixed')])
+        for block_size in [7, 216, 217, 5000]:
+            for text in [data, data.rstrip(b"\n"), data.replace(b"\n", b"\n\n", 3)]:
+                blocks = compute_stats2.read_fixed_columns(io.BytesIO(text), [10], block_size)
+                self.assertEqual(expected.tolist(), np.concatenate([block[0] for block in blocks]).tolist())
+
+    # text columns raise ValueError like float()
+    def test_fixed_text_column(self):
+        with self.assertRaises(ValueError):
+            with open("Data.txt", "rb") as f:
+                list(compute_stats2.input_blocks(f, [11], 'fixed'))
+
+class TestManyColumns(unittest.TestCase):
+
+    # single columns, lists and ranges
+    def test_column_list(self):
+        self.assertEqual([10], compute_stats2.column_list("10"))
+        self.assertEqual([5, 10, 17], compute_stats2.column_list("5,10,17"))
+        self.assertEqual([5, 6, 7, 10], compute_stats2.column_list("5-7,10"))
+
+    # a 2D array gives the statistics of every column
+    def test_compute_stats_columns(self):
+        array = np.array([[1.1, 2.1], [1.3, 2.2], [1.2, 2.3]])
+        results = compute_stats2.compute_stats(array)
+        self.assertEqual(2, len(results))
+        for expected, actual in zip((1.1, 1.3, 1.2, 1.2), results[0]):
+            self.assertAlmostEqual(expected, actual)
+        for expected, actual in zip((2.1, 2.3, 2.2, 2.2), results[1]):
+            self.assertAlmostEqual(expected, actual)
+
+    # one scan of many columns matches one scan per column, with either parser
+    def test_file_stats(self):
+        col_nums = [1, 5, 10, 17, 26]
+        for parser in ["csv", "fixed"]:
+            results = compute_stats2.file_stats("Data.txt", col_nums, parser)
+            for col_num, column in zip(col_nums, results):
+                self.assertEqual(compute_stats2.file_stats("Data.txt", [col_num], "csv")[0], column)
+        # column 26 only holds -9999.0
+        self.assertEqual(compute_stats2.Column(None, 0, 365, 0), results[-1])
+
+    # files read by a process pool come back in order
+    def test_files_stats_parallel(self):
+        files = compute_stats2.expand_files(["../week_*/Data.txt", "Data.txt"])
+        self.assertEqual(["../week_1/Data.txt", "../week_2/Data.txt", "Data.txt"], files)
+        serial = compute_stats2.files_stats(files, [5, 10], "fixed", processes = 1)
+        parallel = compute_stats2.files_stats(files, [5, 10], "fixed", processes = 2)
+        self.assertEqual(serial, parallel)
+
+class TestMasks(unittest.TestCase):
+
+    # sentinels and values out of range are masked and counted separately
+    def test_column_mask(self):
+        mask = compute_stats2.ColumnMask((-9999.0, -99.0), -50, 50)
+        values = np.array([1.0, -99.0, -9999.0, 60.0, -50.0, np.nan, 50.0])
+        sentinel, out_of_range = mask.split(values)
+        self.assertEqual([False, True, True, False, False, False, False], sentinel.tolist())
+        self.assertEqual([False, False, False, True, False, True, False], out_of_range.tolist())
+
+    # specs for every column and for some columns, later ones win
+    def test_column_masks(self):
+        masks = compute_stats2.column_masks([5, 17, 18], ["17:", "-1,-2", "18:0"], ["0:", "5:-10:20", "17:1:"])
+        self.assertEqual(((-1.0, -2.0), -10.0, 20.0), (masks[0].sentinels, masks[0].lo, masks[0].hi))
+        self.assertEqual(((-1.0, -2.0), 1.0, math.inf), (masks[1].sentinels, masks[1].lo, masks[1].hi))
+        self.assertEqual(((0.0,), 0.0, math.inf), (masks[2].sentinels, masks[2].lo, masks[2].hi))
+        with self.assertRaises(ValueError):
+            compute_stats2.column_masks([5], [], ["1:2:3:4"])
+
+    # -99.000 in column 18 is masked instead of averaged in
+    def test_masked_counts(self):
+        for parser in ["csv", "fixed"]:
+            column = compute_stats2.file_stats("Data.txt", [18], parser)[0]
+            self.assertEqual((189, 176, 0), column[1:])
+            self.assertGreater(column.stats[0], 0)
+            masks = [compute_stats2.ColumnMask(sentinels = ())]
+            column = compute_stats2.file_stats("Data.txt", [18], parser, masks = masks)[0]
+            self.assertEqual((365, 0, 0), column[1:])
+            self.assertEqual(-99.0, column.stats[0])
+
+class TestSeries(unittest.TestCase):
+
+    # YYYYMMDD dates to days and back, and the first day of each period
+    def test_periods(self):
+        dates = np.array([20180101.0, 20180228.0, 20181231.0, 20200229.0])
+        days = compute_stats2.date_days(dates)
+        self.assertEqual(dates.astype(int).tolist(), compute_stats2.yyyymmdd(days).tolist())
+        starts = {period: compute_stats2.yyyymmdd(compute_stats2.period_starts(days, period)).tolist()
+                  for period in compute_stats2.PERIODS}
+        self.assertEqual([20180101, 20180228, 20181231, 20200229], starts["day"])
+        # Mondays
+        self.assertEqual([20180101, 20180226, 20181231, 20200224], starts["week"])
+        self.assertEqual([20180101, 20180201, 20181201, 20200201], starts["month"])
+        self.assertEqual([20180101, 20180101, 20180101, 20200101], starts["year"])
+
+    # monthly rows match numpy on each month of the file
+    def test_grouped_stats(self):
+        array = np.loadtxt("Data.txt", usecols = (1, 8))
+        array = array[array[:, 1] > -9999]
+        for parser in ["csv", "fixed"]:
+            rows = compute_stats2.file_series("Data.txt", [8], parser, period = "month")["period"][0]
+            self.assertEqual(12, len(rows))
+            for month, (date, count, low, high, mean) in enumerate(rows, 1):
+                values = array[array[:, 0] // 100 % 100 == month, 1]
+                self.assertEqual(20180001 + 100 * month, date)
+                self.assertEqual(len(values), count)
+                self.assertEqual((values.min(), values.max()), (low, high))
+                self.assertAlmostEqual(values.mean(), mean)
+
+    # rolling windows match a recomputation of every window
+    def test_rolling_window(self):
+        rng = random.Random(4)
+        days = sorted(rng.randrange(100) for i in range(300))
+        values = [rng.uniform(-10, 10) for day in days]
+        keep = [rng.random() > 0.1 for day in days]
+        window = compute_stats2.RollingWindow(7)
+        rows = []
+        for start in range(0, 300, 64):
+            rows += window.update(np.array(days[start:start + 64]), np.array(values[start:start + 64]),
+                                  np.array(keep[start:start + 64]))
+        rows += window.finish()
+
+        self.assertEqual(len(set(days)), len(rows))
+        for day, row in zip(sorted(set(days)), rows):
+            inside = [value for d, value, k in zip(days, values, keep) if day - 7 < d <= day and k]
+            self.assertEqual(len(inside), row[1])
+            if inside:
+                self.assertEqual((min(inside), max(inside)), row[2:4])
+                self.assertAlmostEqual(statistics.mean(inside), row[4])
+
+    # rows out of date order cannot be windowed
+    def test_rolling_window_order(self):
+        window = compute_stats2.RollingWindow(7)
+        with self.assertRaises(ValueError):
+            window.update(np.array([5, 3]), np.array([1.0, 2.0]), np.array([True, True]))
+
+        # and the command line reports them as a usage error
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, "Data.txt")
+            with open("Data.txt", "rb") as f:
+                lines = f.readlines()
+            with open(file, "wb") as f:
+                f.writelines(lines[1:3] + lines[:1])
+            with mock.patch.object(sys, "argv", ["compute_stats2.py", "10", file, "-w", "7", "-j", "1"]), \
+                 mock.patch.object(sys, "stderr", io.StringIO()) as stderr:
+                with self.assertRaises(SystemExit):
+                    compute_stats2.main()
+            self.assertIn("date order", stderr.getvalue())
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        with open("Data.txt", "rb") as f:
+            self.lines = f.readlines()
+        self.directory = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.directory.name, "Data.txt")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, lines, mode = "wb"):
+        with open(self.file, mode) as f:
+            f.writelines(lines)
+
+    # rows appended between runs are merged into the cached summaries
+    def test_appended_rows(self):
+        col_nums = [5, 10, 18]
+        for parser in ["csv", "fixed"]:
+            self.write(self.lines[:200])
+            compute_stats2.cached_file_stats(self.file, col_nums, parser)
+            self.write(self.lines[200:], "ab")
+            with mock.patch.object(compute_stats2, "ByteRange", wraps = compute_stats2.ByteRange) as byte_range:
+                cached = compute_stats2.cached_file_stats(self.file, col_nums, parser)
+            # only the appended rows are read
+            self.assertEqual(sum(len(line) for line in self.lines[:200]), byte_range.call_args[0][1])
+
+            full = compute_stats2.file_stats(self.file, col_nums, parser, "approx")
+            for expected, actual in zip(full, cached):
+                self.assertEqual(expected[1:], actual[1:])
+                self.assertEqual(expected.stats[0:2], actual.stats[0:2])
+                self.assertAlmostEqual(expected.stats[2], actual.stats[2])
+                self.assertEqual(expected.stats[3], actual.stats[3])
+            os.remove(self.file + compute_stats2.CACHE_SUFFIX)
+
+    # a rewritten file is read again from the start
+    def test_rewritten_file(self):
+        self.write(self.lines[:200])
+        compute_stats2.cached_file_stats(self.file, [10])
+        self.write(self.lines[100:])
+        cached = compute_stats2.cached_file_stats(self.file, [10])
+        self.assertEqual(compute_stats2.file_stats(self.file, [10], median = "approx"), cached)
+
+    # a row edited in the middle of the parsed prefix, keeping the length
+    # and both ends, is read again from the start
+    def test_edited_middle_row(self):
+        lines = self.lines * 4
+        self.write(lines)
+        compute_stats2.cached_file_stats(self.file, [10])
+        edited = list(lines)
+        edited[len(lines) // 2] = edited[len(lines) // 2 + 1]
+        self.write(edited + self.lines[:10])
+        with mock.patch.object(compute_stats2, "ByteRange", wraps = compute_stats2.ByteRange) as byte_range:
+            cached = compute_stats2.cached_file_stats(self.file, [10])
+        self.assertEqual(0, byte_range.call_args[0][1])
+        self.assertEqual(compute_stats2.file_stats(self.file, [10], median = "approx"), cached)
+
+    # an unfinished last line waits for the next run
+    def test_partial_line(self):
+        self.write(self.lines[:10] + [self.lines[10][:50]])
+        self.assertEqual(10, compute_stats2.cached_file_stats(self.file, [10])[0].count)
+        self.write([self.lines[10][50:]], "ab")
+        self.assertEqual(11, compute_stats2.cached_file_stats(self.file, [10])[0].count)
+
+class TestColumnar(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.directory.name, "Data.txt")
+        with open("Data.txt", "rb") as f, open(self.file, "wb") as out:
+            out.write(f.read())
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # the columns read back from the binary form equal the parsed text
+    def test_round_trip(self):
+        col_nums = [0, 1, 5, 10, 18]
+        directory = compute_stats2.convert_file(self.file, block_size = 4096)
+        columns = compute_stats2.load_columns(directory, col_nums)
+        with open(self.file, "rb") as f:
+            parsed = [np.concatenate(values) for values in zip(*compute_stats2.read_fixed_columns(f, col_nums))]
+        for expected, actual in zip(parsed, columns):
+            np.testing.assert_array_equal(expected, actual)
+        self.assertEqual(np.dtype("<i8"), columns[1].dtype)
+        self.assertEqual(np.dtype("<f8"), columns[3].dtype)
+
+    # a column that is an integer on the first line only is stored as float64
+    def test_later_decimal(self):
+        with open(self.file, "wb") as f:
+            f.write(b"  1   5  2.0\n  2 6.5  3.0\n")
+        for block_size in [16, 4096]:
+            directory = compute_stats2.convert_file(self.file, block_size = block_size)
+            columns = compute_stats2.load_columns(directory, [0, 1, 2])
+            self.assertEqual(["<i8", "<f8", "<f8"], [column.dtype.str for column in columns])
+            self.assertEqual([5.0, 6.5], columns[1].tolist())
+            self.assertEqual(compute_stats2.file_stats(self.file, [1], "fixed"),
+                             compute_stats2.file_stats(directory, [1]))
+
+    # file_stats reads a fresh binary form and ignores a stale one
+    def test_fresh_and_stale(self):
+        expected = compute_stats2.file_stats(self.file, [5, 10])
+        directory = compute_stats2.convert_file(self.file)
+        self.assertEqual(directory, compute_stats2.columnar_path(self.file))
+        self.assertEqual(directory, compute_stats2.columnar_path(directory))
+        with mock.patch.object(compute_stats2, "read_fixed_columns") as read_fixed_columns:
+            self.assertEqual(expected, compute_stats2.file_stats(self.file, [5, 10], "fixed"))
+        read_fixed_columns.assert_not_called()
+
+        with open(self.file, "ab") as f:
+            f.write(open("Data.txt", "rb").readline())
+        self.assertIsNone(compute_stats2.columnar_path(self.file))
+        self.assertEqual(expected[0].count + 1, compute_stats2.file_stats(self.file, [5])[0].count)
+
+class TestSplitFile(unittest.TestCase):
+
+    # ranges start at line starts and cover the whole file
+    def test_line_ranges(self):
+        ranges = compute_stats2.line_ranges("Data.txt", 7, 1000)
+        self.assertEqual(7, len(ranges))
+        self.assertEqual(0, ranges[0][0])
+        self.assertEqual(os.path.getsize("Data.txt"), ranges[-1][1])
+        with open("Data.txt", "rb") as f:
+            data = f.read()
+        for (start, stop), (next_start, next_stop) in zip(ranges, ranges[1:]):
+            self.assertEqual(stop, next_start)
+            self.assertEqual(b"\n", data[next_start - 1:next_start])
+        # a small file is not split
+        self.assertEqual([(0, len(data))], compute_stats2.line_ranges("Data.txt", 7))
+
+    # merged partial summaries match reading the file in one pass
+    def test_split_matches_one_pass(self):
+        col_nums = [5, 10, 18]
+        for parser in ["csv", "fixed"]:
+            expected = compute_stats2.file_stats("Data.txt", col_nums, parser, "approx")
+            for processes in [1, 2]:
+                results = compute_stats2.split_files_stats(["Data.txt", "Data.txt"], col_nums, parser,
+                                                           processes, range_bytes = 5000)
+                for file_results in results:
+                    for column, actual in zip(expected, file_results):
+                        self.assertEqual(column[1:], actual[1:])
+                        self.assertEqual(column.stats[0:2], actual.stats[0:2])
+                        self.assertAlmostEqual(column.stats[2], actual.stats[2])
+                        self.assertEqual(column.stats[3], actual.stats[3])
+
+class TestInput(unittest.TestCase):
+
+    def setUp(self):
+        with open("Data.txt", "rb") as f:
+            self.data = f.read()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # compressed files give the statistics of the plain file
+    def test_compressed_files(self):
+        for parser in ["csv", "fixed"]:
+            expected = compute_stats2.file_stats("Data.txt", [5, 10], parser)
+            for module, suffix in [(gzip, ".gz"), (bz2, ".bz2"), (lzma, ".xz")]:
+                file = os.path.join(self.directory.name, "Data.txt" + suffix)
+                with module.open(file, "wb") as f:
+                    f.write(self.data)
+                self.assertTrue(compute_stats2.is_compressed(file))
+                self.assertEqual(expected, compute_stats2.file_stats(file, [5, 10], parser))
+                # a compressed file is read whole, not in byte ranges
+                self.assertEqual(compute_stats2.file_stats(file, [5, 10], parser, "approx"),
+                                 compute_stats2.split_files_stats([file], [5, 10], parser, 2, range_bytes = 5000)[0])
+
+    # stdin is read like a file and left open
+    def test_stdin(self):
+        for parser in ["csv", "fixed"]:
+            stdin = io.TextIOWrapper(io.BytesIO(self.data))
+            with mock.patch.object(sys, "stdin", stdin):
+                results = compute_stats2.file_stats("-", [5, 10], parser)
+            self.assertEqual(compute_stats2.file_stats("Data.txt", [5, 10], parser), results)
+            self.assertFalse(stdin.closed)
@@ -1,5 +1,7 @@
 # import packages
 import sys
+import functools
+import math
 import random
 
 def get_card():
@@ -7,40 +9,37 @@ def get_card():
     '''
     return random.randint(1, 13)
 
+# point value of each card, indexed by the card (index 0 is unused)
+CARD_VALUES = (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10)
+
+def score_state(hard_total, has_ace):
+    ''' take the hard total (all aces count 1) and whether there is an ace
+        and return total sum and soft_ace_count
+    '''
+    # if aces present and would not bust make one ace soft
+    if has_ace and hard_total + 10 < 22:
+        return(hard_total + 10, 1)
+    return(hard_total, 0)
+
 def score(cards):
     ''' take in a list of blackjack cards and return total sum and soft_ace_count
     '''
-    
-    # initializing counts
-    soft_ace_count = 0
-    total = 0
-    
-    # face cards values
-    face_cards = (11, 12, 13)
-    
-    # check for aces
-    ace = False
-    if 1 in cards:
-        ace = True
-
     # count the cards (treat all aces as hard)
+    hard_total = 0
     for card in cards:
-        if card in face_cards:
-            total += 10
-        else:
-            total += card
-    
-    # if aces present and would not bust make one ace soft
-    if ace and total + 10 < 22:
-        total += 10
-        soft_ace_count += 1
-    
-    return(total, soft_ace_count)
+        hard_total += CARD_VALUES[card]
+
+    return score_state(hard_total, 1 in cards)
 
 def stand(stand_on_value, stand_on_soft, cards):
     ''' Stand (True) or Hit (False) depending on rules
     '''
     total, soft_ace_count = score(cards)
+    return stand_score(stand_on_value, stand_on_soft, total, soft_ace_count)
+
+def stand_score(stand_on_value, stand_on_soft, total, soft_ace_count):
+    ''' Stand (True) or Hit (False) for an already scored hand
+    '''
 
     # hand is soft
     if soft_ace_count == 1:
@@ -65,6 +64,76 @@ def stand(stand_on_value, stand_on_soft, cards):
         elif total >= stand_on_value:
             return True
 
+@functools.lru_cache(maxsize = None)
+def stand_table(stand_on_value, stand_on_soft):
+    ''' Stand (True) or Hit (False) for every state, indexed [has_ace][hard_total]
+    '''
+    # standing on more than 21 would keep hitting busted hands
+    if stand_on_value > 21:
+        raise ValueError(f"Oops! Can not stand on {stand_on_value}, the most is 21.")
+    # a hand only hits up to a hard total of 21, so one more card reaches at most 31
+    return tuple(tuple(stand_score(stand_on_value, stand_on_soft, *score_state(hard_total, has_ace))
+                       for hard_total in range(32))
+                 for has_ace in (False, True))
+
+# z value of a two sided 95% confidence interval
+Z_95 = 1.96
+
+# hands played before the precision is first checked
+ADAPTIVE_BATCH = 10000
+
+def count_busts(stand_on_value, stand_on_soft, num_simulations):
+    ''' play num_simulations hands and return how many of them bust
+    '''
+    # initialize the number of times player has bust
+    bust = 0
+
+    # number of simulations
+    stands = stand_table(stand_on_value, stand_on_soft)
+    for i in range(num_simulations):
+        # initialize the hand, only the hard total and whether there is an ace are kept
+        first, second = get_card(), get_card()
+        hard_total = CARD_VALUES[first] + CARD_VALUES[second]
+        has_ace = first == 1 or second == 1
+        #print("starting hand:", score_state(hard_total, has_ace)[0]) # optional: view the hand 
+        # hit (False)
+        while stands[has_ace][hard_total] == False:
+            card = get_card()           # add a card
+            hard_total += CARD_VALUES[card]
+            has_ace = has_ace or card == 1
+            #print("new hand:", score_state(hard_total, has_ace)[0])  # optional: view the hand
+        # stand (True)
+        else:
+            # did the player bust? if so add 1 to bust counter
+            if hard_total > 21:
+                bust += 1
+
+    return bust
+
+def half_width(count, n, z = Z_95):
+    ''' half-width in percent of the normal confidence interval of count / n
+    '''
+    p = count / n
+    return z * math.sqrt(p * (1 - p) / n) * 100
+
+def count_busts_adaptive(stand_on_value, stand_on_soft, target, max_simulations):
+    ''' play hands in batches until the bust percentage is within target of
+        its estimate (or max_simulations hands are played), return (busts, n)
+    '''
+    bust = 0
+    n = 0
+    size = ADAPTIVE_BATCH
+    while True:
+        size = min(size, max_simulations - n)
+        bust += count_busts(stand_on_value, stand_on_soft, size)
+        n += size
+        if n >= max_simulations or half_width(bust, n) <= target:
+            return bust, n
+
+        # the half-width shrinks with 1/sqrt(n), aim straight for the target
+        needed = n * (half_width(bust, n) / target) ** 2
+        size = max(ADAPTIVE_BATCH, math.ceil(needed) - n)
+
 def main():
     ''' simulate n poker hands
     '''
@@ -94,29 +163,18 @@ def main():
     elif strategy == 'hard':
         stand_on_soft = False
 
-    # initialize the number of times player has bust
-    bust = 0
+    # optional: half-width of the 95% CI to reach, num_simulations is then the most hands
+    if len(sys.argv) > 4:
+        target = float(sys.argv[4])
+        if target <= 0:
+            raise ValueError("Oops! The half-width has to be a positive number.")
+        bust, n = count_busts_adaptive(stand_on_value, stand_on_soft, target, num_simulations)
+        print("Bust Percentage:", (bust/n)*100, "% +/-", half_width(bust, n), "% after", n, "hands")
+        return
 
-    # number of simulations
-    for i in range(num_simulations):
-        hand = [get_card(), get_card()] # initialize the hand
-        total = score(hand)[0]
-        #print("starting hand:", total) # optional: view the hand 
-        hit_or_stand = stand(stand_on_value, stand_on_soft, hand)
-        # hit (False)
-        while hit_or_stand == False:
-            hand.append(get_card())     # add a card
-            total = score(hand)[0]      # get the total
-            hit_or_stand = stand(stand_on_value, stand_on_soft, hand)
-            #print("new hand:", total)  # optional: view the hand
-        # stand (True)
-        else:
-            # did the player bust? if so add 1 to bust counter
-            if total > 21:
-                bust += 1
+    bust = count_busts(stand_on_value, stand_on_soft, num_simulations)
 
     print("Bust Percentage:", (bust/num_simulations)*100, "%")
     
 if __name__ == '__main__':
     main()
-
@@ -78,5 +78,37 @@ class TestBlackjack(unittest.TestCase):
         self.assertTrue(blackjack.stand(16, STAND_ON_SOFT, [5, 5, 3, 4]))
         self.assertTrue(blackjack.stand(16, HIT_ON_SOFT, [5, 5, 3, 4]))
 
+    def test_score_state(self):
+        self.assertEqual((15, 0), blackjack.score_state(15, False))
+        self.assertEqual((16, 1), blackjack.score_state(6, True))
+        self.assertEqual((21, 1), blackjack.score_state(11, True))
+        # making the ace soft would bust the hand
+        self.assertEqual((12, 0), blackjack.score_state(12, True))
+
+        # adding cards one at a time gives the same score as the whole hand
+        cards = [1, 2, 3, 10, 1, 13]
+        hard_total, has_ace = 0, False
+        for i, card in enumerate(cards):
+            hard_total += blackjack.CARD_VALUES[card]
+            has_ace = has_ace or card == 1
+            self.assertEqual(blackjack.score(cards[:i + 1]), blackjack.score_state(hard_total, has_ace))
+
+    def test_stand_table_limit(self):
+        # 21 is the highest total a hand can stand on
+        self.assertTrue(all(blackjack.stand_table(21, False)[False][21:]))
+        with self.assertRaises(ValueError):
+            blackjack.count_busts(22, False, 10)
+
+    def test_count_busts_adaptive(self):
+        blackjack.random.seed(0)
+        bust, n = blackjack.count_busts_adaptive(17, False, 1.0, 10**6)
+        self.assertLessEqual(blackjack.half_width(bust, n), 1.0)
+        # about 28.5% bust, roughly 7800 hands are enough
+        self.assertEqual(blackjack.ADAPTIVE_BATCH, n)
+
+        # never more than the most hands
+        bust, n = blackjack.count_busts_adaptive(17, False, 0.01, 500)
+        self.assertEqual(500, n)
+
 if __name__ == '__main__':
     unittest.main()
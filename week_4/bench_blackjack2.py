@@ -0,0 +1,54 @@
+""" Microbenchmark of play_hand() against rescoring the whole hand per card.
+    Cards are drawn up front so only the scoring and decisions are timed.
+
+    run with: python3 bench_blackjack2.py [num_hands]
+"""
+import random
+import sys
+import timeit
+
+import blackjack2
+
+def score_full(cards):
+    ''' the old score(): rescore every card and test for face cards
+    '''
+    total = 0
+    face_cards = (11, 12, 13)
+    ace = 1 in cards
+    for card in cards:
+        if card in face_cards:
+            total += 10
+        else:
+            total += card
+    if ace and total + 10 < 22:
+        return (total + 10, 1)
+    return (total, 0)
+
+def play_hand_full(stand_on_value, stand_on_soft):
+    ''' the old play_hand(): keep the card list and rescore it after every card
+    '''
+    hand = [blackjack2.get_card(), blackjack2.get_card()]
+    total, soft_ace_count = score_full(hand)
+    while not blackjack2.stand_score(stand_on_value, stand_on_soft, total, soft_ace_count):
+        hand.append(blackjack2.get_card())
+        total, soft_ace_count = score_full(hand)
+    return 22 if total >= 22 else total
+
+def main():
+    num_hands = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    # a hand never takes more than 11 cards
+    random.seed(0)
+    cards = [random.randint(1, 13) for i in range(num_hands * 11)]
+
+    get_card = blackjack2.get_card
+    try:
+        for name, play in [('rescore', play_hand_full), ('incremental', blackjack2.play_hand)]:
+            blackjack2.get_card = iter(cards).__next__
+            seconds = timeit.timeit(lambda: play(17, False), number = num_hands)
+            print(f'{name:>12}: {seconds / num_hands * 1e6:.3f} us/hand')
+    finally:
+        blackjack2.get_card = get_card
+
+if __name__ == '__main__':
+    main()
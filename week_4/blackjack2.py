@@ -1,45 +1,122 @@
 # import packages
-import sys
+import argparse
 import random
 import collections
 import csv
+import functools
+import math
+import multiprocessing
+import numpy as np
 
 def get_card():
     ''' generate random integer
     '''
     return random.randint(1, 13)
 
+# fraction of a shoe that is dealt before it is reshuffled
+PENETRATION = 0.75
+
+# number of cards of each value 1-10 in one deck (10, J, Q and K are all worth 10)
+DECK_VALUE_COUNTS = (4, 4, 4, 4, 4, 4, 4, 4, 4, 16)
+
+def new_deck(num_decks = 1):
+    ''' num_decks unshuffled decks as an array of cards 1-13
+    '''
+    return np.tile(np.repeat(np.arange(1, 14, dtype = np.int8), 4), num_decks)
+
+def max_cards(num_decks, num_hands = 1):
+    ''' most cards num_hands hands can take from a shoe of num_decks decks
+    '''
+    # a hand only hits while its hard total is 20 or less, so all of its cards
+    # but the last add up to 20 or less, and the most cards are the smallest
+    # ones the shoe holds
+    budget = 20 * num_hands
+    cards = num_hands
+    for value, count in enumerate(DECK_VALUE_COUNTS, 1):
+        taken = min(count * num_decks, budget // value)
+        cards += taken
+        budget -= taken * value
+    return cards
+
+def cut_card(num_decks, penetration = PENETRATION, num_hands = 1):
+    ''' number of cards dealt from a shoe before it is reshuffled, leaving
+        room behind the cut card for num_hands more hands
+    '''
+    num_cards = 52 * num_decks
+    cut = int(num_cards * penetration)
+    if not 0 < cut <= num_cards - max_cards(num_decks, num_hands):
+        raise ValueError(f"Oops! A penetration of {penetration} does not leave room for "
+                         f"{num_hands} hand(s) in a {num_decks} deck shoe")
+    return cut
+
+class Shoe:
+    ''' class that encapsulates a shoe of num_decks decks that is dealt
+        down to the cut card and then reshuffled, num_hands hands are dealt
+        between two checks of the cut card
+    '''
+    __slots__ = ('num_decks', 'num_hands', 'cut', 'rng', 'cursor', '_deck', '_cards')
+
+    def __init__(self, num_decks = 6, penetration = PENETRATION, rng = None, num_hands = 1):
+        ''' initialize and shuffle the shoe
+        '''
+        self.num_decks = num_decks
+        self.num_hands = num_hands
+        self.cut = cut_card(num_decks, penetration, num_hands)
+        self.rng = np.random.default_rng() if rng is None else rng
+        self._deck = new_deck(num_decks)
+        self.shuffle()
+
+    def __repr__(self):
+        ''' 'canonical' values
+        '''
+        return f"Shoe({self.num_decks}, {self.cut / len(self._deck)}, num_hands = {self.num_hands})"
+
+    def shuffle(self):
+        ''' shuffle all cards back into the shoe
+        '''
+        # shuffled as an array, dealt from a list so draw() is cheap
+        self.rng.shuffle(self._deck)
+        self._cards = self._deck.tolist()
+        self.cursor = 0
+
+    def needs_shuffle(self):
+        ''' check if the cut card has been reached
+        '''
+        return self.cursor >= self.cut
+
+    def draw(self):
+        ''' deal the next card
+        '''
+        if self.cursor == len(self._cards):
+            self.shuffle()
+        card = self._cards[self.cursor]
+        self.cursor += 1
+        return card
+
 # create a namedtuple object for score
 Score = collections.namedtuple('Score', 'total soft_ace_count')
 
+# point value of each card, indexed by the card (index 0 is unused)
+CARD_VALUES = (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10)
+
+def score_state(hard_total, has_ace):
+    ''' take the hard total (all aces count 1) and whether there is an ace
+        and return total sum and soft_ace_count
+    '''
+    # if aces present and would not bust make one ace soft
+    if has_ace and hard_total + 10 < 22:
+        return Score(hard_total + 10, 1)
+    return Score(hard_total, 0)
+
 def score(cards):
     ''' take in a list of blackjack cards and return total sum and soft_ace_count
     '''
-    # initializing counts
-    soft_ace_count = 0
-    total = 0
-    
-    # face cards values
-    face_cards = (11, 12, 13)
-    
-    # check for aces
-    ace = False
-    if 1 in cards:
-        ace = True
-
     # count the cards (treat all aces as hard)
+    hard_total = 0
     for card in cards:
-        if card in face_cards:
-            total += 10
-        else:
-            total += card
-    
-    # if aces present and would not bust make one ace soft
-    if ace and total + 10 < 22:
-        total += 10
-        soft_ace_count += 1
+        hard_total += CARD_VALUES[card]
 
-    return Score(total, soft_ace_count)
+    return score_state(hard_total, 1 in cards)
 
 # create namedtuple object for stand
 Stand = collections.namedtuple('Stand', 'stand total')
@@ -50,34 +127,61 @@ def stand(stand_on_value, stand_on_soft, cards):
     # get the hand total and soft_ace_count
     total, soft_ace_count = score(cards)
 
+    return Stand(stand_score(stand_on_value, stand_on_soft, total, soft_ace_count), total)
+
+def stand_score(stand_on_value, stand_on_soft, total, soft_ace_count):
+    ''' Stand (True) or Hit (False) for an already scored hand
+    '''
     # if below stand on value = HIT
     if total < stand_on_value:
-        stand = False
+        return False
     # if above stand on value = STAND
     elif total > stand_on_value:
-        stand = True
+        return True
     # if on stand on value with no soft aces or stand on soft = STAND
     elif soft_ace_count == 0 or stand_on_soft == True:
-        stand = True
+        return True
     # if on stand on value and hit on soft = Hit
     else:
-        stand = False
+        return False
 
-    return Stand(stand, total)
+@functools.lru_cache(maxsize = None)
+def stand_table(stand_on_value, stand_on_soft):
+    ''' Stand (True) or Hit (False) for every state, indexed [has_ace][hard_total]
+    '''
+    # standing on more than 21 would keep hitting busted hands
+    if stand_on_value > 21:
+        raise ValueError(f"Oops! Can not stand on {stand_on_value}, the most is 21.")
+    # a hand only hits up to a hard total of 21, so one more card reaches at most 31
+    return tuple(tuple(stand_score(stand_on_value, stand_on_soft, *score_state(hard_total, has_ace))
+                       for hard_total in range(32))
+                 for has_ace in (False, True))
 
-def play_hand(stand_on_value, stand_on_soft):
-    ''' simulate one hand
+def play_hand(stand_on_value, stand_on_soft, shoe = None):
+    ''' simulate one hand, dealt from shoe if one is given
     '''
+    stands = stand_table(stand_on_value, stand_on_soft)
+
+    if shoe is None:
+        draw = get_card
+    else:
+        # reshuffle between hands once the cut card is reached
+        if shoe.needs_shuffle():
+            shoe.shuffle()
+        draw = shoe.draw
+
+    # initialize the hand, only the hard total and whether there is an ace are kept
+    first, second = draw(), draw()
+    hard_total = CARD_VALUES[first] + CARD_VALUES[second]
+    has_ace = first == 1 or second == 1
 
-    hand = [get_card(), get_card()] # initialize the hand
-    stand_or_hit = stand(stand_on_value, stand_on_soft, hand)
-    
     # hit (False)
-    while stand_or_hit.stand == False:
-        hand.append(get_card()) # add a card
-        stand_or_hit = stand(stand_on_value, stand_on_soft, hand) # test new hand
-    
-    total = score(hand)[0]
+    while not stands[has_ace][hard_total]:
+        card = draw() # add a card
+        hard_total += CARD_VALUES[card]
+        has_ace = has_ace or card == 1
+
+    total = score_state(hard_total, has_ace).total
 
     # return 22 if bust, return total otherwise
     if total >= 22:
@@ -85,33 +189,193 @@ def play_hand(stand_on_value, stand_on_soft):
     else:
         return total
 
-def main():
-    ''' simulate n poker hands
+# stand on values and strategies used for the rows of the table
+STAND_ON_VALUES = [ x for x in range(13,22)]
+STRATEGIES = ['hard', 'soft']
+
+# largest number of hands of a single strategy given to one worker
+SHARD_SIZE = 1_000_000
+
+# z value of a two sided 95% confidence interval
+Z_95 = 1.96
+
+# hands played for a strategy before its precision is first checked
+ADAPTIVE_BATCH = 10_000
+
+def strategy_rows():
+    ''' list of (name, stand_on_value, stand_on_soft) in table order
+    '''
+    rows = list()
+    for value in STAND_ON_VALUES:
+        for strategy in STRATEGIES:
+            # soft strategy = stand on soft, hard strategy = hit on soft
+            if strategy == 'soft':
+                rows.append((f'S{value}', value, True))
+            else:
+                rows.append((f'H{value}', value, False))
+    return rows
+
+def split_shards(num_sims, shard_size = SHARD_SIZE):
+    ''' split num_sims hands into a list of shard sizes of at most shard_size
     '''
+    shards = [shard_size] * (num_sims // shard_size)
+    if num_sims % shard_size:
+        shards.append(num_sims % shard_size)
+    return shards
 
-    # validate input
+def row_player(stand_on_value, stand_on_soft, seed, num_decks, penetration):
+    ''' function that plays num_sims more hands of a strategy and returns the
+        counts of each total
+    '''
+    # every shard has its own stream so a seeded run does not depend on
+    # which worker (or how many workers) played it
+    if seed is not None:
+        random.seed(seed)
 
-    # make sure there are correct number of inputs
-    try:
-        len(sys.argv) == 2
-    except ValueError:
-        print("ValueError: Oops! Please enter only the number of simulations you want to run.")
+    # num_decks = None is an infinite deck
+    shoe = None
+    if num_decks is not None:
+        rng = np.random.default_rng(None if seed is None else random.getrandbits(64))
+        shoe = Shoe(num_decks, penetration, rng)
 
-    # num_simulations
-    # check to see if it's a number
-    try:
-        num_sims = int(sys.argv[1])
-    except ValueError:
-        print("ValueError: Oops! Did you input a string? Please, input an integer")
-    # check to see if it's greater than 0
-    try:
-        num_sims > 0
-    except ValueError:
-        print("ValueError: Oops! Please make sure you input a positive integer for this argument")
+    def play(num_sims):
+        results = collections.defaultdict(int)
+        for i in range(num_sims):
+            results[play_hand(stand_on_value, stand_on_soft, shoe)] += 1
+        return results
+    return play
 
-    stand_on_values = [ x for x in range(13,22)] # stand on values
-    strategies = ['hard', 'soft'] # strategies
+def run_shard(task):
+    ''' play one shard of a strategy and return (row, counts of each total)
+    '''
+    row_index, stand_on_value, stand_on_soft, num_sims, seed, num_decks, penetration = task
+    play = row_player(stand_on_value, stand_on_soft, seed, num_decks, penetration)
+    return row_index, play(num_sims)
+
+def count_totals(num_sims, seed = None, processes = 1, shard_size = SHARD_SIZE, num_decks = None,
+                 penetration = PENETRATION):
+    ''' simulate every strategy and return a list of total -> count dicts
+    '''
+    rows = strategy_rows()
+    tasks = list()
+    for row_index, (name, value, stand_on_soft) in enumerate(rows):
+        for shard_index, size in enumerate(split_shards(num_sims, shard_size)):
+            shard_seed = None if seed is None else f'{seed}-{row_index}-{shard_index}'
+            tasks.append((row_index, value, stand_on_soft, size, shard_seed, num_decks, penetration))
 
+    counts = [collections.defaultdict(int) for row in rows]
+    if processes == 1:
+        for row_index, results in map(run_shard, tasks):
+            for total, count in results.items():
+                counts[row_index][total] += count
+    else:
+        # processes = None uses every core
+        with multiprocessing.Pool(processes) as pool:
+            for row_index, results in pool.imap_unordered(run_shard, tasks):
+                for total, count in results.items():
+                    counts[row_index][total] += count
+    return counts
+
+# probability of drawing each card value (10, J, Q and K are all worth 10)
+CARD_PROBS = [(value, 1/13) for value in range(1, 10)] + [(10, 4/13)]
+
+@functools.lru_cache(maxsize = None)
+def _final_totals(hard_total, has_ace, num_cards, stand_on_value, stand_on_soft):
+    ''' probability of each final total (index 22 is BUST) from a hand state
+    '''
+    # the first two cards are always dealt before any decision
+    if num_cards >= 2:
+        # treat one ace as 11 if it would not bust the hand
+        soft = has_ace and hard_total + 10 < 22
+        total = hard_total + 10 if soft else hard_total
+        if total >= 22:
+            return tuple(1.0 if x == 22 else 0.0 for x in range(23))
+        # same rules as stand()
+        if total > stand_on_value or \
+           (total == stand_on_value and (not soft or stand_on_soft)):
+            return tuple(1.0 if x == total else 0.0 for x in range(23))
+
+    # hit: average over the next card
+    probs = [0.0] * 23
+    for value, prob in CARD_PROBS:
+        next_probs = _final_totals(hard_total + value, has_ace or value == 1,
+                                   num_cards + 1, stand_on_value, stand_on_soft)
+        for x in range(23):
+            probs[x] += prob * next_probs[x]
+    return tuple(probs)
+
+def final_totals(stand_on_value, stand_on_soft):
+    ''' exact probability of every final total of play_hand(), 22 is BUST
+    '''
+    probs = _final_totals(0, False, 0, stand_on_value, stand_on_soft)
+    return {total: prob for total, prob in enumerate(probs) if prob > 0}
+
+def exact_totals():
+    ''' exact version of count_totals() with probabilities instead of counts
+    '''
+    return [final_totals(value, stand_on_soft) for name, value, stand_on_soft in strategy_rows()]
+
+def half_width(count, num_sims, z = Z_95):
+    ''' half-width in percent of the normal confidence interval of count / num_sims
+    '''
+    p = count / num_sims
+    return z * math.sqrt(p * (1 - p) / num_sims) * 100
+
+def row_half_width(results, num_sims):
+    ''' widest half-width of all the totals of a row
+    '''
+    return max(half_width(count, num_sims) for count in results.values())
+
+def run_adaptive_row(task):
+    ''' play a strategy in batches until every total is within target of its
+        estimate (or max_sims hands are played), return (row, counts, num_sims)
+    '''
+    row_index, stand_on_value, stand_on_soft, target, max_sims, seed, num_decks, penetration = task
+    play = row_player(stand_on_value, stand_on_soft, seed, num_decks, penetration)
+
+    counts = collections.defaultdict(int)
+    num_sims = 0
+    size = ADAPTIVE_BATCH
+    while True:
+        size = min(size, max_sims - num_sims)
+        for total, count in play(size).items():
+            counts[total] += count
+        num_sims += size
+        widest = row_half_width(counts, num_sims)
+        if num_sims >= max_sims or widest <= target:
+            return row_index, counts, num_sims
+
+        # the half-width shrinks with 1/sqrt(n), aim straight for the target
+        needed = num_sims * (widest / target) ** 2
+        size = max(ADAPTIVE_BATCH, math.ceil(needed) - num_sims)
+
+def count_totals_adaptive(target, max_sims, seed = None, processes = 1, num_decks = None,
+                          penetration = PENETRATION):
+    ''' simulate every strategy to a target CI half-width and return the
+        total -> count dicts and the number of hands of each strategy
+    '''
+    tasks = list()
+    for row_index, (name, value, stand_on_soft) in enumerate(strategy_rows()):
+        row_seed = None if seed is None else f'{seed}-{row_index}'
+        tasks.append((row_index, value, stand_on_soft, target, max_sims, row_seed, num_decks, penetration))
+
+    counts = [None] * len(tasks)
+    sims = [0] * len(tasks)
+    if processes == 1:
+        for row_index, row_counts, num_sims in map(run_adaptive_row, tasks):
+            counts[row_index] = row_counts
+            sims[row_index] = num_sims
+    else:
+        # processes = None uses every core
+        with multiprocessing.Pool(processes) as pool:
+            for row_index, row_counts, num_sims in pool.imap_unordered(run_adaptive_row, tasks):
+                counts[row_index] = row_counts
+                sims[row_index] = num_sims
+    return counts, sims
+
+def make_table(counts, num_sims):
+    ''' turn the counts of each total into the percentage table
+    '''
     table = list() # initialize empty list
 
     # get column names as first row in table
@@ -119,50 +383,98 @@ def main():
     col_names.appendleft('STRATEGY')
     col_names.append('BUST')
     table.append(list(col_names))
-    
-    # iterate over stand on values
-    for value in stand_on_values:
-    
-        # iterate over strategies
-        for strategy in strategies:
 
-            # soft strategy = stand on soft, hard strategy = hit on soft
-            if strategy == 'soft':
-                stand_on_soft = True
-                strat_name = f'S{value}' # strategy name for table
-            else:
-                stand_on_soft = False
-                strat_name = f'H{value}'
-        
-            results = collections.defaultdict(int) # initialize defaultdict
-    
-            # run it through the number of simulations
-            for i in range(num_sims):
-                total = play_hand(value, stand_on_soft)
-                results[total] += 1
-
-            # take total and get a rounded percentage for each key
-            for k in results:
-                results[k] = round(((results[k]/num_sims)*100),1)
-        
-            # create a deque that contains the percentages of all numbers
-            percentages = collections.deque([f'{x[1]}' for x in sorted(results.items())])
-        
-            # filling in zeros for values below stand on value
-            while len(percentages) < 10:
-                percentages.appendleft('0.0')
-        
-            # append the strategy name
-            percentages.appendleft(strat_name)
-        
-            # append a list of percentages
-            table.append(list(percentages))
-
-    # write table to a csv
-    with open('output.csv', 'w') as f:
+    for (strat_name, value, stand_on_soft), results in zip(strategy_rows(), counts):
+        # rounded percentage of every total, 22 is BUST
+        percentages = [f'{round(((results.get(x, 0)/num_sims)*100),1)}' for x in range(13,23)]
+        table.append([strat_name] + percentages)
+
+    return table
+
+def make_adaptive_table(counts, sims):
+    ''' percentage table with the widest CI half-width and the number of
+        hands of each strategy added as the last two columns
+    '''
+    # same column names as make_table()
+    table = [make_table([], 1)[0] + ['CI +/-', 'SIMS']]
+
+    for (strat_name, value, stand_on_soft), results, num_sims in zip(strategy_rows(), counts, sims):
+        percentages = [f'{round(((results.get(x, 0)/num_sims)*100),1)}' for x in range(13,23)]
+        widest = f'{round(row_half_width(results, num_sims),2)}'
+        table.append([strat_name] + percentages + [widest, num_sims])
+
+    return table
+
+def write_table(table, file_name = 'output.csv'):
+    ''' write table to a csv
+    '''
+    with open(file_name, 'w') as f:
         writer = csv.writer(f)
         writer.writerows(table)
 
+def positive_int(value):
+    ''' argparse type for the number of simulations
+    '''
+    try:
+        num_sims = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Oops! Did you input a string? Please, input an integer")
+    if num_sims <= 0:
+        raise argparse.ArgumentTypeError("Oops! Please make sure you input a positive integer for this argument")
+    return num_sims
+
+def main():
+    ''' simulate n blackjack hands for every strategy
+    '''
+    parser = argparse.ArgumentParser(description = 'distribution of final totals for each blackjack strategy')
+    parser.add_argument('num_sims', metavar = '<num_sims>', type = positive_int, nargs = '?',
+                        help = 'number of hands per strategy (the most hands with --half-width)')
+    parser.add_argument('-x', '--exact', action = 'store_true', dest = 'exact',
+                        help = 'compute the exact probabilities instead of simulating')
+    parser.add_argument('--seed', type = int, default = None, dest = 'seed', help = 'seed for a reproducible table')
+    parser.add_argument('-p', '--processes', type = int, default = 1, dest = 'processes',
+                        help = 'number of worker processes, 0 uses every core')
+    parser.add_argument('--shard-size', type = positive_int, default = SHARD_SIZE, dest = 'shard_size',
+                        help = 'largest number of hands of one strategy given to a worker')
+    parser.add_argument('-d', '--decks', type = positive_int, default = None, dest = 'decks',
+                        help = 'deal from a shoe of this many decks instead of an infinite deck')
+    parser.add_argument('--penetration', type = float, default = PENETRATION, dest = 'penetration',
+                        help = 'fraction of the shoe dealt before it is reshuffled')
+    parser.add_argument('-w', '--half-width', type = float, default = None, dest = 'half_width',
+                        help = 'play each strategy until the 95%% CI of every column is this many points wide either side')
+
+    args = parser.parse_args()
+
+    if args.decks is not None:
+        try:
+            cut_card(args.decks, args.penetration)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.exact:
+        if args.decks is not None:
+            parser.error('--exact assumes an infinite deck, it cannot be used with --decks')
+        # probabilities are counts out of a single hand
+        write_table(make_table(exact_totals(), 1))
+        return
+
+    if args.num_sims is None:
+        parser.error('<num_sims> is required unless --exact is given')
+
+    processes = args.processes if args.processes > 0 else None
+
+    if args.half_width is not None:
+        if args.half_width <= 0:
+            parser.error('--half-width has to be positive')
+        counts, sims = count_totals_adaptive(args.half_width, args.num_sims, args.seed, processes,
+                                             args.decks, args.penetration)
+        write_table(make_adaptive_table(counts, sims))
+        return
+
+    counts = count_totals(args.num_sims, args.seed, processes, args.shard_size,
+                          args.decks, args.penetration)
+    write_table(make_table(counts, args.num_sims))
+
 # call the main function
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -103,5 +103,120 @@ class TestBlackjack(unittest.TestCase):
         ret = blackjack2.stand(16, HIT_ON_SOFT, [5, 5, 3, 4])
         self.assertEqual((True, 17), ret)
 
+    def test_stand_table(self):
+        for name, value, stand_on_soft in blackjack2.strategy_rows():
+            stands = blackjack2.stand_table(value, stand_on_soft)
+            for has_ace in (False, True):
+                for hard_total in range(32):
+                    score = blackjack2.score_state(hard_total, has_ace)
+                    self.assertEqual(blackjack2.stand_score(value, stand_on_soft, *score), stands[has_ace][hard_total])
+
+    def test_stand_table_limit(self):
+        # 21 is the highest total a hand can stand on
+        self.assertTrue(all(blackjack2.stand_table(21, False)[False][21:]))
+        with self.assertRaises(ValueError):
+            blackjack2.play_hand(22, False)
+
+    def test_Shoe(self):
+        shoe = blackjack2.Shoe(1, 0.5, blackjack2.np.random.default_rng(0))
+        cards = [shoe.draw() for i in range(52)]
+        self.assertEqual(sorted(list(range(1, 14)) * 4), sorted(cards))
+        self.assertEqual(True, shoe.needs_shuffle())
+
+        # play_hand() reshuffles a shoe that is past the cut card
+        total = blackjack2.play_hand(17, True, shoe)
+        self.assertTrue(17 <= total <= 22)
+        self.assertLess(shoe.cursor, 12)
+
+    def test_max_cards(self):
+        # 4 aces, 4 twos and 2 threes add up to 18, the next card ends the hand
+        self.assertEqual(11, blackjack2.max_cards(1))
+        # with enough aces a hand hits up to a hard total of 20
+        self.assertEqual(21, blackjack2.max_cards(8))
+        # two hands share the smallest cards of the shoe
+        self.assertEqual(18, blackjack2.max_cards(1, 2))
+        self.assertEqual(38, blackjack2.max_cards(8, 2))
+
+        # a single deck cut at 0.75 has room for one hand but not two
+        self.assertEqual(39, blackjack2.cut_card(1))
+        with self.assertRaises(ValueError):
+            blackjack2.cut_card(1, num_hands = 2)
+
+    def test_shoe_counts_match_exact(self):
+        num_sims = 10000
+        counts = blackjack2.count_totals(num_sims, seed = 2, num_decks = 8)
+        for probs, results in zip(blackjack2.exact_totals(), counts):
+            self.assertEqual(num_sims, sum(results.values()))
+            self.assertAlmostEqual(probs[22], results[22] / num_sims, delta = 0.025)
+
+    def test_split_shards(self):
+        self.assertEqual([10], blackjack2.split_shards(10, 100))
+        self.assertEqual([4, 4, 2], blackjack2.split_shards(10, 4))
+
+    def test_parallel_counts_are_reproducible(self):
+        serial = blackjack2.count_totals(50, seed = 7, processes = 1, shard_size = 20)
+        parallel = blackjack2.count_totals(50, seed = 7, processes = 2, shard_size = 20)
+        self.assertEqual(serial, parallel)
+        # every hand ends up in exactly one column
+        for counts in serial:
+            self.assertEqual(50, sum(counts.values()))
+
+    def test_make_table(self):
+        counts = [{17: 3, 22: 1}] + [{22: 4}] * 17
+        table = blackjack2.make_table(counts, 4)
+        self.assertEqual(19, len(table))
+        self.assertEqual(['STRATEGY', '13', '14', '15', '16', '17', '18', '19', '20', '21', 'BUST'], table[0])
+        self.assertEqual(['H13', '0.0', '0.0', '0.0', '0.0', '75.0', '0.0', '0.0', '0.0', '0.0', '25.0'], table[1])
+        self.assertEqual('S21', table[-1][0])
+
+    def test_final_totals(self):
+        for name, value, stand_on_soft in blackjack2.strategy_rows():
+            probs = blackjack2.final_totals(value, stand_on_soft)
+            self.assertAlmostEqual(1.0, sum(probs.values()))
+            # never stands below the stand on value
+            self.assertEqual(min(probs), value)
+
+        # standing on 21 only ends on 21 or bust
+        self.assertEqual([21, 22], sorted(blackjack2.final_totals(21, True)))
+
+        # hitting soft 17 moves probability away from 17
+        self.assertLess(blackjack2.final_totals(17, False)[17], blackjack2.final_totals(17, True)[17])
+
+    def test_final_totals_match_simulation(self):
+        num_sims = 10000
+        counts = blackjack2.count_totals(num_sims, seed = 1)
+        for probs, results in zip(blackjack2.exact_totals(), counts):
+            for total in range(13, 23):
+                self.assertAlmostEqual(probs.get(total, 0), results.get(total, 0) / num_sims, delta = 0.02)
+
+    def test_score_state(self):
+        self.assertEqual((15, 0), blackjack2.score_state(15, False))
+        self.assertEqual((16, 1), blackjack2.score_state(6, True))
+        self.assertEqual((21, 1), blackjack2.score_state(11, True))
+        # making the ace soft would bust the hand
+        self.assertEqual((12, 0), blackjack2.score_state(12, True))
+
+        # adding cards one at a time gives the same score as the whole hand
+        cards = [1, 2, 3, 10, 1, 13]
+        hard_total, has_ace = 0, False
+        for i, card in enumerate(cards):
+            hard_total += blackjack2.CARD_VALUES[card]
+            has_ace = has_ace or card == 1
+            self.assertEqual(blackjack2.score(cards[:i + 1]), blackjack2.score_state(hard_total, has_ace))
+
+    def test_adaptive_rows(self):
+        counts, sims = blackjack2.count_totals_adaptive(1.0, 50000, seed = 4)
+        for results, num_sims in zip(counts, sims):
+            self.assertEqual(num_sims, sum(results.values()))
+            self.assertLessEqual(blackjack2.row_half_width(results, num_sims), 1.0)
+
+        # H21 only has two outcomes and stops after the first batch
+        self.assertEqual(blackjack2.ADAPTIVE_BATCH, sims[-2])
+
+        table = blackjack2.make_adaptive_table(counts, sims)
+        self.assertEqual(['CI +/-', 'SIMS'], table[0][-2:])
+        self.assertEqual(sims[0], table[1][-1])
+        self.assertEqual(13, len(table[1]))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,80 @@
+""" Microbenchmark of Strategy.play() with incremental and full hand scoring.
+    Cards are drawn up front so only the scoring and decisions are timed.
+    Last, the numpy engine plays [num_matchups] hands from an infinite deck
+    and from 6 and 8 deck shoes.
+
+    run with: python3 bench_blackjack3.py [num_hands] [num_matchups]
+"""
+import random
+import sys
+import time
+import timeit
+
+import blackjack3
+
+class RescoredHand(blackjack3.Hand):
+    ''' the old Hand: rescore every card and test for face cards on each draw
+    '''
+    def add_card(self):
+        self.cards = self.cards + [random.randint(1,13)]
+        self.score()
+
+    def score(self):
+        self.total = 0
+        self.soft_ace_count = 0
+        face_cards = (11, 12, 13)
+        ace = 1 in self.cards
+        for card in self.cards:
+            if card in face_cards:
+                self.total += 10
+            else:
+                self.total += card
+        if ace and self.total + 10 < 22:
+            self.total += 10
+            self.soft_ace_count += 1
+
+def play_rescored(strategy):
+    ''' Strategy.play() with a RescoredHand
+    '''
+    hand = RescoredHand()
+    while len(hand.cards) < 2:
+        hand.add_card()
+    while not strategy.stand(hand):
+        hand.add_card()
+    return hand
+
+def main():
+    num_hands = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    num_matchups = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+    strategy = blackjack3.Strategy(17, False)
+
+    # a hand never takes more than 11 cards
+    random.seed(0)
+    cards = [random.randint(1, 13) for i in range(num_hands * 11)]
+
+    randint = random.randint
+    try:
+        for name, play in [('rescore', play_rescored), ('incremental', blackjack3.Strategy.play)]:
+            next_card = iter(cards).__next__
+            random.randint = lambda a, b: next_card()
+            seconds = timeit.timeit(lambda: play(strategy), number = num_hands)
+            print(f'{name:>12}: {seconds / num_hands * 1e6:.3f} us/hand')
+    finally:
+        random.randint = randint
+
+    # shoes should stay within 2x of the infinite deck
+    player_strat = blackjack3.Strategy(17, False)
+    dealer_strat = blackjack3.Strategy(16, True)
+    rng = blackjack3.np.random.default_rng(0)
+    for name, play in [('infinite', lambda: blackjack3.play_matchup_numpy(player_strat, dealer_strat,
+                                                                          num_matchups, rng)),
+                       ('6 decks', lambda: blackjack3.play_matchup_shoes(player_strat, dealer_strat,
+                                                                         num_matchups, rng, 6)),
+                       ('8 decks', lambda: blackjack3.play_matchup_shoes(player_strat, dealer_strat,
+                                                                         num_matchups, rng, 8, 0.9))]:
+        start = time.perf_counter()
+        play()
+        print(f'{name:>12}: {(time.perf_counter() - start) * 1000:.1f} ms for {num_matchups} hands')
+
+if __name__ == '__main__':
+    main()
@@ -1,108 +1,128 @@
-import sys
+import argparse
 import collections
 import csv
+import functools
+import math
+import multiprocessing
+import os
 import random
+import sys
+import time
+import numpy as np
+
+# the finite shoe, its cut card and its deck are shared with week 4
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'week_4'))
+from blackjack2 import PENETRATION, Shoe, cut_card, new_deck
+
+# point value of each card, indexed by the card (index 0 is unused)
+CARD_VALUES = (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10)
+
+# hands dealt from a shoe between two checks of the cut card: a round is a
+# player hand and a dealer hand
+ROUND_HANDS = 2
 
 class Hand:
     ''' class that encapsulates a blackjack hand
     '''
+    # no per-hand __dict__, simulations create and reuse a lot of hands
+    __slots__ = ('cards', 'hard_total', 'has_ace', 'total', 'soft_ace_count')
+
     def __init__(self, cards = None):
         ''' initialize the hand
         '''
         # if input is given
         if cards is not None:
-            self.cards = cards
+            self.cards = list(cards)
             self.score()
         # if no input is given
         else:
             self.cards = []
-            self.total = 0
-            self.soft_ace_count = 0
+            self.reset()
 
     def __str__(self):
         ''' print out attributes
         '''
-        print(f'Your cards are: {self.cards}')
-        print(f'Point total: {self.total}')
-        print(f'Number of soft aces: {self.soft_ace_count}')
+        return f'Your cards are: {self.cards}\n' \
+               f'Point total: {self.total}\n' \
+               f'Number of soft aces: {self.soft_ace_count}'
+
+    def reset(self):
+        ''' empty the hand so it can be played again
+        '''
+        self.cards.clear()
+        self.hard_total = 0
+        self.has_ace = False
+        self.total = 0
+        self.soft_ace_count = 0
 
-    def add_card(self):
-        ''' add a random card to the hand and re-score hand
+    def add_card(self, shoe = None):
+        ''' add a card from the shoe (or a random card) and update the score
         '''
-        self.cards = self.cards + [random.randint(1,13)]
-        self.score()
+        card = random.randint(1,13) if shoe is None else shoe.draw()
+        self.cards.append(card)
+        # only the new card is counted, the rest of the hand is already scored
+        self.hard_total += CARD_VALUES[card]
+        self.has_ace = self.has_ace or card == 1
+        self._score_state()
 
     def is_blackjack(self):
         ''' check if blackjack
         '''
-        face_cards = [10,11,12,13]
-        
-        if any(card in self.cards for card in face_cards): # if any card in the hand is a face card
-            if self.soft_ace_count > 0 and self.total == 21: # if other card is a soft ace
-                return True 
-            else:
-                return False
-        else:
-            return False
+        # a soft 21 with two cards can only be an ace and a ten valued card
+        return len(self.cards) == 2 and self.soft_ace_count > 0 and self.total == 21
 
     def is_bust(self):
         ''' check if player bust
         '''
-        if self.total > 21:
-            return True
-        else:
-            return False
+        return self.total > 21
 
     def score(self):
         ''' score the hand
         '''
-        # initialize total and soft_ace_count
-        self.total = 0
-        self.soft_ace_count = 0
-
-        # face cards values
-        face_cards = (11, 12, 13)
-    
-        # check for aces
-        ace = False
-        if 1 in self.cards:
-            ace = True
-
         # count the cards (treat all aces as hard)
+        self.hard_total = 0
         for card in self.cards:
-            if card in face_cards:
-                self.total += 10
-            else:
-                self.total += card
-    
+            self.hard_total += CARD_VALUES[card]
+        self.has_ace = 1 in self.cards
+        self._score_state()
+
+    def _score_state(self):
+        ''' set total and soft_ace_count from the hard total and aces
+        '''
         # if aces present and would not bust make one ace soft
-        if ace and self.total + 10 < 22:
-            self.total += 10
-            self.soft_ace_count += 1
+        if self.has_ace and self.hard_total + 10 < 22:
+            self.total = self.hard_total + 10
+            self.soft_ace_count = 1
+        else:
+            self.total = self.hard_total
+            self.soft_ace_count = 0
 
 class Strategy:
     ''' class that encapsulates a blackjack strategy
     '''
+    __slots__ = ('stand_on_value', 'stand_on_soft')
+
     def __init__(self, stand_on_value, stand_on_soft):
         ''' Strategy values
         '''
+        # standing on more than 21 would keep hitting busted hands
+        if stand_on_value > 21:
+            raise ValueError(f"Oops! Can not stand on {stand_on_value}, the most is 21.")
         self.stand_on_value = stand_on_value
         self.stand_on_soft = stand_on_soft
 
     def __repr__(self):
-        ''' print out 'canonical' values
+        ''' 'canonical' values
         '''
-        print(f"Stand on value is: {self.stand_on_value}")
-        print(f"Stand on soft aces? {self.stand_on_soft}")
+        return f"Strategy({self.stand_on_value}, {self.stand_on_soft})"
 
     def __str__(self):
-        ''' print out values
+        ''' values, S = stand on soft, H = hit on soft
         '''
         if self.stand_on_soft == True: # soft strategy
-            self.strategy = "S"
+            return f"Strategy: S{self.stand_on_value}"
         else:                          # hard strategy
-            self.strategy = "H"
-        print(f"Strategy: {self.strategy}{self.stand_on_value}")
+            return f"Strategy: H{self.stand_on_value}"
 
     def stand(self, hand):
         ''' Stand (True) or Hit (False) depending on rules
@@ -122,128 +142,875 @@ class Strategy:
         # return True or False
         return stand
     
-    def play(self):
-        ''' play a hand of blackjack
+    def play(self, hand = None, shoe = None):
+        ''' play a hand of blackjack, reusing hand if one is given and
+            dealing from shoe if one is given
         '''
-        hand = Hand() # instantiate hand object
+        if hand is None:
+            hand = Hand() # instantiate hand object
+        else:
+            hand.reset()
+
+        hand.add_card(shoe)
+        hand.add_card(shoe)
 
-        while len(hand.cards) < 2: # add cards 
-            hand.add_card()
-        
-        self.decision = self.stand(hand) # hit or stand?
+        # same answers as self.stand(hand), looked up by the hand state
+        stands = stand_table(self.stand_on_value, self.stand_on_soft)
 
-        while self.decision == False: # continue until stand or bust
-            hand.add_card()
-            self.decision = self.stand(hand)
+        while not stands[hand.has_ace][hand.hard_total]: # continue until stand or bust
+            hand.add_card(shoe)
 
         return hand
 
-def main():
-    ''' simulate n blackjack hands
+@functools.lru_cache(maxsize = None)
+def stand_table(stand_on_value, stand_on_soft):
+    ''' Strategy.stand() for every hand state, indexed [has_ace][hard_total]
     '''
-    # validate input
-    # make sure there are correct number of inputs
-    try:
-        len(sys.argv) == 2
-    except ValueError:
-        print("ValueError: Oops! Please enter only the number of simulations you want to run.")
-    # num_simulations
-    # check to see if it's a number
-    try:
-        n = int(sys.argv[1])
-    except ValueError:
-        print("ValueError: Oops! Did you input a string? Please, input an integer")
-    # check to see if it's greater than 0
+    strategy = Strategy(stand_on_value, stand_on_soft)
+    table = ([], [])
+    # a hand only hits up to a hard total of 21, so one more card reaches at most 31
+    for has_ace in (False, True):
+        for hard_total in range(32):
+            hand = Hand()
+            hand.hard_total = hard_total
+            hand.has_ace = has_ace
+            hand._score_state()
+            table[has_ace].append(strategy.stand(hand))
+    return (tuple(table[0]), tuple(table[1]))
+
+# stand on values and strategies used for the rows and columns of the table
+STAND_ON_VALUES = [ x for x in range(13,21)]
+STRATEGIES = ['H', 'S'] # strategies: H = hard, S = soft
+
+# CARD_VALUES as an array so whole blocks of cards can be looked up at once
+CARD_VALUE_ARRAY = np.array(CARD_VALUES)
+
+# number of hands the numpy engine plays at once
+BATCH_SIZE = 1_000_000
+
+# largest number of hands of a single cell given to one worker
+SHARD_SIZE = 1_000_000
+
+# most shoes the numpy engine deals side by side (more of them no longer
+# fit in the cpu cache and deal slower), and the fewest rounds each of them
+# plays
+NUM_SHOES = 8000
+ROUNDS_PER_SHOE = 200
+
+# z value of a two sided 95% confidence interval
+Z_95 = 1.96
+
+# hands played in a cell before its precision is first checked
+ADAPTIVE_BATCH = 10_000
+
+# seconds between checkpoints of a long run
+CHECKPOINT_EVERY = 60
+
+# most cards one hand can take from an infinite deck: it only hits while its
+# hard total is 20 or less
+MAX_HAND_CARDS = 21
+
+# hands per card matrix of the common random numbers engine
+CRN_BATCH_SIZE = 200_000
+
+def strategy_grid():
+    ''' list of (name, Strategy) pairs in table order
+    '''
+    grid = list()
+    for value in STAND_ON_VALUES:
+        for strategy in STRATEGIES:
+            # hard strategy = hit on soft, soft strategy = stand on soft
+            grid.append((f'{strategy}{value}', Strategy(value, strategy == 'S')))
+    return grid
+
+def player_wins(player_hand, dealer_hand):
+    ''' True if the player hand beats the dealer hand
+    '''
+    # player bust?: DEALER WINS
+    if player_hand.is_bust() == True:
+        return False
+    # dealer bust?: PLAYER WINS
+    elif dealer_hand.is_bust() == True:
+        return True
+    # player has blackjack and dealer doesn't: PLAYER WINS
+    elif player_hand.is_blackjack() == True and dealer_hand.is_blackjack() == False:
+        return True
+    # dealer has blackjack and player doesn't: DEALER WINS
+    elif player_hand.is_blackjack() == False and dealer_hand.is_blackjack() == True:
+        return False
+    # if both have 21, but player has blackjack and dealer doesn't: PLAYER WINS
+    elif player_hand.total == dealer_hand.total and player_hand.is_blackjack() == True:
+        return True
+    # player total equals dealer total: TIE
+    elif player_hand.total == dealer_hand.total:
+        return False
+    # player hand greater than dealer hand: PLAYER WINS
+    else:
+        return player_hand.total > dealer_hand.total
+
+def play_matchup(player_strat, dealer_strat, n, shoe = None):
+    ''' play n hands with Hand objects and return the number of player wins,
+        dealing from shoe if one is given
+    '''
+    wins = 0
+    # the same two hands are reset and replayed every time
+    player_hand = Hand()
+    dealer_hand = Hand()
+    for i in range(n):
+        # reshuffle between rounds once the cut card is reached
+        if shoe is not None and shoe.needs_shuffle():
+            shoe.shuffle()
+        player_strat.play(player_hand, shoe)
+        dealer_strat.play(dealer_hand, shoe)
+        if player_wins(player_hand, dealer_hand):
+            wins += 1
+    return wins
+
+def _play_hands(strategy, first, second, deal):
+    ''' play one hand per pair of first two cards, deal(active) returns the
+        next card of each hand in the index array active
+    '''
+    hard = CARD_VALUE_ARRAY[first] + CARD_VALUE_ARRAY[second]
+    has_ace = (first == 1) | (second == 1)
+    blackjack = has_ace & (hard == 11)
+
+    # one ace counts as 11 if it would not bust the hand
+    soft = has_ace & (hard < 12)
+    totals = hard + 10 * soft
+
+    # only the hands that still have to hit are dealt another card
+    hitting = (totals < strategy.stand_on_value) | \
+              ((totals == strategy.stand_on_value) & soft & (not strategy.stand_on_soft))
+    active = np.flatnonzero(hitting)
+    while active.size:
+        card = deal(active)
+        hard[active] += CARD_VALUE_ARRAY[card]
+        has_ace[active] |= card == 1
+
+        soft = has_ace[active] & (hard[active] < 12)
+        new_totals = hard[active] + 10 * soft
+        totals[active] = new_totals
+
+        hitting = (new_totals < strategy.stand_on_value) | \
+                  ((new_totals == strategy.stand_on_value) & soft & (not strategy.stand_on_soft))
+        active = active[hitting]
+
+    return totals, blackjack
+
+def play_hands_numpy(strategy, n, rng):
+    ''' play n hands at once and return arrays of (totals, blackjacks)
+    '''
+    # deal the first two cards of every hand as one block
+    cards = rng.integers(1, 14, size = (n, 2))
+    return _play_hands(strategy, cards[:, 0], cards[:, 1],
+                       lambda active: rng.integers(1, 14, size = active.size))
+
+def count_player_wins(player_totals, player_bj, dealer_totals):
+    ''' number of hands the player won, from arrays of hand results
+    '''
+    # same rules as player_wins(): a player blackjack always wins, otherwise
+    # the player needs to stay under 22 and beat (or bust) the dealer
+    player_ok = player_totals < 22
+    won = player_ok & ((dealer_totals > 21) | player_bj | (player_totals > dealer_totals))
+    return int(np.count_nonzero(won))
+
+def play_matchup_numpy(player_strat, dealer_strat, n, rng, batch_size = BATCH_SIZE):
+    ''' play n hands in numpy batches and return the number of player wins
+    '''
+    wins = 0
+    while n > 0:
+        size = min(n, batch_size)
+        player_totals, player_bj = play_hands_numpy(player_strat, size, rng)
+        dealer_totals, dealer_bj = play_hands_numpy(dealer_strat, size, rng)
+        wins += count_player_wins(player_totals, player_bj, dealer_totals)
+        n -= size
+    return wins
+
+def play_hands_shoes(strategy, shoes, cursor, rng):
+    ''' play one hand from each shoe (row of shoes), dealing at the shoe's
+        cursor, and return arrays of (totals, blackjacks)
+    '''
+    def deal(active):
+        # swap a random card that has not been dealt yet with the card at
+        # the cursor and deal it, so the shoes are shuffled as they are dealt
+        dealt = cursor[active]
+        top = tops[active] + dealt
+        pick = top + (rng.random(active.size) * (num_cards - dealt)).astype(np.int64)
+        card = cards[pick]
+        cards[pick] = cards[top]
+        cards[top] = card
+        cursor[active] = dealt + 1
+        return card
+
+    def deal_everyone():
+        # deal() for every shoe, without picking out the cursors
+        top = tops + cursor
+        pick = top + (rng.random(cursor.size) * (num_cards - cursor)).astype(np.int64)
+        card = cards[pick]
+        cards[pick] = cards[top]
+        cards[top] = card
+        cursor[:] += 1
+        return card
+
+    # flat indices into the shoes are cheaper than (row, column) pairs
+    num_cards = shoes.shape[1]
+    cards = shoes.reshape(-1)
+    tops = np.arange(0, cards.size, num_cards)
+
+    first = deal_everyone()
+    second = deal_everyone()
+    return _play_hands(strategy, first, second, deal)
+
+def play_matchup_shoes(player_strat, dealer_strat, n, rng, num_decks,
+                       penetration = PENETRATION, num_shoes = NUM_SHOES):
+    ''' play n hands from finite shoes and return the number of player wins
+
+        Each shoe is dealt one round after the other exactly like a Shoe,
+        the shoes themselves are played side by side as one array.
+    '''
+    # every shoe should play enough rounds to go through several shuffles
+    num_shoes = max(1, min(num_shoes, n // ROUNDS_PER_SHOE))
+    cut = cut_card(num_decks, penetration, ROUND_HANDS)
+    # the cards are shuffled as they are dealt, so the shoes can start in
+    # any order
+    shoes = np.tile(new_deck(num_decks), (num_shoes, 1))
+    cursor = np.zeros(num_shoes, dtype = np.int64)
+
+    wins = 0
+    while n > 0:
+        # the shoes that reached the cut card are reshuffled by dealing them
+        # from the top again
+        cursor[cursor >= cut] = 0
+
+        # the last round may only need the first few shoes
+        size = min(n, num_shoes)
+        player_totals, player_bj = play_hands_shoes(player_strat, shoes[:size], cursor[:size], rng)
+        dealer_totals, dealer_bj = play_hands_shoes(dealer_strat, shoes[:size], cursor[:size], rng)
+        # cut_card() keeps a whole round behind the cut card, so a shoe is
+        # never dealt past its last card (and into the next shoe)
+        assert cursor[:size].max() <= shoes.shape[1], "a round ran past the end of its shoe"
+        wins += count_player_wins(player_totals, player_bj, dealer_totals)
+        n -= size
+    return wins
+
+# probability of drawing each card value (10, J, Q and K are all worth 10)
+CARD_PROBS = [(value, 1/13) for value in range(1, 10)] + [(10, 4/13)]
+
+# final outcomes of a hand: totals 0-21, 22 = bust, 23 = blackjack
+BUST = 22
+BLACKJACK = 23
+
+def _deal(state):
+    ''' deal one card to every (ace, hard total) state, return (state, bust)
+    '''
+    new_state = np.zeros_like(state)
+    bust = np.zeros(len(state))
+    for value, prob in CARD_PROBS:
+        if value == 1:
+            # an ace moves every hand into the "has an ace" half
+            new_state[:, 1, 1:] += prob * state[:, :, :-1].sum(axis = 1)
+        else:
+            new_state[:, :, value:] += prob * state[:, :, :-value]
+        bust += prob * state[:, :, BUST - value:].sum(axis = (1, 2))
+    return new_state, bust
+
+def outcome_matrix(strategies):
+    ''' exact probability of every final outcome (see BUST, BLACKJACK) of
+        strategy.play() for each strategy, one row per strategy
+    '''
+    num_strats = len(strategies)
+    stand_on_value = np.array([strat.stand_on_value for strat in strategies])[:, None, None]
+    stand_on_soft = np.array([strat.stand_on_soft for strat in strategies])[:, None, None]
+
+    # hands that are still live are indexed by (has ace, hard total below 22)
+    hard = np.arange(BUST)
+    soft = np.array([np.zeros(BUST, dtype = bool), hard + 10 < 22])
+    totals = hard + 10 * soft
+
+    # same rules as Strategy.stand() for every strategy and state
+    stands = (totals > stand_on_value) | \
+             ((totals == stand_on_value) & (~soft | stand_on_soft))
+
+    # maps each (has ace, hard total) state to its final total
+    to_total = np.zeros((2 * BUST, 24))
+    to_total[np.arange(2 * BUST), totals.ravel()] = 1
+
+    outcomes = np.zeros((num_strats, 24))
+
+    # the first two cards are always dealt before any decision
+    state = np.zeros((num_strats, 2, BUST))
+    state[:, 0, 0] = 1
+    for i in range(2):
+        state, bust = _deal(state)
+    outcomes[:, BLACKJACK] = state[:, 1, 11]
+    state[:, 1, 11] = 0
+
+    # every card adds at least one point, so all hands finish within 22 cards
+    while state.any():
+        stood = np.where(stands, state, 0)
+        outcomes += stood.reshape(num_strats, 2 * BUST) @ to_total
+        state, bust = _deal(state - stood)
+        outcomes[:, BUST] += bust
+
+    return outcomes
+
+def final_outcomes(strategy):
+    ''' exact probability of every final outcome of strategy.play()
+    '''
+    return outcome_matrix([strategy])[0]
+
+def win_probability(player_strat, dealer_strat):
+    ''' exact probability that the player beats the dealer
+    '''
+    player_probs = final_outcomes(player_strat)
+    dealer_probs = final_outcomes(dealer_strat)
+
+    # same rules as player_wins(): a player blackjack always wins, otherwise
+    # the player needs to stay under 22 and beat (or bust) the dealer
+    prob = player_probs[BLACKJACK]
+    for player_total in range(BUST):
+        beaten = dealer_probs[BUST] + sum(dealer_probs[:player_total])
+        prob += player_probs[player_total] * beaten
+    return prob
+
+def exact_wins():
+    ''' exact version of count_wins() with probabilities instead of counts
+    '''
+    outcomes = outcome_matrix([strat for name, strat in strategy_grid()])
+
+    # beaten[d, t] = probability that dealer strategy d busts or ends below t
+    below = np.cumsum(outcomes[:, :BUST], axis = 1) - outcomes[:, :BUST]
+    beaten = below + outcomes[:, BUST:BUST + 1]
+
+    # same convolution as win_probability() for every pair at once
+    wins = outcomes[:, :BUST] @ beaten.T + outcomes[:, BLACKJACK:BLACKJACK + 1]
+    return wins.tolist()
+
+def split_shards(n, shard_size = SHARD_SIZE):
+    ''' split n hands into a list of shard sizes of at most shard_size
+    '''
+    shards = [shard_size] * (n // shard_size)
+    if n % shard_size:
+        shards.append(n % shard_size)
+    return shards
+
+def make_tasks(n, engine = 'object', seed = None, shard_size = SHARD_SIZE, num_decks = None,
+               penetration = PENETRATION):
+    ''' one (player, dealer, n, engine, seed, num_decks, penetration) task
+        per shard of every cell, num_decks = None is an infinite deck
+    '''
+    num_strats = len(strategy_grid())
+    cells = [(p, d, size) for p in range(num_strats)
+                          for d in range(num_strats)
+                          for size in split_shards(n, shard_size)]
+
+    # every shard gets its own independent stream, in a fixed order so that
+    # a seeded run gives the same table whatever the number of processes
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(len(cells))
+    return [(p, d, size, engine, s, num_decks, penetration) for (p, d, size), s in zip(cells, seeds)]
+
+def cell_player(player_index, dealer_index, engine, seed, num_decks, penetration):
+    ''' function that plays n more hands of a cell and returns the player wins
+    '''
+    grid = strategy_grid()
+    player_strat = grid[player_index][1]
+    dealer_strat = grid[dealer_index][1]
+    rng = np.random.default_rng(seed)
+
+    if engine == 'numpy' and num_decks is not None:
+        return lambda n: play_matchup_shoes(player_strat, dealer_strat, n, rng, num_decks, penetration)
+    elif engine == 'numpy':
+        return lambda n: play_matchup_numpy(player_strat, dealer_strat, n, rng)
+    elif num_decks is not None:
+        shoe = Shoe(num_decks, penetration, rng, ROUND_HANDS)
+        return lambda n: play_matchup(player_strat, dealer_strat, n, shoe)
+    else:
+        random.seed(int(seed.generate_state(1)[0]))
+        return lambda n: play_matchup(player_strat, dealer_strat, n)
+
+def run_shard(task):
+    ''' play one shard of a cell and return (player, dealer, wins)
+    '''
+    player_index, dealer_index, n, engine, seed, num_decks, penetration = task
+    play = cell_player(player_index, dealer_index, engine, seed, num_decks, penetration)
+    return player_index, dealer_index, play(n)
+
+def count_wins(n, engine = 'object', seed = None, processes = 1, shard_size = SHARD_SIZE,
+               num_decks = None, penetration = PENETRATION):
+    ''' simulate every player/dealer pair and return a matrix of win counts
+    '''
+    tasks = make_tasks(n, engine, seed, shard_size, num_decks, penetration)
+    num_strats = len(strategy_grid())
+    wins = [[0] * num_strats for i in range(num_strats)]
+
+    if processes == 1:
+        for player_index, dealer_index, shard_wins in map(run_shard, tasks):
+            wins[player_index][dealer_index] += shard_wins
+    else:
+        # processes = None uses every core
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.imap_unordered(run_shard, tasks)
+            for player_index, dealer_index, shard_wins in results:
+                wins[player_index][dealer_index] += shard_wins
+
+    return wins
+
+def root_seed(entropy, generation = 0):
+    ''' SeedSequence of one generation of a checkpointed run, generation 0 is
+        the same stream as an ordinary run with that seed
+    '''
+    if generation == 0:
+        return np.random.SeedSequence(entropy)
+    return np.random.SeedSequence([entropy, generation])
+
+def new_checkpoint(n, engine = 'object', seed = None, shard_size = SHARD_SIZE, num_decks = None,
+                   penetration = PENETRATION):
+    ''' checkpoint state of a run that has not played any hands yet
+    '''
+    num_strats = len(strategy_grid())
+    num_tasks = num_strats * num_strats * len(split_shards(n, shard_size))
+    return {'entropy': np.random.SeedSequence(seed).entropy,
+            'generation': 0,
+            'engine': engine,
+            'shard_size': shard_size,
+            'num_decks': num_decks,
+            'penetration': penetration,
+            'n': n,                         # hands per cell of this generation
+            'base_n': 0,                    # hands per cell of earlier generations
+            'done': np.zeros(num_tasks, dtype = bool),
+            'wins': np.zeros((num_strats, num_strats), dtype = np.int64)}
+
+def save_checkpoint(file_name, state):
+    ''' write the checkpoint state, replacing the old file only once the new
+        one is complete
+    '''
+    tmp_name = file_name + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        np.savez_compressed(f,
+                            entropy = str(state['entropy']),
+                            generation = state['generation'],
+                            engine = state['engine'],
+                            shard_size = state['shard_size'],
+                            num_decks = 0 if state['num_decks'] is None else state['num_decks'],
+                            penetration = state['penetration'],
+                            n = state['n'],
+                            base_n = state['base_n'],
+                            num_tasks = len(state['done']),
+                            done = np.packbits(state['done']),
+                            wins = state['wins'])
+    os.replace(tmp_name, file_name)
+
+def load_checkpoint(file_name):
+    ''' read a checkpoint state written by save_checkpoint()
+    '''
+    with np.load(file_name) as data:
+        num_decks = int(data['num_decks'])
+        return {'entropy': int(str(data['entropy'])),
+                'generation': int(data['generation']),
+                'engine': str(data['engine']),
+                'shard_size': int(data['shard_size']),
+                'num_decks': num_decks if num_decks else None,
+                'penetration': float(data['penetration']),
+                'n': int(data['n']),
+                'base_n': int(data['base_n']),
+                'done': np.unpackbits(data['done'], count = int(data['num_tasks'])).astype(bool),
+                'wins': data['wins'].copy()}
+
+def start_generation(state, n):
+    ''' add another n hands per cell on top of a finished checkpoint state
+    '''
+    if not state['done'].all():
+        raise ValueError("Oops! The checkpoint is not finished, resume it before adding hands")
+    num_strats = len(strategy_grid())
+    state['generation'] += 1
+    state['base_n'] += state['n']
+    state['n'] = n
+    state['done'] = np.zeros(num_strats * num_strats * len(split_shards(n, state['shard_size'])), dtype = bool)
+
+def run_numbered_shard(numbered_task):
+    ''' run_shard() that also returns the number of the task
+    '''
+    task_number, task = numbered_task
+    return task_number, run_shard(task)
+
+def run_checkpointed(file_name, state, processes = 1, every = CHECKPOINT_EVERY):
+    ''' play the unfinished shards of a checkpoint state, saving it to
+        file_name at least every `every` seconds, and return the state
+    '''
+    tasks = make_tasks(state['n'], state['engine'], root_seed(state['entropy'], state['generation']),
+                       state['shard_size'], state['num_decks'], state['penetration'])
+    todo = [(i, task) for i, task in enumerate(tasks) if not state['done'][i]]
+
+    def add(results):
+        last_save = time.monotonic()
+        for task_number, (player_index, dealer_index, shard_wins) in results:
+            state['wins'][player_index, dealer_index] += shard_wins
+            state['done'][task_number] = True
+            if time.monotonic() - last_save >= every:
+                save_checkpoint(file_name, state)
+                last_save = time.monotonic()
+
+    # whatever happens, keep the shards that did finish
     try:
-        n > 0
-    except ValueError:
-        print("ValueError: Oops! Please make sure you input a positive integer for this argument")
+        if processes == 1:
+            add(map(run_numbered_shard, todo))
+        else:
+            # processes = None uses every core
+            with multiprocessing.Pool(processes) as pool:
+                add(pool.imap_unordered(run_numbered_shard, todo))
+    finally:
+        save_checkpoint(file_name, state)
+
+    return state
+
+def card_matrix(n, rng, antithetic = False):
+    ''' n rows of MAX_HAND_CARDS random cards, one row per hand; with
+        antithetic the second half of the rows mirrors the first half
+        (card c becomes 14 - c, so low cards become high cards)
+    '''
+    if not antithetic:
+        return rng.integers(1, 14, size = (n, MAX_HAND_CARDS), dtype = np.int8)
+    half = rng.integers(1, 14, size = (n // 2, MAX_HAND_CARDS), dtype = np.int8)
+    return np.concatenate([half, 14 - half])
+
+def play_hands_cards(strategy, cards):
+    ''' play one hand per row of cards, dealing each row left to right, and
+        return arrays of (totals, blackjacks)
+    '''
+    position = np.full(len(cards), 2)
+
+    def deal(active):
+        card = cards[active, position[active]]
+        position[active] += 1
+        return card
+
+    return _play_hands(strategy, cards[:, 0], cards[:, 1], deal)
+
+def run_crn_shard(task):
+    ''' play one shard of the whole grid on common random numbers and return
+        (wins, units, diff_sums, diff_squares)
+
+        Every strategy plays the same card rows, player hands from one matrix
+        and dealer hands from another. A unit is one hand, or one antithetic
+        pair of hands. diff_sums and diff_squares add up, per unit, the win
+        difference between neighbouring dealer columns and its square.
+    '''
+    n, seed, antithetic = task
+    rng = np.random.default_rng(seed)
+    strats = [strat for name, strat in strategy_grid()]
+    num_strats = len(strats)
+
+    wins = np.zeros((num_strats, num_strats), dtype = np.int64)
+    diff_sums = np.zeros((num_strats, num_strats - 1))
+    diff_squares = np.zeros((num_strats, num_strats - 1))
+    units = 0
+
+    while n > 0:
+        # with antithetic, n and CRN_BATCH_SIZE are even so a batch is whole pairs
+        size = min(n, CRN_BATCH_SIZE)
+        player_cards = card_matrix(size, rng, antithetic)
+        dealer_cards = card_matrix(size, rng, antithetic)
+
+        # every strategy only plays each card matrix once
+        player_hands = [play_hands_cards(strat, player_cards) for strat in strats]
+        dealer_totals = np.array([play_hands_cards(strat, dealer_cards)[0] for strat in strats])
+
+        for p, (player_totals, player_bj) in enumerate(player_hands):
+            # same rules as player_wins(), one row of dealer strategies at a time
+            won = (player_totals < 22) & ((dealer_totals > 21) | player_bj | (player_totals > dealer_totals))
+            wins[p] += won.sum(axis = 1)
+
+            per_unit = won.astype(np.float64)
+            if antithetic:
+                per_unit = (per_unit[:, :size // 2] + per_unit[:, size // 2:]) / 2
+            diff = per_unit[1:] - per_unit[:-1]
+            diff_sums[p] += diff.sum(axis = 1)
+            diff_squares[p] += (diff ** 2).sum(axis = 1)
+
+        units += size // 2 if antithetic else size
+        n -= size
+
+    return wins, units, diff_sums, diff_squares
+
+def count_wins_crn(n, seed = None, processes = 1, shard_size = SHARD_SIZE, antithetic = False):
+    ''' simulate the whole grid on common random numbers and return (wins,
+        hands, variance reduction factors)
 
-    stand_on_values = [ x for x in range(13,21)] # stand on values
-    strategies = ['H', 'S'] # strategies: H = hard, S = soft
+        The factor of each pair of neighbouring dealer columns is the
+        variance of the difference of their win % with independent hands,
+        divided by the measured variance of that difference. With
+        antithetic, hands are played in pairs and an odd n is rounded up
+        to the next pair.
+    '''
+    if antithetic:
+        # split whole pairs, a shard never plays half of one
+        shards = [2 * pairs for pairs in split_shards((n + 1) // 2, max(1, shard_size // 2))]
+    else:
+        shards = split_shards(n, shard_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(shards))
+    tasks = [(size, s, antithetic) for size, s in zip(shards, seeds)]
+
+    if processes == 1:
+        results = list(map(run_crn_shard, tasks))
+    else:
+        # processes = None uses every core
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(run_crn_shard, tasks)
+
+    wins = sum(result[0] for result in results)
+    units = sum(result[1] for result in results)
+    diff_sums = sum(result[2] for result in results)
+    diff_squares = sum(result[3] for result in results)
+    hands = 2 * units if antithetic else units
+
+    # variance of one unit's difference, then of the mean difference
+    mean_diff = diff_sums / units
+    measured = (diff_squares / units - mean_diff ** 2) / units
+
+    # the same number of independent hands per cell
+    p = wins / hands
+    independent = (p[:, 1:] * (1 - p[:, 1:]) + p[:, :-1] * (1 - p[:, :-1])) / hands
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        factors = np.where(measured > 0, independent / measured, np.inf)
+    return wins.tolist(), hands, factors
+
+def make_factor_table(factors):
+    ''' table of the variance reduction factor of every pair of neighbouring
+        dealer columns
+    '''
+    grid = strategy_grid()
+    names = [name for name, strat in grid]
+    table = [['P-Strategy'] + [f'D-{a} vs D-{b}' for a, b in zip(names[:-1], names[1:])]]
+    for name, row in zip(names, factors):
+        table.append([f'P-{name}'] + [round(float(factor), 2) for factor in row])
+    return table
+
+def half_width(count, n, z = Z_95):
+    ''' half-width in percent of the normal confidence interval of count / n
+    '''
+    p = count / n
+    return z * math.sqrt(p * (1 - p) / n) * 100
+
+def run_adaptive_cell(task):
+    ''' play a cell in batches until the win % is within target of its
+        estimate (or max_n hands are played), return (player, dealer, wins, n)
+    '''
+    player_index, dealer_index, target, max_n, engine, seed, num_decks, penetration = task
+    play = cell_player(player_index, dealer_index, engine, seed, num_decks, penetration)
+
+    wins = 0
+    n = 0
+    size = ADAPTIVE_BATCH
+    while True:
+        size = min(size, max_n - n)
+        wins += play(size)
+        n += size
+        if n >= max_n or half_width(wins, n) <= target:
+            return player_index, dealer_index, wins, n
+
+        # the half-width shrinks with 1/sqrt(n), aim straight for the target
+        needed = n * (half_width(wins, n) / target) ** 2
+        size = max(ADAPTIVE_BATCH, math.ceil(needed) - n)
+
+def count_wins_adaptive(target, max_n, engine = 'object', seed = None, processes = 1,
+                        num_decks = None, penetration = PENETRATION):
+    ''' simulate every player/dealer pair to a target CI half-width and
+        return matrices of win counts and hands played
+    '''
+    num_strats = len(strategy_grid())
+    cells = [(p, d) for p in range(num_strats) for d in range(num_strats)]
+    seeds = np.random.SeedSequence(seed).spawn(len(cells))
+    tasks = [(p, d, target, max_n, engine, s, num_decks, penetration) for (p, d), s in zip(cells, seeds)]
+
+    wins = [[0] * num_strats for i in range(num_strats)]
+    hands = [[0] * num_strats for i in range(num_strats)]
+    if processes == 1:
+        results = map(run_adaptive_cell, tasks)
+        for player_index, dealer_index, cell_wins, n in results:
+            wins[player_index][dealer_index] = cell_wins
+            hands[player_index][dealer_index] = n
+    else:
+        # processes = None uses every core
+        with multiprocessing.Pool(processes) as pool:
+            for player_index, dealer_index, cell_wins, n in pool.imap_unordered(run_adaptive_cell, tasks):
+                wins[player_index][dealer_index] = cell_wins
+                hands[player_index][dealer_index] = n
+
+    return wins, hands
+
+def make_adaptive_table(wins, hands):
+    ''' one row per strategy pair with the win %, its CI half-width and the
+        number of hands played
+    '''
+    grid = strategy_grid()
+    table = [['P-Strategy', 'D-Strategy', 'Win %', 'CI +/-', 'Hands']]
+    for (player_name, player_strat), row_wins, row_hands in zip(grid, wins, hands):
+        for (dealer_name, dealer_strat), count, n in zip(grid, row_wins, row_hands):
+            table.append([f'P-{player_name}', f'D-{dealer_name}',
+                          round((count/n)*100,2), round(half_width(count, n),3), n])
+    return table
+
+def make_table(wins, n):
+    ''' turn a matrix of win counts over n hands into the win % table
+    '''
+    grid = strategy_grid()
 
     table = list() # initialize empty list
 
     # get column names as first row in table
     col_names = collections.deque(['P-Strategy'])
-    for value in stand_on_values:
-        for strategy in strategies:
-            col_names.append(f"D-{strategy}{value}")
+    for name, strat in grid:
+        col_names.append(f"D-{name}")
     table.append(list(col_names))
 
-    # this section if for each of the player strategies
-    for player_value in stand_on_values:
-        for player_strategy in strategies:
-        
-            if player_strategy == 'H': # hard strategy = hit on soft
-                player_stand_on_soft = False
-                player_strat_name = f'P-H{player_value}'
-            else:
-                player_stand_on_soft = True # soft strategy = stand on soft
-                player_strat_name = f'P-S{player_value}'
-            
-            # instantiate player strategy
-            player_strat = Strategy(player_value, player_stand_on_soft)
-            
-            row = list() # initialize empty row
-            row.append(player_strat_name)
-        
-            # this section is for each of the dealer strategies
-            for dealer_value in stand_on_values:
-                for dealer_strategy in strategies:
-                
-                    if dealer_strategy == 'H': # hard strategy = hit on soft
-                        dealer_stand_on_soft = False
-                    else:
-                        dealer_stand_on_soft = True # soft strategy = stand on soft
-
-                    # instantiate dealer strategy
-                    dealer_strat = Strategy(dealer_value, dealer_stand_on_soft)
-                
-                    player_wins = 0 # initialize player wins
-
-                    # loop over the number of simulations
-                    for i in range(n):
-                        player_hand = player_strat.play()
-                        # player bust?: DEALER WINS
-                        if player_hand.is_bust() == True:
-                            next
-                    
-                        # play dealer's hand
-                        dealer_hand = dealer_strat.play()
-            
-                        # dealer bust?: PLAYER WINS
-                        if dealer_hand.is_bust() == True:
-                            player_wins += 1
-                        # player has blackjack and dealer doesn't: PLAYER WINS
-                        elif player_hand.is_blackjack() == True and dealer_hand.is_blackjack() == False:
-                            player_wins += 1
-                        # dealer has blackjack and player doesn't: DEALER WINS
-                        elif player_hand.is_blackjack() == False and dealer_hand.is_blackjack() == True:
-                            next
-                        # if both have 21, but player has blackjack and dealer doesn't: PLAYER WINS
-                        elif player_hand.total == dealer_hand.total and player_hand.is_blackjack() == True:
-                            player_wins += 1
-                        # if both have 21, but dealer has blackjack and player doesn't: DEALER WINS
-                        elif player_hand.total == dealer_hand.total and dealer_hand.is_blackjack() == True:
-                            next
-                        # player total equals dealer total: TIE
-                        elif player_hand.total == dealer_hand.total:
-                            next
-                        # player hand greater than dealer hand: PLAYER WINS
-                        elif player_hand.total > dealer_hand.total:
-                            player_wins += 1
-                        else:
-                            next
-                    row.append(round((player_wins/n)*100,2)) # append value to row
-        
-            table.append(row) # append row to table
-
-    # write table to a csv
-    with open('output.csv', 'w') as f:
+    # one row for each of the player strategies
+    for (player_name, player_strat), row_wins in zip(grid, wins):
+        row = [f'P-{player_name}']
+        for count in row_wins:
+            row.append(round((count/n)*100,2)) # append value to row
+        table.append(row) # append row to table
+
+    return table
+
+def build_table(n, engine = 'object', seed = None, processes = 1, shard_size = SHARD_SIZE,
+                num_decks = None, penetration = PENETRATION):
+    ''' simulate every player/dealer strategy pair and return the win % table
+    '''
+    return make_table(count_wins(n, engine, seed, processes, shard_size, num_decks, penetration), n)
+
+def write_table(table, file_name = 'output.csv'):
+    ''' write table to a csv
+    '''
+    with open(file_name, 'w') as f:
         writer = csv.writer(f)
         writer.writerows(table)
 
+def positive_int(value):
+    ''' argparse type for the number of simulations
+    '''
+    try:
+        n = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Oops! Did you input a string? Please, input an integer")
+    if n <= 0:
+        raise argparse.ArgumentTypeError("Oops! Please make sure you input a positive integer for this argument")
+    return n
+
+def main():
+    ''' simulate n blackjack hands
+    '''
+    parser = argparse.ArgumentParser(description = 'simulate blackjack strategies against each other')
+    parser.add_argument('n', metavar = '<n>', type = positive_int, nargs = '?',
+                        help = 'number of hands per strategy pair (the most hands with --half-width)')
+    parser.add_argument('-e', '--engine', choices = ['object', 'numpy', 'exact'], default = 'object', dest = 'engine',
+                        help = 'object plays Hand objects one at a time, numpy plays batches of hands as arrays, '
+                               'exact computes the win probabilities without simulating')
+    parser.add_argument('--seed', type = int, default = None, dest = 'seed', help = 'seed for a reproducible table')
+    parser.add_argument('-p', '--processes', type = int, default = 1, dest = 'processes',
+                        help = 'number of worker processes, 0 uses every core')
+    parser.add_argument('--shard-size', type = positive_int, default = SHARD_SIZE, dest = 'shard_size',
+                        help = 'largest number of hands of one cell given to a worker')
+    parser.add_argument('-d', '--decks', type = positive_int, default = None, dest = 'decks',
+                        help = 'deal from a shoe of this many decks instead of an infinite deck')
+    parser.add_argument('--penetration', type = float, default = PENETRATION, dest = 'penetration',
+                        help = 'fraction of the shoe dealt before it is reshuffled')
+    parser.add_argument('-w', '--half-width', type = float, default = None, dest = 'half_width',
+                        help = 'play each pair until the 95%% CI of its win %% is this many points wide either side')
+    parser.add_argument('-c', '--checkpoint', metavar = '<file>', default = None, dest = 'checkpoint',
+                        help = 'save progress to this file and resume from it if it exists, '
+                               'a resumed run keeps the settings it was started with')
+    parser.add_argument('--checkpoint-every', type = float, default = CHECKPOINT_EVERY, dest = 'checkpoint_every',
+                        help = 'seconds between checkpoints')
+    parser.add_argument('--merge', action = 'store_true', dest = 'merge',
+                        help = 'add <n> more hands per pair to a finished checkpoint')
+    parser.add_argument('--crn', action = 'store_true', dest = 'crn',
+                        help = 'play every pair on the same cards (numpy engine) and write the variance '
+                               'reduction of neighbouring columns to variance_reduction.csv')
+    parser.add_argument('--antithetic', action = 'store_true', dest = 'antithetic',
+                        help = 'with --crn, also play every hand on mirrored cards')
+
+    args = parser.parse_args()
+
+    if args.decks is not None:
+        try:
+            cut_card(args.decks, args.penetration, ROUND_HANDS)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.engine == 'exact':
+        if args.decks is not None:
+            parser.error('--engine exact assumes an infinite deck, it cannot be used with --decks')
+        # probabilities are wins out of a single hand
+        write_table(make_table(exact_wins(), 1))
+        return
+
+    processes = args.processes if args.processes > 0 else None
+
+    if args.antithetic and not args.crn:
+        parser.error('--antithetic needs --crn')
+
+    if args.crn:
+        if args.engine != 'numpy' or args.decks is not None or args.half_width is not None \
+           or args.checkpoint is not None:
+            parser.error('--crn only works with --engine numpy and an infinite deck, '
+                         'without --half-width or --checkpoint')
+        if args.n is None:
+            parser.error('<n> is required with --crn')
+        wins, hands, factors = count_wins_crn(args.n, args.seed, processes, args.shard_size, args.antithetic)
+        if hands != args.n:
+            print(f'--antithetic plays hands in pairs, {hands} hands were played instead of {args.n}')
+        write_table(make_table(wins, hands))
+        write_table(make_factor_table(factors), 'variance_reduction.csv')
+        print(f'Variance reduction of neighbouring columns: median {np.median(factors):.1f}x, '
+              f'min {np.min(factors):.1f}x')
+        return
+
+    if args.checkpoint is not None:
+        if args.half_width is not None:
+            parser.error('--checkpoint cannot be used with --half-width')
+
+        if os.path.exists(args.checkpoint):
+            state = load_checkpoint(args.checkpoint)
+            if args.merge:
+                if args.n is None:
+                    parser.error('<n> is required with --merge')
+                try:
+                    start_generation(state, args.n)
+                except ValueError as e:
+                    parser.error(str(e))
+            elif args.n is not None and args.n != state['base_n'] + state['n']:
+                # the hands of every merged generation
+                parser.error(f"the checkpoint is a run of {state['base_n'] + state['n']} hands, "
+                             "use --merge to add hands to it")
+        else:
+            if args.merge:
+                parser.error('--merge needs an existing checkpoint')
+            if args.n is None:
+                parser.error('<n> is required to start a checkpointed run')
+            state = new_checkpoint(args.n, args.engine, args.seed, args.shard_size, args.decks, args.penetration)
+
+        state = run_checkpointed(args.checkpoint, state, processes, args.checkpoint_every)
+        write_table(make_table(state['wins'].tolist(), state['base_n'] + state['n']))
+        return
+
+    if args.n is None:
+        parser.error('<n> is required unless --engine exact is given')
+
+    if args.half_width is not None:
+        if args.half_width <= 0:
+            parser.error('--half-width has to be positive')
+        wins, hands = count_wins_adaptive(args.half_width, args.n, args.engine, args.seed, processes,
+                                          args.decks, args.penetration)
+        write_table(make_adaptive_table(wins, hands))
+        return
+
+    table = build_table(args.n, args.engine, args.seed, processes, args.shard_size,
+                        args.decks, args.penetration)
+    write_table(table)
+
 # call the main function
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
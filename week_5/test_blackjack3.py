@@ -1,5 +1,10 @@
 """Unit tests for the blackjack program."""
+import io
+import os
+import random
+import tempfile
 import unittest
+import unittest.mock
 
 import blackjack3
 
@@ -109,6 +114,47 @@ class TestBlackjack(unittest.TestCase):
         self.assertEqual(1, hand.soft_ace_count)
         self.assertEqual(False, hand.is_blackjack()) # should not be a blackjack
 
+    def test_add_card_matches_score(self):
+        random.seed(2)
+        for i in range(200):
+            hand = blackjack3.Hand()
+            while not hand.is_bust():
+                hand.add_card()
+                rescored = blackjack3.Hand(list(hand.cards))
+                self.assertEqual(rescored.total, hand.total)
+                self.assertEqual(rescored.soft_ace_count, hand.soft_ace_count)
+
+    def test_Hand_reset(self):
+        cards = [1, 10]
+        hand = blackjack3.Hand(cards)
+        self.assertEqual(True, hand.is_blackjack())
+        # the hand keeps its own copy of the cards
+        hand.cards.append(5)
+        self.assertEqual([1, 10], cards)
+
+        hand.reset()
+        self.assertEqual([], hand.cards)
+        self.assertEqual(0, hand.total)
+        self.assertEqual(0, hand.soft_ace_count)
+        self.assertEqual(False, hand.is_blackjack())
+
+        # slots, no stray attributes
+        with self.assertRaises(AttributeError):
+            hand.decision = True
+
+    def test_Strategy_play_reuses_hand(self):
+        random.seed(4)
+        strat = blackjack3.Strategy(17, False)
+        hand = blackjack3.Hand()
+        for i in range(100):
+            self.assertIs(hand, strat.play(hand))
+            self.assertGreaterEqual(len(hand.cards), 2)
+            self.assertEqual(True, strat.stand(hand))
+            self.assertEqual(hand.total, blackjack3.Hand(hand.cards).total)
+
+        self.assertEqual('Strategy: H17', str(strat))
+        self.assertEqual('Strategy(16, True)', repr(blackjack3.Strategy(16, True)))
+
     def test_Strategy_values(self):
         strat = blackjack3.Strategy(16, True)
         self.assertEqual(16, strat.stand_on_value)
@@ -118,6 +164,11 @@ class TestBlackjack(unittest.TestCase):
         self.assertEqual(17, strat.stand_on_value)
         self.assertEqual(False, strat.stand_on_soft)
 
+        # 21 is the highest total a hand can stand on
+        self.assertGreaterEqual(blackjack3.Strategy(21, False).play().total, 21)
+        with self.assertRaises(ValueError):
+            blackjack3.Strategy(22, True)
+
     def test_Strategy_stand(self):
         STAND_ON_SOFT = True
         HIT_ON_SOFT = False
@@ -185,5 +236,273 @@ class TestBlackjack(unittest.TestCase):
         hand = blackjack3.Hand([5,5,3,4])
         self.assertEqual(True, strat.stand(hand))
 
+    def test_player_wins(self):
+        # player bust loses even if the dealer busts too
+        self.assertEqual(False, blackjack3.player_wins(blackjack3.Hand([10,10,5]), blackjack3.Hand([10,10,3])))
+        # dealer bust, player standing wins
+        self.assertEqual(True, blackjack3.player_wins(blackjack3.Hand([10,7]), blackjack3.Hand([10,10,3])))
+        # blackjack beats a three card 21
+        self.assertEqual(True, blackjack3.player_wins(blackjack3.Hand([1,12]), blackjack3.Hand([5,6,10])))
+        self.assertEqual(False, blackjack3.player_wins(blackjack3.Hand([5,6,10]), blackjack3.Hand([1,12])))
+        # ties go to the dealer
+        self.assertEqual(False, blackjack3.player_wins(blackjack3.Hand([10,8]), blackjack3.Hand([9,9])))
+        self.assertEqual(True, blackjack3.player_wins(blackjack3.Hand([10,9]), blackjack3.Hand([9,9])))
+
+    def test_numpy_hands(self):
+        rng = blackjack3.np.random.default_rng(0)
+        for name, strat in blackjack3.strategy_grid():
+            totals, blackjack = blackjack3.play_hands_numpy(strat, 10000, rng)
+            # every hand stands at or above the stand on value
+            self.assertTrue((totals >= strat.stand_on_value).all())
+            self.assertTrue((totals <= 30).all())
+            # blackjacks are always 21
+            self.assertTrue((totals[blackjack] == 21).all())
+
+    def test_numpy_engine_matches_object_engine(self):
+        n = 20000
+        random.seed(1)
+        rng = blackjack3.np.random.default_rng(1)
+        player_strat = blackjack3.Strategy(17, False)
+        dealer_strat = blackjack3.Strategy(16, True)
+        object_pct = blackjack3.play_matchup(player_strat, dealer_strat, n) / n
+        numpy_pct = blackjack3.play_matchup_numpy(player_strat, dealer_strat, n, rng, batch_size = 3000) / n
+        # both estimates are within a few standard errors of each other
+        self.assertAlmostEqual(object_pct, numpy_pct, delta = 0.02)
+
+    def test_build_table_shape(self):
+        table = blackjack3.build_table(10, engine = 'numpy', seed = 0)
+        self.assertEqual(17, len(table))
+        self.assertEqual('P-Strategy', table[0][0])
+        self.assertEqual('D-S20', table[0][-1])
+        self.assertEqual('P-H13', table[1][0])
+        for row in table[1:]:
+            self.assertEqual(17, len(row))
+
+    def test_Shoe(self):
+        shoe = blackjack3.Shoe(2, 0.5, blackjack3.np.random.default_rng(0), blackjack3.ROUND_HANDS)
+        self.assertEqual(52, shoe.cut)
+
+        cards = [shoe.draw() for i in range(104)]
+        # every card of both decks is dealt exactly once
+        self.assertEqual(sorted(list(range(1, 14)) * 8), sorted(cards))
+        self.assertEqual(True, shoe.needs_shuffle())
+
+        # an empty shoe reshuffles itself
+        shoe.draw()
+        self.assertEqual(1, shoe.cursor)
+
+        shoe.shuffle()
+        self.assertEqual(False, shoe.needs_shuffle())
+        self.assertEqual(0, shoe.cursor)
+
+        # no room left for a round after the cut card
+        with self.assertRaises(ValueError):
+            blackjack3.Shoe(1, 0.75, num_hands = blackjack3.ROUND_HANDS)
+
+    def test_Strategy_play_from_shoe(self):
+        shoe = blackjack3.Shoe(1, 0.5, blackjack3.np.random.default_rng(1))
+        hand = blackjack3.Strategy(17, True).play(shoe = shoe)
+        self.assertEqual(len(hand.cards), shoe.cursor)
+
+    def test_play_hands_shoes(self):
+        shoes = blackjack3.np.tile(blackjack3.new_deck(1), (50, 1))
+        cursor = blackjack3.np.zeros(50, dtype = blackjack3.np.int64)
+        rng = blackjack3.np.random.default_rng(2)
+        totals, blackjacks = blackjack3.play_hands_shoes(blackjack3.Strategy(17, True), shoes, cursor, rng)
+        for row in range(50):
+            # every hand is made of the cards in front of the cursor
+            hand = blackjack3.Hand(shoes[row, :cursor[row]].tolist())
+            self.assertEqual(hand.total, totals[row])
+            self.assertEqual(hand.total == 21 and cursor[row] == 2, blackjacks[row])
+            # and the shoe still holds the whole deck
+            self.assertEqual(sorted(list(range(1, 14)) * 4), sorted(shoes[row].tolist()))
+
+    def test_play_matchup_shoes_stays_in_shoe(self):
+        # the longest hands, from shoes cut as deep as a round allows
+        strategy = blackjack3.Strategy(20, False)
+        cut = blackjack3.cut_card(2, 0.75, blackjack3.ROUND_HANDS)
+        self.assertEqual(78, cut)
+        rng = blackjack3.np.random.default_rng(3)
+        wins = blackjack3.play_matchup_shoes(strategy, strategy, 20000, rng, 2, 0.75, num_shoes = 50)
+        self.assertTrue(0 < wins < 20000)
+
+    def test_shoe_engines_match_exact(self):
+        n = 20000
+        player_strat = blackjack3.Strategy(17, False)
+        dealer_strat = blackjack3.Strategy(16, True)
+        exact = blackjack3.win_probability(player_strat, dealer_strat)
+        rng = blackjack3.np.random.default_rng(6)
+
+        # a deep 8 deck shoe is close to an infinite deck
+        wins = blackjack3.play_matchup_shoes(player_strat, dealer_strat, n, rng, 8, num_shoes = 100)
+        self.assertAlmostEqual(exact, wins / n, delta = 0.02)
+
+        wins = blackjack3.play_matchup(player_strat, dealer_strat, n, blackjack3.Shoe(8, rng = rng, num_hands = blackjack3.ROUND_HANDS))
+        self.assertAlmostEqual(exact, wins / n, delta = 0.02)
+
+    def test_split_shards(self):
+        self.assertEqual([10], blackjack3.split_shards(10, 100))
+        self.assertEqual([4, 4, 2], blackjack3.split_shards(10, 4))
+        self.assertEqual([5, 5], blackjack3.split_shards(10, 5))
+
+    def test_parallel_table_is_reproducible(self):
+        # same seed gives the same counts whatever the number of processes
+        serial = blackjack3.count_wins(50, 'numpy', seed = 3, processes = 1, shard_size = 20)
+        parallel = blackjack3.count_wins(50, 'numpy', seed = 3, processes = 2, shard_size = 20)
+        self.assertEqual(serial, parallel)
+
+        serial = blackjack3.count_wins(5, 'object', seed = 3, processes = 1)
+        parallel = blackjack3.count_wins(5, 'object', seed = 3, processes = 2)
+        self.assertEqual(serial, parallel)
+
+    def test_final_outcomes(self):
+        for name, strat in blackjack3.strategy_grid():
+            probs = blackjack3.final_outcomes(strat)
+            self.assertAlmostEqual(1.0, sum(probs))
+            # never stands below the stand on value
+            self.assertEqual(0.0, sum(probs[:strat.stand_on_value]))
+            # ace and a ten valued card: 2 * 1/13 * 4/13
+            self.assertAlmostEqual(8/169, probs[blackjack3.BLACKJACK])
+
+    def test_exact_wins_matrix(self):
+        exact = blackjack3.exact_wins()
+        grid = blackjack3.strategy_grid()
+        for p in range(len(grid)):
+            for d in range(len(grid)):
+                self.assertAlmostEqual(blackjack3.win_probability(grid[p][1], grid[d][1]), exact[p][d])
+
+    def test_exact_wins_match_simulation(self):
+        n = 20000
+        rng = blackjack3.np.random.default_rng(5)
+        exact = blackjack3.exact_wins()
+        grid = blackjack3.strategy_grid()
+        for p, d in [(0, 0), (3, 12), (9, 8), (15, 1), (15, 15)]:
+            wins = blackjack3.play_matchup_numpy(grid[p][1], grid[d][1], n, rng)
+            self.assertAlmostEqual(exact[p][d], wins / n, delta = 0.015)
+
+    def test_card_matrix(self):
+        rng = blackjack3.np.random.default_rng(0)
+        cards = blackjack3.card_matrix(100, rng)
+        self.assertEqual((100, blackjack3.MAX_HAND_CARDS), cards.shape)
+        self.assertTrue(((cards >= 1) & (cards <= 13)).all())
+        # antithetic rows mirror the first half
+        cards = blackjack3.card_matrix(100, rng, antithetic = True)
+        self.assertTrue((cards[50:] == 14 - cards[:50]).all())
+
+    def test_play_hands_cards_matches_object_engine(self):
+        rng = blackjack3.np.random.default_rng(2)
+        cards = blackjack3.card_matrix(200, rng)
+        for name, strat in blackjack3.strategy_grid():
+            totals, blackjack = blackjack3.play_hands_cards(strat, cards)
+            for row, total, bj in zip(cards, totals, blackjack):
+                # the object engine dealt the same row of cards
+                deck = iter(row.tolist())
+                with unittest.mock.patch('random.randint', lambda a, b: next(deck)):
+                    hand = strat.play()
+                self.assertEqual(hand.total, total)
+                self.assertEqual(hand.is_blackjack(), bj)
+
+    def test_crn_wins_match_exact(self):
+        n = 20000
+        exact = blackjack3.np.array(blackjack3.exact_wins())
+        for antithetic in [False, True]:
+            wins, hands, factors = blackjack3.count_wins_crn(n, seed = 4, antithetic = antithetic)
+            self.assertEqual(n, hands)
+            self.assertTrue((abs(blackjack3.np.array(wins) / n - exact) < 0.02).all())
+            # neighbouring dealer columns are compared far more precisely
+            self.assertTrue((factors > 2).all())
+
+    def test_crn_antithetic_pairs(self):
+        # an odd n is rounded up to whole pairs once, whatever the shards
+        for n, shard_size, expected in [(51, 20, 52), (50, 25, 50), (7, 1, 8)]:
+            wins, hands, factors = blackjack3.count_wins_crn(n, seed = 5, shard_size = shard_size, antithetic = True)
+            self.assertEqual(expected, hands)
+
+    def test_crn_is_reproducible(self):
+        serial = blackjack3.count_wins_crn(50, seed = 3, processes = 1, shard_size = 20)
+        parallel = blackjack3.count_wins_crn(50, seed = 3, processes = 2, shard_size = 20)
+        self.assertEqual(serial[0], parallel[0])
+        self.assertTrue((serial[2] == parallel[2]).all())
+
+    def test_half_width(self):
+        self.assertAlmostEqual(1.96 * 5, blackjack3.half_width(50, 100))
+        self.assertEqual(0.0, blackjack3.half_width(0, 100))
+
+    def test_adaptive_cell(self):
+        seed = blackjack3.np.random.SeedSequence(8)
+        task = (0, 15, 0.5, 10**7, 'numpy', seed, None, blackjack3.PENETRATION)
+        player_index, dealer_index, wins, n = blackjack3.run_adaptive_cell(task)
+        self.assertEqual((0, 15), (player_index, dealer_index))
+        self.assertLessEqual(blackjack3.half_width(wins, n), 0.5)
+        # p is about 0.62, so roughly 36000 hands are needed
+        self.assertLess(n, 60000)
+
+        # the most hands wins over the precision
+        task = (0, 15, 0.01, 1000, 'object', seed, None, blackjack3.PENETRATION)
+        self.assertEqual(1000, blackjack3.run_adaptive_cell(task)[3])
+
+    def test_adaptive_table(self):
+        wins, hands = blackjack3.count_wins_adaptive(5, 2000, 'numpy', seed = 1)
+        table = blackjack3.make_adaptive_table(wins, hands)
+        self.assertEqual(['P-Strategy', 'D-Strategy', 'Win %', 'CI +/-', 'Hands'], table[0])
+        self.assertEqual(257, len(table))
+        for row in table[1:]:
+            self.assertLessEqual(row[4], 2000)
+
+    def test_checkpoint_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'run.npz')
+            state = blackjack3.new_checkpoint(30, 'numpy', seed = 2, shard_size = 20, num_decks = 6)
+            state['done'][:5] = True
+            state['wins'][1, 2] = 7
+            blackjack3.save_checkpoint(file_name, state)
+
+            loaded = blackjack3.load_checkpoint(file_name)
+            self.assertEqual(state['entropy'], loaded['entropy'])
+            self.assertEqual('numpy', loaded['engine'])
+            self.assertEqual(6, loaded['num_decks'])
+            self.assertEqual(state['done'].tolist(), loaded['done'].tolist())
+            self.assertEqual(7, loaded['wins'][1, 2])
+
+    def test_checkpoint_resume_and_merge(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_name = os.path.join(tmp_dir, 'run.npz')
+
+            # a run that stops half way gives the same counts once resumed
+            state = blackjack3.new_checkpoint(40, 'numpy', seed = 9, shard_size = 20)
+            half = len(state['done']) // 2
+            tasks = blackjack3.make_tasks(40, 'numpy', blackjack3.root_seed(state['entropy']), 20)
+            for i, task in enumerate(tasks[:half]):
+                player_index, dealer_index, wins = blackjack3.run_shard(task)
+                state['wins'][player_index, dealer_index] += wins
+                state['done'][i] = True
+            blackjack3.save_checkpoint(file_name, state)
+
+            state = blackjack3.run_checkpointed(file_name, blackjack3.load_checkpoint(file_name))
+            self.assertTrue(state['done'].all())
+            self.assertEqual(blackjack3.count_wins(40, 'numpy', seed = 9, shard_size = 20), state['wins'].tolist())
+
+            # merging more hands keeps the earlier counts
+            before = state['wins'].copy()
+            blackjack3.start_generation(state, 10)
+            with self.assertRaises(ValueError):
+                blackjack3.start_generation(state, 10)
+            state = blackjack3.run_checkpointed(file_name, state)
+            self.assertEqual(50, state['base_n'] + state['n'])
+            self.assertTrue((state['wins'] >= before).all())
+            self.assertTrue((state['wins'] <= before + 10).all())
+
+            # a resumed run is checked against the hands of every generation
+            argv = ['blackjack3.py', '-e', 'numpy', '-c', file_name]
+            with unittest.mock.patch('sys.argv', argv + ['10']), \
+                 unittest.mock.patch('sys.stderr', new_callable = io.StringIO) as stderr:
+                with self.assertRaises(SystemExit):
+                    blackjack3.main()
+            self.assertIn('a run of 50 hands', stderr.getvalue())
+            with unittest.mock.patch('sys.argv', argv + ['50']), \
+                 unittest.mock.patch.object(blackjack3, 'write_table') as write_table:
+                blackjack3.main()
+            write_table.assert_called_once_with(blackjack3.make_table(state['wins'].tolist(), 50))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -4,14 +4,74 @@
 import os
 import csv
 from collections import namedtuple
+import numpy as np
+
+# typed fields of the binary form of auto-mpg.clean.txt, as small as their
+# values allow; car_name is added with the width of the longest name
+RECORD_FIELDS = [('mpg', 'f8'), ('cylinders', 'i1'), ('displacement', 'f8'), ('horsepower', 'f8'),
+                 ('weight', 'f8'), ('acceleration', 'f8'), ('model_year', 'i2'), ('origin', 'i1')]
+
+# values of auto-mpg.clean.txt that mark a missing value
+MISSING_VALUES = ['?', '']
+
+# missing values of the integer fields; float fields use nan
+MISSING_INT = -1
+
+def to_binary(clean_file, binary_file):
+    # write the typed records of clean_file to binary_file and return them;
+    # weeks 7 and 8 convert their clean files with this too
+
+    # initialize a namedtuple object
+    Record = namedtuple('Record', ['mpg', 'cylinders', 'displacement', 'horsepower', 'weight', \
+                                   'acceleration', 'model_year', 'origin', 'car_name'])
+
+    with open(clean_file, 'rt') as file:
+        reader = csv.reader(file, delimiter = " ", skipinitialspace = True)
+        records = [Record(*row) for row in reader] # * lets you use all elements of row
+
+    # convert each column in bulk; missing values (like the '?' horsepowers)
+    # become nan, or MISSING_INT in the integer fields
+    columns = list(zip(*records)) if records else [()] * len(Record._fields)
+    name_width = max([len(name) for name in columns[-1]], default = 1)
+    table = np.empty(len(records), dtype = RECORD_FIELDS + [('car_name', f'U{name_width}')])
+    for (name, dtype), column in zip(RECORD_FIELDS, columns):
+        values = np.array(column, dtype = str)
+        missing = np.isin(values, MISSING_VALUES)
+        if missing.any():
+            values = np.where(missing, 'nan' if dtype.startswith('f') else str(MISSING_INT), values)
+        table[name] = values.astype(dtype)
+    table['car_name'] = columns[-1]
+
+    np.save(binary_file, table)
+    return table
 
 class AutoMPG:
+    # no per object __dict__, millions of cars take much less memory
+    __slots__ = ('make', 'model', 'year', 'mpg')
+
     def __init__(self, make, model, year, mpg):
         # make sure the values are the right type
-        self.make = str(make)
-        self.model = str(model)
-        self.year = 1900 + int(year)
-        self.mpg = float(mpg)
+        object.__setattr__(self, 'make', str(make))
+        object.__setattr__(self, 'model', str(model))
+        object.__setattr__(self, 'year', 1900 + int(year))
+        object.__setattr__(self, 'mpg', float(mpg))
+
+    @classmethod
+    def _from_typed(cls, make, model, year, mpg):
+        # for values converted in bulk already: str, str, full year int, float
+        car = cls.__new__(cls)
+        object.__setattr__(car, 'make', make)
+        object.__setattr__(car, 'model', model)
+        object.__setattr__(car, 'year', year)
+        object.__setattr__(car, 'mpg', mpg)
+        return car
+
+    def __setattr__(self, name, value):
+        # cars are shared by every AutoMPGData of the process, so they are read only
+        raise AttributeError(f"{type(self).__name__} objects are read only, cannot set {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} objects are read only, cannot delete {name}")
     
     def __repr__(self):
         return f'AutoMPG(make={self.make}, model={self.model}, year={self.year}, year={self.mpg})'
@@ -45,6 +105,14 @@ class AutoMPG:
 
 class AutoMPGData:
 
+    original_file = 'auto-mpg.data.txt'
+    clean_file    = 'auto-mpg.clean.txt'
+    binary_file   = 'auto-mpg.clean.npy'
+
+    # (clean file path, mtime, size), the AutoMPG objects loaded from it and
+    # its typed records, shared by every AutoMPGData of the process
+    _dataset = None
+
     def __init__(self):
         self._load_data()
 
@@ -58,31 +126,52 @@ class AutoMPGData:
         return str(self.data)
     
     def _load_data(self):
-        clean_file = 'auto-mpg.clean.txt'
+        clean_file = AutoMPGData.clean_file
+        binary_file = AutoMPGData.binary_file
 
         # if the clean file doesn't exist, clean it
         if not os.path.exists(clean_file):
             self._clean_data()
-        
-        # initialize a namedtuple object
-        Record = namedtuple('Record', ['mpg', 'cylinders', 'displacement', 'horsepower', 'weight', \
-                                       'acceleration', 'model_year', 'origin', 'car_name'])
-
-        self.data = list() # initialize empty list for data
-        with open(clean_file, 'rt') as file:
-            reader = csv.reader(file, delimiter = " ", skipinitialspace = True)
-            for row in reader:
-                record = Record(*row) # * lets you use all elements of row
-                auto_object = AutoMPG(record.car_name.split()[0], \
-                                      record.car_name.split(maxsplit = 1)[-1], \
-                                      record.model_year, \
-                                      record.mpg)
-                self.data.append(auto_object) 
-    
+
+        # only load again if the clean file changed since the last load
+        stat = os.stat(clean_file)
+        key = (os.path.abspath(clean_file), stat.st_mtime_ns, stat.st_size)
+        if AutoMPGData._dataset is None or AutoMPGData._dataset[0] != key:
+            # if the binary file is missing or older than the clean file, convert it
+            if not os.path.exists(binary_file) or os.path.getmtime(binary_file) < os.path.getmtime(clean_file) \
+               or np.load(binary_file, mmap_mode = 'r').dtype.descr[:-1] != np.dtype(RECORD_FIELDS).descr:
+                self._to_binary(clean_file, binary_file)
+            AutoMPGData._dataset = (key, *self._read_binary(binary_file))
+
+        # a new list of the shared objects, so reordering it leaves the others alone
+        self.data = list(AutoMPGData._dataset[1])
+        # every field of every car, read only: records['horsepower'], ...
+        self.records = AutoMPGData._dataset[2]
+
+    def _read_binary(self, binary_file):
+        # one read of the typed records, returned with the AutoMPG objects
+        # made from them; their fields are converted to Python values in bulk
+        records = np.load(binary_file)
+        records.setflags(write = False)
+
+        data = list() # initialize empty list for data
+        model_years = records['model_year']
+        years = np.where(model_years == MISSING_INT, model_years, model_years + 1900).tolist() # converted in bulk
+        for car_name, year, mpg in zip(records['car_name'].tolist(), years, records['mpg'].tolist()):
+            auto_object = AutoMPG._from_typed(car_name.split()[0], \
+                                              car_name.split(maxsplit = 1)[-1], \
+                                              year, \
+                                              mpg)
+            data.append(auto_object)
+        return tuple(data), records
+
+    def _to_binary(self, clean_file, binary_file):
+        to_binary(clean_file, binary_file)
+
     def _clean_data(self):
         # read from one and write to the other
-        with open('auto-mpg.data.txt',  'rt') as in_file, \
-             open('auto-mpg.clean.txt', 'wt') as out_file:
+        with open(AutoMPGData.original_file,  'rt') as in_file, \
+             open(AutoMPGData.clean_file, 'wt') as out_file:
             for row in in_file:
                 out_file.write(row.expandtabs()) # makes space delimited instead of tab
 
@@ -2,11 +2,16 @@
     AutoMPG data is collected from the UCI Machine Learning Databases
 """
 import argparse
-import csv
-from collections import namedtuple
 import logging
 import os
+import sys
 import requests
+import numpy as np
+
+# the typed record schema and its converter are shared with week 6
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'week_6'))
+import autompg
+from autompg import RECORD_FIELDS, MISSING_INT, to_binary
 
 def log_config():
     logger = logging.getLogger()
@@ -23,13 +28,23 @@ def log_config():
     logger.addHandler(sh)
 
 class AutoMPG:
+    # no per object __dict__, millions of cars take much less memory
+    __slots__ = ('make', 'model', 'year', 'mpg')
+
     def __init__(self, make, model, year, mpg):
         # make sure the values are the right type
-        self.make = str(make)
-        self.model = str(model)
-        self.year = 1900 + int(year)
-        self.mpg = float(mpg)
-    
+        object.__setattr__(self, 'make', str(make))
+        object.__setattr__(self, 'model', str(model))
+        object.__setattr__(self, 'year', 1900 + int(year))
+        object.__setattr__(self, 'mpg', float(mpg))
+
+    # for values converted in bulk already: str, str, full year int, float
+    _from_typed = classmethod(autompg.AutoMPG._from_typed.__func__)
+
+    # cars are shared by every AutoMPGData of the process, so they are read only
+    __setattr__ = autompg.AutoMPG.__setattr__
+    __delattr__ = autompg.AutoMPG.__delattr__
+
     def __repr__(self):
         return f"AutoMPG(make={self.make}, model={self.model}, year={self.year}, mpg={self.mpg})"
 
@@ -58,10 +73,39 @@ class AutoMPG:
         # return the hash of the tuple
         return hash((self.make, self.model, self.year, self.mpg))
 
+class SortedView:
+    """ The cars of an AutoMPGData in the order of a permutation index;
+        neither the cars nor their order are copied or changed """
+
+    def __init__(self, cars, order):
+        self.cars = cars
+        self.order = order
+
+    def __iter__(self):
+        cars = self.cars
+        return (cars[i] for i in self.order.tolist())
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return SortedView(self.cars, self.order[index])
+        return self.cars[self.order[index]]
+
+    def __repr__(self):
+        return f"SortedView({len(self)} cars)"
+
 class AutoMPGData:
 
     original_file = 'auto-mpg.data.txt'
     clean_file    = 'auto-mpg.clean.txt'
+    binary_file   = 'auto-mpg.clean.npy'
+
+    # (clean file path, mtime, size), the AutoMPG objects and typed records
+    # loaded from it and the sort orders computed so far, shared by every
+    # AutoMPGData of the process
+    _dataset = None
 
     def __init__(self):
         self._load_data()
@@ -77,18 +121,32 @@ class AutoMPGData:
 
     def sort_by_default(self):
         logging.info("INFO: Sorting AutoMPG objects by make")
-        self.data.sort()
-        return self.data
+        return SortedView(self._cars, self._order('default'))
 
     def sort_by_year(self):
         logging.info("INFO: Sorting AutoMPG objects by year")
-        self.data.sort(key = lambda x: x.year)
-        return self.data
+        return SortedView(self._cars, self._order('year'))
 
     def sort_by_mpg(self):
         logging.info("INFO: Sorting AutoMPG objects by mpg")
-        self.data.sort(key = lambda x: x.mpg)
-        return self.data
+        return SortedView(self._cars, self._order('mpg'))
+
+    def _order(self, sort_method):
+        # permutation index of a sort, computed once per data set
+        if sort_method not in self._orders:
+            years = np.array([car.year for car in self._cars], dtype = np.int64)
+            mpgs = np.array([car.mpg for car in self._cars], dtype = np.float64)
+            if sort_method == 'default':
+                # like AutoMPG.__lt__; np.lexsort sorts by the last key first
+                makes = np.array([car.make for car in self._cars], dtype = str)
+                models = np.array([car.model for car in self._cars], dtype = str)
+                order = np.lexsort((mpgs, years, models, makes))
+            else:
+                # stable, so equal keys keep their file order
+                order = np.argsort(years if sort_method == 'year' else mpgs, kind = 'stable')
+            order.setflags(write = False)
+            self._orders[sort_method] = order
+        return self._orders[sort_method]
     
     def _load_data(self):
         logging.info("INFO: Checking auto-mpg.data.txt")
@@ -100,25 +158,54 @@ class AutoMPGData:
         if not os.path.exists(AutoMPGData.clean_file):
             self._clean_data()
         
-        # initialize a namedtuple object
-        logging.debug("DEBUG: Record objects are of type <namedtuple>")
-        Record = namedtuple('Record', ['mpg', 'cylinders', 'displacement', 'horsepower', 'weight', \
-                                       'acceleration', 'model_year', 'origin', 'car_name'])
-
-        logging.info("INFO: Parsing auto-mpg.clean.txt into AutoMPG objects")
-
-        self.data = list() # initialize empty list for data
-        with open(AutoMPGData.clean_file, 'rt') as in_file:
-            reader = csv.reader(in_file, delimiter = " ", skipinitialspace = True)
-            for row in reader:
-                record = Record(*row) # * lets you use all elements of row
-                logging.debug("DEBUG: Record objects filtered into AutoMPG objects")
-                auto_object = AutoMPG(record.car_name.split()[0], \
-                                      record.car_name.split(maxsplit = 1)[-1], \
-                                      record.model_year, \
-                                      record.mpg)
-                self.data.append(auto_object) 
-    
+        # only load again if the clean file changed since the last load
+        stat = os.stat(AutoMPGData.clean_file)
+        key = (os.path.abspath(AutoMPGData.clean_file), stat.st_mtime_ns, stat.st_size)
+        if AutoMPGData._dataset is None or AutoMPGData._dataset[0] != key:
+            # if the binary file is missing or older than the clean file, convert it
+            if not os.path.exists(AutoMPGData.binary_file) or \
+               os.path.getmtime(AutoMPGData.binary_file) < os.path.getmtime(AutoMPGData.clean_file) or \
+               np.load(AutoMPGData.binary_file, mmap_mode = 'r').dtype.descr[:-1] != np.dtype(RECORD_FIELDS).descr:
+                self._to_binary()
+            AutoMPGData._dataset = (key, *self._read_binary(), {})
+        else:
+            logging.debug("DEBUG: Reusing the AutoMPG objects already loaded")
+
+        # a new list of the shared objects, so reordering it leaves the others alone
+        self.data = list(AutoMPGData._dataset[1])
+        self._cars = AutoMPGData._dataset[1]
+        # every field of every car, read only: records['horsepower'], ...
+        self.records = AutoMPGData._dataset[2]
+        self._orders = AutoMPGData._dataset[3]
+
+    def _read_binary(self):
+        logging.info("INFO: Loading auto-mpg.clean.npy into AutoMPG objects")
+
+        # one read of the typed records, returned with the AutoMPG objects
+        # made from them; their fields are converted to Python values in bulk
+        records = np.load(AutoMPGData.binary_file)
+        records.setflags(write = False)
+
+        data = list() # initialize empty list for data
+        model_years = records['model_year']
+        years = np.where(model_years == MISSING_INT, model_years, model_years + 1900).tolist() # converted in bulk
+        for car_name, year, mpg in zip(records['car_name'].tolist(), years, records['mpg'].tolist()):
+            auto_object = AutoMPG._from_typed(car_name.split()[0], \
+                                              car_name.split(maxsplit = 1)[-1], \
+                                              year, \
+                                              mpg)
+            data.append(auto_object)
+        return tuple(data), records
+
+    def _to_binary(self):
+        logging.info("INFO: Converting auto-mpg.clean.txt to auto-mpg.clean.npy")
+        table = to_binary(AutoMPGData.clean_file, AutoMPGData.binary_file)
+        for name, dtype in RECORD_FIELDS:
+            missing = np.isnan(table[name]) if dtype.startswith('f') else table[name] == MISSING_INT
+            if missing.any():
+                logging.debug(f"DEBUG: {missing.sum()} missing {name} values")
+        logging.debug(f"DEBUG: {len(table)} records saved to auto-mpg.clean.npy")
+
     def _clean_data(self):
         logging.debug("DEBUG: File cleaned by applying .expandtabs() method")
         # read from one and write to the other
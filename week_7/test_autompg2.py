@@ -1,5 +1,9 @@
 """Unit tests for the autompg program."""
+import os
+import shutil
+import tempfile
 import unittest
+from unittest import mock
 
 from autompg2 import *
 
@@ -68,6 +72,21 @@ class TestAutoMPG(unittest.TestCase):
         self.assertEqual(5, len(s))
         self.assertTrue(b1 in s)
                 
+    def test_slots(self):
+        # cars have no __dict__, only their four fields
+        a1 = AutoMPG('a', 'b', 3, 4)
+        self.assertFalse(hasattr(a1, '__dict__'))
+        self.assertEqual(a1, AutoMPG._from_typed('a', 'b', 1903, 4.0))
+
+    def test_read_only(self):
+        # cars are shared by every AutoMPGData, so they cannot be changed
+        a1 = AutoMPG('a', 'b', 3, 4)
+        with self.assertRaises(AttributeError):
+            a1.mpg = 5.0
+        with self.assertRaises(AttributeError):
+            del a1.make
+        self.assertEqual(AutoMPG('a', 'b', 3, 4), a1)
+
     @unittest.expectedFailure
     def test_lt_wrong_type(self):
         a1 = AutoMPG('a', 'b', 3, 4)
@@ -104,6 +123,73 @@ class TestAutoMPGData(unittest.TestCase):
     def test_iterable(self):
         # make sure it is possible to get and iterator from AutoMPGData
         iter(AutoMPGData())
+
+    def test_missing_values(self):
+        # missing values are nan, or MISSING_INT in the integer fields
+        data = AutoMPGData()
+        with tempfile.TemporaryDirectory() as directory:
+            clean_file = os.path.join(directory, 'auto-mpg.clean.txt')
+            binary_file = os.path.join(directory, 'auto-mpg.clean.npy')
+            with open(clean_file, 'w') as f:
+                f.write('25.0   4   98.00      ?          2046.      19.0   71  1        "ford pinto"\n')
+                f.write('21.0   ?   200.0      85.00      2875.      17.0   74  1        "ford maverick"\n')
+            with mock.patch.object(AutoMPGData, 'clean_file', clean_file), \
+                 mock.patch.object(AutoMPGData, 'binary_file', binary_file):
+                data._to_binary()
+            records = np.load(binary_file)
+        self.assertTrue(np.isnan(records['horsepower'][0]))
+        self.assertEqual(85.0, records['horsepower'][1])
+        self.assertEqual([4, MISSING_INT], records['cylinders'].tolist())
+        self.assertEqual(['ford pinto', 'ford maverick'], records['car_name'].tolist())
+
+    def test_records(self):
+        # every field of the clean file is kept, typed and read only
+        data = AutoMPGData()
+        self.assertEqual(len(data.data), len(data.records))
+        self.assertEqual([name for name, dtype in RECORD_FIELDS] + ['car_name'], list(data.records.dtype.names))
+        self.assertEqual(np.dtype('i1'), data.records['cylinders'].dtype)
+        self.assertTrue(np.isnan(data.records['horsepower']).any())
+        with self.assertRaises(ValueError):
+            data.records['mpg'][0] = 0
+
+    def test_loaded_once(self):
+        # the clean file is only read again after it changes, on a copy so
+        # the tracked file is left alone
+        with tempfile.TemporaryDirectory() as directory:
+            clean_file = os.path.join(directory, 'auto-mpg.clean.txt')
+            shutil.copy(AutoMPGData.clean_file, clean_file)
+            with mock.patch.object(AutoMPGData, 'original_file', clean_file), \
+                 mock.patch.object(AutoMPGData, 'clean_file', clean_file), \
+                 mock.patch.object(AutoMPGData, 'binary_file', os.path.join(directory, 'auto-mpg.clean.npy')), \
+                 mock.patch.object(AutoMPGData, '_dataset', None), \
+                 mock.patch.object(AutoMPGData, '_read_binary', autospec = True,
+                                   side_effect = AutoMPGData._read_binary) as read_binary:
+                data1 = AutoMPGData()
+                data2 = AutoMPGData()
+                self.assertEqual(1, read_binary.call_count)
+                self.assertEqual(data1.data, data2.data)
+
+                # each one has its own list of cars
+                data1.data.reverse()
+                self.assertNotEqual(data1.data, data2.data)
+
+                stat = os.stat(clean_file)
+                os.utime(clean_file, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+                AutoMPGData()
+                self.assertEqual(2, read_binary.call_count)
+
+    def test_sorted_views(self):
+        # sorted views match sorting the list and leave it as it is
+        data = AutoMPGData()
+        cars = list(data.data)
+        self.assertEqual(sorted(cars), list(data.sort_by_default()))
+        self.assertEqual(sorted(cars, key = lambda x: x.year), list(data.sort_by_year()))
+        self.assertEqual(sorted(cars, key = lambda x: x.mpg), list(data.sort_by_mpg()))
+        self.assertEqual(cars, data.data)
+        self.assertEqual(min(cars, key = lambda x: x.mpg), data.sort_by_mpg()[0])
+
+        # the order is computed once and shared
+        self.assertIs(data.sort_by_year().order, AutoMPGData().sort_by_year().order)
                 
 if __name__ == '__main__':
     unittest.main()
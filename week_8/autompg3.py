@@ -4,13 +4,57 @@
 import argparse
 import csv
 from collections import namedtuple
-from collections import defaultdict
 import logging
 import os
+import sys
 import requests
 import numpy as np
 import matplotlib.pyplot as plt
 
+# the typed record schema and its converter are shared with week 6
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'week_6'))
+import autompg
+from autompg import RECORD_FIELDS, MISSING_INT, to_binary
+
+# columns of the data set: sorted unique makes and models, the index of
+# each car's make and model in them, and its numeric fields
+Columns = namedtuple('Columns', ['makes', 'models', 'make_codes', 'model_codes', 'years', 'mpgs', 'cylinders',
+                                 'displacements', 'horsepowers', 'weights', 'accelerations', 'origins'])
+
+# fields aggregate() groups by, and their columns
+GROUP_FIELDS = {'make': 'make_codes', 'year': 'years', 'cylinders': 'cylinders', 'origin': 'origins'}
+
+# numeric fields aggregate() summarises, and their columns
+METRIC_FIELDS = {'mpg': 'mpgs', 'cylinders': 'cylinders', 'displacement': 'displacements',
+                 'horsepower': 'horsepowers', 'weight': 'weights', 'acceleration': 'accelerations', 'year': 'years'}
+
+# statistics of a FIELD:STAT metric of aggregate()
+METRIC_STATS = ('count', 'mean', 'median', 'min', 'max', 'std')
+
+# <output> choices that are fixed aggregations: (by, metrics)
+AGGREGATE_OUTPUTS = {'mpg_by_cylinders': (['cylinders'], ['mpg:mean']),
+                     'mpg_by_origin': (['origin'], ['mpg:mean'])}
+
+def group_stats(codes, values, groups):
+    """ Returns the count, mean and standard deviation of values for each
+        of groups codes, with one np.bincount pass per statistic """
+    counts = np.bincount(codes, minlength = groups)
+    sums = np.bincount(codes, weights = values, minlength = groups)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        means = sums / counts
+        squares = np.bincount(codes, weights = (values - means[codes]) ** 2, minlength = groups)
+        stds = np.sqrt(squares / counts)
+    return counts, means, stds
+
+def int_codes(values):
+    """ Returns the sorted distinct values of an integer array and the index
+        of each value in them, counting instead of sorting """
+    if not len(values):
+        return values[:0], np.zeros(0, dtype = np.int64)
+    first = int(values.min())
+    present = np.bincount(values - first) > 0
+    return np.flatnonzero(present) + first, (np.cumsum(present) - 1)[values - first]
+
 def log_config():
     logger = logging.getLogger()
     logger.setLevel(logging.DEBUG)
@@ -26,13 +70,23 @@ def log_config():
     logger.addHandler(sh)
 
 class AutoMPG:
+    # no per object __dict__, millions of cars take much less memory
+    __slots__ = ('make', 'model', 'year', 'mpg')
+
     def __init__(self, make, model, year, mpg):
         # make sure the values are the right type
-        self.make = str(make)
-        self.model = str(model)
-        self.year = 1900 + int(year)
-        self.mpg = float(mpg)
-    
+        object.__setattr__(self, 'make', str(make))
+        object.__setattr__(self, 'model', str(model))
+        object.__setattr__(self, 'year', 1900 + int(year))
+        object.__setattr__(self, 'mpg', float(mpg))
+
+    # for values converted in bulk already: str, str, full year int, float
+    _from_typed = classmethod(autompg.AutoMPG._from_typed.__func__)
+
+    # cars are shared by every AutoMPGData of the process, so they are read only
+    __setattr__ = autompg.AutoMPG.__setattr__
+    __delattr__ = autompg.AutoMPG.__delattr__
+
     def __repr__(self):
         return f'AutoMPG(make={self.make}, model={self.model}, year={self.year}, mpg={self.mpg})'
 
@@ -61,16 +115,81 @@ class AutoMPG:
         # return the hash of the tuple
         return hash((self.make, self.model, self.year, self.mpg))
 
+class SortedView:
+    """ The cars of an AutoMPGData in the order of a permutation index,
+        made as they are iterated; neither the data set nor its order is
+        copied or changed """
+
+    def __init__(self, data, order):
+        self.data = data
+        self.order = order
+
+    def __iter__(self):
+        return self.data._cars(self.order)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return SortedView(self.data, self.order[index])
+        return next(self.data._cars(self.order[[index]]))
+
+    def __repr__(self):
+        return f"SortedView({self.data!r}, {len(self)} cars)"
+
 class AutoMPGData:
 
     original_file = 'auto-mpg.data.txt'
     clean_file    = 'auto-mpg.clean.txt'
+    binary_file   = 'auto-mpg.clean.npy'
+
+    # (clean file path, mtime, size), the Columns loaded from it and the
+    # sort orders computed so far, shared by every AutoMPGData of the process
+    _dataset = None
 
     def __init__(self):
         self._load_data()
 
     def __iter__(self):
-        return iter(self.data)
+        # AutoMPG objects are only made while iterating, unless data was used
+        if self._data is None:
+            return self._cars()
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self.columns.mpgs)
+
+    @property
+    def data(self):
+        # list of AutoMPG objects, made on first use
+        if self._data is None:
+            self._data = list(self._cars())
+        return self._data
+
+    def _cars(self, order = None):
+        # the cars at the positions of order, or all of them in file order
+        columns = self.columns
+        if order is None:
+            order = slice(None)
+        for make, model, year, mpg in zip(columns.makes[columns.make_codes[order]].tolist(),
+                                          columns.models[columns.model_codes[order]].tolist(),
+                                          columns.years[order].tolist(), columns.mpgs[order].tolist()):
+            yield AutoMPG._from_typed(make, model, year, mpg)
+
+    def _order(self, sort_method):
+        # permutation index of a sort, computed once per data set; codes sort
+        # like the names because makes and models are sorted
+        if sort_method not in self._orders:
+            columns = self.columns
+            # np.lexsort sorts by the last key first
+            keys = {'default': (columns.mpgs, columns.years, columns.model_codes, columns.make_codes),
+                    'year': (columns.mpgs, columns.model_codes, columns.make_codes, columns.years),
+                    'mpg': (columns.years, columns.model_codes, columns.make_codes, columns.mpgs)}
+            order = np.lexsort(keys[sort_method])
+            order.setflags(write = False)
+            self._orders[sort_method] = order
+        return self._orders[sort_method]
     
     def __repr__(self):
         return "AutoMPGData()"
@@ -80,50 +199,135 @@ class AutoMPGData:
 
     def sort_by_default(self):
         logging.debug("DEBUG: Sorting AutoMPG objects by make")
-        self.data.sort()
-        return self.data
+        return SortedView(self, self._order('default'))
 
     def sort_by_year(self):
         logging.debug("DEBUG: Sorting AutoMPG objects by year")
-        self.data.sort(key = lambda x: (x.year, x.make, x.model, x.mpg))
-        return self.data
+        return SortedView(self, self._order('year'))
 
     def sort_by_mpg(self):
         logging.debug("DEBUG: Sorting AutoMPG objects by mpg")
-        self.data.sort(key = lambda x: (x.mpg, x.make, x.model, x.year))
-        return self.data
+        return SortedView(self, self._order('mpg'))
 
     def mpg_by_year(self, plot = False):
-        self.year_dict = defaultdict(list)
-        for row in self.data:
-            self.year_dict[row.year].append(row.mpg)
-        for year in self.year_dict.keys():
-            self.year_dict[year] = np.mean(self.year_dict[year])
+        year_dict = {year: mpg for (year,), (mpg,) in self.aggregate(['year'], ['mpg:mean']).items()}
 
         if plot:
             plt.figure(figsize = (10, 7))
-            plt.plot(self.year_dict.keys(), self.year_dict.values(), 'r--')
+            plt.plot(year_dict.keys(), year_dict.values(), 'r--')
             plt.title('Average MPG per year')
             plt.show()
 
-        return self.year_dict
+        return year_dict
 
 
     def mpg_by_make(self, plot = False):
-        self.make_dict = defaultdict(list)
-        for car in self.data:
-            self.make_dict[car.make].append(car.mpg)
-        for make in self.make_dict.keys():
-            self.make_dict[make] = np.mean(self.make_dict[make])
+        # makes are sorted already
+        make_dict = {make: mpg for (make,), (mpg,) in self.aggregate(['make'], ['mpg:mean']).items()}
         
         if plot:
             plt.figure(figsize = (10, 7))
-            plt.plot(self.make_dict.keys(), self.make_dict.values(), 'r--')
+            plt.plot(make_dict.keys(), make_dict.values(), 'r--')
             plt.xticks(rotation = 75)
             plt.title('Average MPG per make')
             plt.show()
 
-        return dict(sorted(self.make_dict.items()))
+        return make_dict
+
+    def aggregate(self, by = ('make',), metrics = ('mpg:mean',), plot = False):
+        """ Returns {(group values): (metric values)} for every group of cars
+            with the same by fields (of GROUP_FIELDS), sorted by group
+
+            A metric is 'count' (cars in the group) or FIELD:STAT, a
+            statistic of METRIC_STATS of a field of METRIC_FIELDS, e.g.
+            'horsepower:median'; missing values are left out of it. Every
+            metric is computed over whole columns at once. """
+        if not by or not metrics:
+            raise ValueError('aggregate needs at least one field to group by and one metric')
+        columns = self.columns
+
+        # the group of each car as a mixed radix number of its field codes
+        codes = np.zeros(len(self), dtype = np.int64)
+        labels = list()
+        for field in by:
+            if field not in GROUP_FIELDS:
+                raise ValueError(f'cannot group by {field!r}, only by {", ".join(GROUP_FIELDS)}')
+            if field == 'make':
+                field_labels, field_codes = columns.makes, columns.make_codes
+            else:
+                field_labels, field_codes = int_codes(getattr(columns, GROUP_FIELDS[field]))
+            codes = codes * len(field_labels) + field_codes
+            labels.append(field_labels)
+
+        # number only the groups that have cars, in order
+        sizes = [len(field_labels) for field_labels in labels]
+        present = np.bincount(codes, minlength = int(np.prod(sizes))) > 0
+        groups = np.flatnonzero(present)
+        if len(groups) < len(present):
+            codes = (np.cumsum(present) - 1)[codes]
+        keys = list(zip(*[field_labels[index].tolist()
+                          for field_labels, index in zip(labels, np.unravel_index(groups, sizes))]))
+
+        summaries = dict()
+        results = [self._metric(metric, codes, len(groups), summaries).tolist() for metric in metrics]
+        aggregates = dict(zip(keys, zip(*results)))
+
+        if plot:
+            plt.figure(figsize = (10, 7))
+            names = [' '.join(str(value) for value in key) for key in keys]
+            for metric, values in zip(metrics, results):
+                plt.plot(names, values, '--', label = metric)
+            plt.xticks(rotation = 75)
+            plt.legend()
+            plt.title(f'{", ".join(metrics)} per {", ".join(by)}')
+            plt.show()
+
+        return aggregates
+
+    def _metric(self, metric, codes, groups, summaries):
+        # values of one metric for each of groups codes; summaries keeps
+        # what was computed for each field, for its other statistics
+        if metric == 'count':
+            return np.bincount(codes, minlength = groups)
+        field, colon, stat = metric.partition(':')
+        if field not in METRIC_FIELDS or stat not in METRIC_STATS:
+            raise ValueError(f'metric {metric!r} is not count or FIELD:STAT, FIELD one of '
+                             f'{", ".join(METRIC_FIELDS)} and STAT one of {", ".join(METRIC_STATS)}')
+
+        if field not in summaries:
+            column = getattr(self.columns, METRIC_FIELDS[field])
+            values = np.asarray(column, dtype = np.float64)
+            # missing values are nan, or MISSING_INT in the integer fields
+            valid = ~np.isnan(values) if column.dtype.kind == 'f' else column != MISSING_INT
+            if valid.all():
+                summaries[field] = {'codes': codes, 'values': values}
+            else:
+                summaries[field] = {'codes': codes[valid], 'values': values[valid]}
+        summary = summaries[field]
+
+        if stat in ('count', 'mean', 'std'):
+            if 'mean' not in summary:
+                summary['count'], summary['mean'], summary['std'] = \
+                    group_stats(summary['codes'], summary['values'], groups)
+            return summary[stat]
+
+        # min, max and median from the values sorted within each group
+        if 'sorted' not in summary:
+            order = np.lexsort((summary['values'], summary['codes']))
+            summary['sorted'] = summary['values'][order]
+            summary['sizes'] = np.bincount(summary['codes'], minlength = groups)
+        values, sizes = summary['sorted'], summary['sizes']
+        starts = np.cumsum(sizes) - sizes
+        result = np.full(groups, np.nan)
+        some = sizes > 0
+        if stat == 'min':
+            result[some] = values[starts[some]]
+        elif stat == 'max':
+            result[some] = values[starts[some] + sizes[some] - 1]
+        else:
+            # the mean of the middle two values if the count is even
+            result[some] = (values[(starts + (sizes - 1) // 2)[some]] + values[(starts + sizes // 2)[some]]) / 2
+        return result
     
     def _load_data(self):
         logging.debug("DEBUG: Checking auto-mpg.data.txt")
@@ -135,35 +339,71 @@ class AutoMPGData:
         if not os.path.exists(AutoMPGData.clean_file):
             self._clean_data()
         
-        # initialize a namedtuple object
-        logging.debug("DEBUG: Record objects are of type <namedtuple>")
+        # only load again if the clean file changed since the last load
+        stat = os.stat(AutoMPGData.clean_file)
+        key = (os.path.abspath(AutoMPGData.clean_file), stat.st_mtime_ns, stat.st_size)
+        if AutoMPGData._dataset is None or AutoMPGData._dataset[0] != key:
+            # if the binary file is missing or older than the clean file, convert it
+            if not os.path.exists(AutoMPGData.binary_file) or \
+               os.path.getmtime(AutoMPGData.binary_file) < os.path.getmtime(AutoMPGData.clean_file) or \
+               np.load(AutoMPGData.binary_file, mmap_mode = 'r').dtype.descr[:-1] != np.dtype(RECORD_FIELDS).descr:
+                self._to_binary()
+            AutoMPGData._dataset = (key, self._read_binary(), {})
+        else:
+            logging.debug("DEBUG: Reusing the AutoMPG objects already loaded")
+
+        # the shared columns are read only; AutoMPG objects are made per instance
+        self.columns = AutoMPGData._dataset[1]
+        self._orders = AutoMPGData._dataset[2]
+        self._data = None
 
-        Record = namedtuple('Record', ['mpg', 'cylinders', 'displacement', 'horsepower', 'weight', \
-                                       'acceleration', 'model_year', 'origin', 'car_name'])
+    def _read_binary(self):
+        logging.debug("DEBUG: Loading auto-mpg.clean.npy into Columns")
 
-        logging.debug("DEBUG: Parsing auto-mpg.clean.txt into AutoMPG objects")
+        # one read of the typed records; the fields are copied into Columns below
+        records = np.load(AutoMPGData.binary_file)
 
-        self.data = list() # initialize empty list for data
+        # split and fix each distinct car name once
+        names, name_codes = np.unique(records['car_name'], return_inverse = True)
 
         # mispelled words dictionary
         stupid_words = {'chevroelt':'chevrolet', 'chevy':'chevrolet', 'maxda':'mazda', 'mercedes-benz':'mercedes', \
                         'toyouta':'toyota', 'vokswagen':'volkswagen', 'vw':'volkswagen'}
-        with open(AutoMPGData.clean_file, 'rt') as in_file:
-            reader = csv.reader(in_file, delimiter = " ", skipinitialspace = True)
-            logging.debug("DEBUG: Mispelled car names that were replaced:")
-            for row in reader:
-                record = Record(*row) # * lets you use all elements of row
-                make = record.car_name.split()[0]
-                if make in stupid_words.keys(): # is the make mispelled?
-                    logging.debug(f'-      Old:{make}')
-                    make = stupid_words[make]   # if it is replace it with the correct spelling
-                    logging.debug(f'-      New:{make}')
-                auto_object = AutoMPG(make,   
-                                      record.car_name.split(maxsplit = 1)[-1],
-                                      record.model_year,
-                                      record.mpg)
-                self.data.append(auto_object) 
-    
+        logging.debug("DEBUG: Mispelled car names that were replaced:")
+        name_makes = list()
+        name_models = list()
+        for car_name in names.tolist():
+            make = car_name.split()[0]
+            if make in stupid_words.keys(): # is the make mispelled?
+                logging.debug(f'-      Old:{make}')
+                make = stupid_words[make]   # if it is replace it with the correct spelling
+                logging.debug(f'-      New:{make}')
+            name_makes.append(make)
+            name_models.append(car_name.split(maxsplit = 1)[-1])
+
+        makes, make_codes = np.unique(name_makes, return_inverse = True)
+        models, model_codes = np.unique(name_models, return_inverse = True)
+        # codes as int32 and the small integer fields as they are stored
+        model_years = records['model_year']
+        years = np.where(model_years == MISSING_INT, model_years, model_years + 1900)
+        columns = Columns(makes, models, make_codes[name_codes].astype(np.int32),
+                          model_codes[name_codes].astype(np.int32), years,
+                          np.array(records['mpg']), np.array(records['cylinders']),
+                          np.array(records['displacement']), np.array(records['horsepower']),
+                          np.array(records['weight']), np.array(records['acceleration']), np.array(records['origin']))
+        for column in columns:
+            column.setflags(write = False)
+        return columns
+
+    def _to_binary(self):
+        logging.debug("DEBUG: Converting auto-mpg.clean.txt to auto-mpg.clean.npy")
+        table = to_binary(AutoMPGData.clean_file, AutoMPGData.binary_file)
+        for name, dtype in RECORD_FIELDS:
+            missing = np.isnan(table[name]) if dtype.startswith('f') else table[name] == MISSING_INT
+            if missing.any():
+                logging.debug(f"DEBUG: {missing.sum()} missing {name} values")
+        logging.debug(f"DEBUG: {len(table)} records saved to auto-mpg.clean.npy")
+
     def _clean_data(self):
         logging.debug("DEBUG: File cleaned by applying .expandtabs() method")
         # read from one and write to the other
@@ -187,7 +427,7 @@ class AutoMPGData:
 
         logging.debug(f"DEBUG: Response code from url request: {response.status_code}")
     
-    def _to_csv(self, file_name, output, sort_method = None):
+    def _to_csv(self, file_name, output, sort_method = None, by = None, metrics = None, aggregates = None):
         if output == 'print':
             with open(file_name, 'w') as csvfile:
                 writer = csv.writer(csvfile, delimiter = ',', quoting = csv.QUOTE_ALL)
@@ -216,6 +456,17 @@ class AutoMPGData:
                 writer.writerow(['Make', 'MPG'])
                 for key, value in self.mpg_by_make().items():
                     writer.writerow([key, value])
+        elif output == 'aggregate' or output in AGGREGATE_OUTPUTS:
+            by, metrics = AGGREGATE_OUTPUTS.get(output, (by, metrics))
+            # aggregates already computed for the same fields and metrics
+            # are written as they are
+            if aggregates is None:
+                aggregates = self.aggregate(by, metrics)
+            with open(file_name, 'w') as csvfile:
+                writer = csv.writer(csvfile, delimiter = ',', quoting = csv.QUOTE_ALL)
+                writer.writerow([field.capitalize() for field in by] + list(metrics))
+                for key, values in aggregates.items():
+                    writer.writerow(list(key) + list(values))
 
         logging.debug(f'DEBUG: Auto-MPG file saved to {file_name}.csv file')
 
@@ -227,38 +478,62 @@ def main():
     parser = argparse.ArgumentParser(description= 'analyze Auto MPG data set')
     
     logging.debug("DEBUG: <output> is a required argument, --sort, --ofile, --plot are optional")
-    parser.add_argument('output', metavar = '<output>', choices = ['print', 'mpg_by_year', 'mpg_by_make'], action = 'store')
+    parser.add_argument('output', metavar = '<output>', action = 'store',
+                        choices = ['print', 'mpg_by_year', 'mpg_by_make', *AGGREGATE_OUTPUTS, 'aggregate'])
     parser.add_argument('-s', '--sort', choices = ['default', 'year', 'mpg'], action = 'store', dest = 'sort', default = None)
     parser.add_argument('-o', '--ofile', metavar = '<outfile>', type = str, action = 'store', dest = 'ofile_name')
     parser.add_argument('-p', '--plot', action = 'store_true', dest = 'plot', help = 'if specified plots data')
+    parser.add_argument('-b', '--by', metavar = '<fields>', type = lambda x: x.split(','), dest = 'by',
+                        default = ['make'], help = f'aggregate: fields to group by, of {", ".join(GROUP_FIELDS)}')
+    parser.add_argument('-m', '--metrics', metavar = '<metrics>', type = lambda x: x.split(','), dest = 'metrics',
+                        default = ['mpg:mean'], help = 'aggregate: count or FIELD:STAT, FIELD one of '
+                        f'{", ".join(METRIC_FIELDS)} and STAT one of {", ".join(METRIC_STATS)}')
 
     args = parser.parse_args()
 
+    # fixed aggregations are aggregate with their own fields and metrics
+    if args.output in AGGREGATE_OUTPUTS:
+        args.by, args.metrics = AGGREGATE_OUTPUTS[args.output]
+
+    # one data set for the csv file and the printed output
+    data = AutoMPGData()
+
+    aggregates = None
+    if args.output == 'aggregate' or args.output in AGGREGATE_OUTPUTS:
+        try:
+            aggregates = data.aggregate(args.by, args.metrics, plot = args.plot)
+        except ValueError as e:
+            parser.error(str(e))
+
     if args.ofile_name:
-        AutoMPGData()._to_csv(args.ofile_name, args.output, args.sort)
+        data._to_csv(args.ofile_name, args.output, args.sort, args.by, args.metrics, aggregates)
     
     if args.output == 'print':
         print('"Make", "Model", "Year", "MPG"')
         if args.sort == 'default':
-            for row in AutoMPGData().sort_by_default():
+            for row in data.sort_by_default():
                 print(row)
         elif args.sort == 'year':
-            for row in AutoMPGData().sort_by_year():
+            for row in data.sort_by_year():
                 print(row)
         elif args.sort == 'mpg':
-            for row in AutoMPGData().sort_by_mpg():
+            for row in data.sort_by_mpg():
                 print(row)
         else:
-            for row in AutoMPGData():
+            for row in data:
                 print(row)
     elif args.output == 'mpg_by_year':
         print('"Year", "MPG"')
-        for key, value in AutoMPGData().mpg_by_year(plot = args.plot).items():
+        for key, value in data.mpg_by_year(plot = args.plot).items():
             print(f'"{key}", "{value}"')
     elif args.output == 'mpg_by_make':
         print('"Make", "MPG"')
-        for key, value in AutoMPGData().mpg_by_make(plot = args.plot).items():
+        for key, value in data.mpg_by_make(plot = args.plot).items():
             print(f'"{key}", "{value}"')
+    else:
+        print(', '.join(f'"{name}"' for name in [field.capitalize() for field in args.by] + args.metrics))
+        for key, values in aggregates.items():
+            print(', '.join(f'"{value}"' for value in key + values))
 
     
 
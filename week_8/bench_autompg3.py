@@ -0,0 +1,76 @@
+""" Startup benchmark of autompg3: how long AutoMPGData() takes when the
+    binary file has to be built, when the process has not loaded the data
+    yet, and when it already has, and how many times one run of main()
+    loads the data. Last, mpg_by_year() and mpg_by_make() are timed on the
+    columns repeated to [rows] cars.
+
+    run with: python3 bench_autompg3.py [repeats] [rows]
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+from unittest import mock
+
+import numpy as np
+
+import autompg3
+from autompg3 import AutoMPGData
+
+def time_load(name, repeats, setup = None):
+    ''' time AutoMPGData() repeats times and print the mean
+    '''
+    seconds = 0.0
+    for i in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        AutoMPGData()
+        seconds += time.perf_counter() - start
+    print(f'{name:>8}: {seconds / repeats * 1000:.3f} ms')
+
+def forget():
+    ''' drop the data loaded by the process
+    '''
+    AutoMPGData._dataset = None
+
+def rebuild():
+    ''' drop the loaded data and the binary file
+    '''
+    forget()
+    if os.path.exists(AutoMPGData.binary_file):
+        os.remove(AutoMPGData.binary_file)
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 4_000_000
+
+    time_load('convert', repeats, rebuild)
+    time_load('load', repeats, forget)
+    time_load('shared', repeats)
+
+    # one run of main() writing a csv file and printing the same output
+    forget()
+    with mock.patch.object(AutoMPGData, '_read_binary', autospec = True,
+                           side_effect = AutoMPGData._read_binary) as read_binary, \
+         mock.patch.object(sys, 'argv', ['autompg3.py', 'print', '-s', 'year', '-o', 'bench.csv']), \
+         mock.patch.object(autompg3, 'log_config'), \
+         contextlib.redirect_stdout(io.StringIO()):
+        autompg3.main()
+    os.remove('bench.csv')
+    print(f'loads in one run of main(): {read_binary.call_count}')
+
+    # group-bys of many cars, without making AutoMPG objects
+    data = AutoMPGData()
+    columns = data.columns
+    take = np.arange(rows) % len(data)
+    data.columns = columns._replace(make_codes = columns.make_codes[take], model_codes = columns.model_codes[take],
+                                    years = columns.years[take], mpgs = columns.mpgs[take])
+    for name in ['mpg_by_year', 'mpg_by_make']:
+        start = time.perf_counter()
+        getattr(data, name)()
+        print(f'{name}: {(time.perf_counter() - start) * 1000:.1f} ms for {rows} cars')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""Unit tests for the autompg program."""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from autompg3 import *
+
+class TestAutoMPG(unittest.TestCase):
+
+    def test_init(self):
+        a1 = AutoMPG(1, 2, 3, 4)
+        self.assertEqual("1", a1.make)
+        self.assertEqual("2", a1.model)
+        self.assertEqual(1903, a1.year)
+        self.assertEqual(4.0, a1.mpg)
+
+    def test_eq(self):
+        # test when they are equal
+        a1 = AutoMPG('a', 'b', 3, 4)
+        a2 = AutoMPG('a', 'b', 3, 4)
+        self.assertTrue(a1 == a2)
+        self.assertFalse(a1 != a2)
+
+        # test each attribute
+        a2 = AutoMPG('c', 'b', 3, 4)
+        self.assertTrue(a1 != a2)
+        self.assertFalse(a1 == a2)
+
+        a2 = AutoMPG('a', 'c', 3, 4)
+        self.assertTrue(a1 != a2)
+        self.assertFalse(a1 == a2)
+
+        a2 = AutoMPG('a', 'b', 0, 4)
+        self.assertTrue(a1 != a2)
+        self.assertFalse(a1 == a2)
+
+        a2 = AutoMPG('a', 'b', 3, 0)
+        self.assertTrue(a1 != a2)
+        self.assertFalse(a1 == a2)
+
+    def test_hash(self):
+        a1 = AutoMPG('a', 'b', 3, 4)
+        a2 = AutoMPG('a', 'b', 3, 4)
+
+        # sets will only have unique values - determined by hash
+        s = {a1, a2}
+        self.assertEqual(1, len(s))
+        self.assertTrue(a1 in s)
+        self.assertTrue(a2 in s)
+
+        # now make sure each attribute is considered in the
+        # has function
+        b1 = AutoMPG('c', 'b', 3, 4)
+        s.add(b1)
+        self.assertEqual(2, len(s))
+        self.assertTrue(b1 in s)
+
+        b1 = AutoMPG('a', 'c', 3, 4)
+        s.add(b1)
+        self.assertEqual(3, len(s))
+        self.assertTrue(b1 in s)
+
+        b1 = AutoMPG('a', 'b', 0, 4)
+        s.add(b1)
+        self.assertEqual(4, len(s))
+        self.assertTrue(b1 in s)
+
+        b1 = AutoMPG('a', 'b', 3, 0)
+        s.add(b1)
+        self.assertEqual(5, len(s))
+        self.assertTrue(b1 in s)
+
+    def test_slots(self):
+        # cars have no __dict__, only their four fields
+        a1 = AutoMPG('a', 'b', 3, 4)
+        self.assertFalse(hasattr(a1, '__dict__'))
+        self.assertEqual(a1, AutoMPG._from_typed('a', 'b', 1903, 4.0))
+
+    def test_read_only(self):
+        # cars are shared by every AutoMPGData, so they cannot be changed
+        a1 = AutoMPG('a', 'b', 3, 4)
+        with self.assertRaises(AttributeError):
+            a1.mpg = 5.0
+        with self.assertRaises(AttributeError):
+            del a1.make
+        self.assertEqual(AutoMPG('a', 'b', 3, 4), a1)
+
+    @unittest.expectedFailure
+    def test_lt_wrong_type(self):
+        a1 = AutoMPG('a', 'b', 3, 4)
+        a1 < "should not work"
+
+    def test_lt_mpg(self):
+        a1 = AutoMPG('a', 'b', 3, 4)
+        a2 = AutoMPG('a', 'b', 3, 5)
+        self.assertTrue(a1 < a2)
+        self.assertFalse(a2 < a1)
+
+    def test_lt_year(self):
+        a1 = AutoMPG('a', 'b', 3, 0)
+        a2 = AutoMPG('a', 'b', 4, 0)
+        self.assertTrue(a1 < a2)
+        self.assertFalse(a2 < a1)
+
+    def test_lt_model(self):
+        # make, model, year are the only ones that matter
+        a1 = AutoMPG('a', 'b', 0, 0)
+        a2 = AutoMPG('a', 'c', 0, 0)
+        self.assertTrue(a1 < a2)
+        self.assertFalse(a2 < a1)
+
+    def test_lt_make(self):
+        # make, model, year are the only ones that matter
+        a1 = AutoMPG('a', 'c', 0, 0)
+        a2 = AutoMPG('b', 'c', 0, 0)
+        self.assertTrue(a1 < a2)
+        self.assertFalse(a2 < a1)
+
+class TestAutoMPGData(unittest.TestCase):
+
+    def test_iterable(self):
+        # make sure it is possible to get and iterator from AutoMPGData
+        iter(AutoMPGData())
+
+    def test_missing_values(self):
+        # missing values are nan, or MISSING_INT in the integer fields
+        data = AutoMPGData()
+        with tempfile.TemporaryDirectory() as directory:
+            clean_file = os.path.join(directory, 'auto-mpg.clean.txt')
+            binary_file = os.path.join(directory, 'auto-mpg.clean.npy')
+            with open(clean_file, 'w') as f:
+                f.write('25.0   4   98.00      ?          2046.      19.0   71  1        "ford pinto"\n')
+                f.write('21.0   ?   200.0      85.00      2875.      17.0   74  1        "ford maverick"\n')
+            with mock.patch.object(AutoMPGData, 'clean_file', clean_file), \
+                 mock.patch.object(AutoMPGData, 'binary_file', binary_file):
+                data._to_binary()
+            records = np.load(binary_file)
+        self.assertTrue(np.isnan(records['horsepower'][0]))
+        self.assertEqual(85.0, records['horsepower'][1])
+        self.assertEqual([4, MISSING_INT], records['cylinders'].tolist())
+        self.assertEqual(['ford pinto', 'ford maverick'], records['car_name'].tolist())
+
+    def test_loaded_once(self):
+        # the clean file is only read again after it changes, on a copy so
+        # the tracked file is left alone
+        with tempfile.TemporaryDirectory() as directory:
+            clean_file = os.path.join(directory, 'auto-mpg.clean.txt')
+            shutil.copy(AutoMPGData.clean_file, clean_file)
+            with mock.patch.object(AutoMPGData, 'original_file', clean_file), \
+                 mock.patch.object(AutoMPGData, 'clean_file', clean_file), \
+                 mock.patch.object(AutoMPGData, 'binary_file', os.path.join(directory, 'auto-mpg.clean.npy')), \
+                 mock.patch.object(AutoMPGData, '_dataset', None), \
+                 mock.patch.object(AutoMPGData, '_read_binary', autospec = True,
+                                   side_effect = AutoMPGData._read_binary) as read_binary:
+                data1 = AutoMPGData()
+                data2 = AutoMPGData()
+                self.assertEqual(1, read_binary.call_count)
+                self.assertEqual(data1.data, data2.data)
+
+                # each one has its own list of cars
+                data1.data.reverse()
+                self.assertNotEqual(data1.data, data2.data)
+
+                stat = os.stat(clean_file)
+                os.utime(clean_file, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+                AutoMPGData()
+                self.assertEqual(2, read_binary.call_count)
+
+    def test_sorted_views(self):
+        # sorted views match sorting the list in place and leave it as it is
+        data = AutoMPGData()
+        cars = list(data.data)
+        self.assertEqual(sorted(cars), list(data.sort_by_default()))
+        self.assertEqual(sorted(cars, key = lambda x: (x.year, x.make, x.model, x.mpg)), list(data.sort_by_year()))
+        self.assertEqual(sorted(cars, key = lambda x: (x.mpg, x.make, x.model, x.year)), list(data.sort_by_mpg()))
+        self.assertEqual(cars, data.data)
+
+        # the order is computed once and shared
+        self.assertIs(data.sort_by_year().order, AutoMPGData().sort_by_year().order)
+
+class TestAggregate(unittest.TestCase):
+
+    def setUp(self):
+        # a small clean file: the vw horsepowers are all missing
+        self.directory = tempfile.TemporaryDirectory()
+        clean_file = os.path.join(self.directory.name, 'auto-mpg.clean.txt')
+        with open(clean_file, 'w') as f:
+            f.write('20.0   4   98.00      100.0      2046.      19.0   70  1        "ford pinto"\n')
+            f.write('22.0   6   200.0      120.0      2875.      17.0   70  1        "ford maverick"\n')
+            f.write('30.0   4   98.00      90.00      2100.      16.0   71  1        "ford pinto"\n')
+            f.write('24.0   6   200.0      ?          2900.      15.0   71  1        "ford maverick"\n')
+            f.write('35.0   4   97.00      ?          1835.      20.5   70  2        "volkswagen 1131 deluxe sedan"\n')
+            f.write('31.0   4   97.00      ?          1950.      21.0   72  2        "vw super beetle"\n')
+        self.patches = [mock.patch.object(AutoMPGData, 'original_file', clean_file),
+                        mock.patch.object(AutoMPGData, 'clean_file', clean_file),
+                        mock.patch.object(AutoMPGData, 'binary_file',
+                                          os.path.join(self.directory.name, 'auto-mpg.clean.npy'))]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        AutoMPGData._dataset = None
+        self.directory.cleanup()
+
+    # every statistic of a group, and nan for a group with no values
+    def test_statistics(self):
+        metrics = ['count', 'horsepower:count', 'horsepower:mean', 'horsepower:median',
+                   'horsepower:min', 'horsepower:max', 'horsepower:std']
+        aggregates = AutoMPGData().aggregate(['make'], metrics)
+        self.assertEqual([('ford',), ('volkswagen',)], list(aggregates))
+        np.testing.assert_allclose([4, 3, np.mean([100, 120, 90]), 100, 90, 120, np.std([100, 120, 90])],
+                                   aggregates[('ford',)])
+        self.assertEqual((2, 0), aggregates[('volkswagen',)][:2])
+        self.assertTrue(np.isnan(aggregates[('volkswagen',)][2:]).all())
+
+    # groups of several fields are sorted by each field in turn
+    def test_multiple_fields(self):
+        aggregates = AutoMPGData().aggregate(['year', 'cylinders'], ['mpg:median', 'weight:max'])
+        self.assertEqual({(1970, 4): (27.5, 2046.0), (1970, 6): (22.0, 2875.0), (1971, 4): (30.0, 2100.0),
+                          (1971, 6): (24.0, 2900.0), (1972, 4): (31.0, 1950.0)}, aggregates)
+        self.assertEqual(sorted(aggregates), list(aggregates))
+
+    # fields and metrics that do not exist are refused
+    def test_invalid(self):
+        data = AutoMPGData()
+        for by, metrics in [(['color'], ['count']), (['make'], ['mpg:mode']), (['make'], ['speed:mean']),
+                            (['make'], ['mpg']), ([], ['count']), (['make'], [])]:
+            with self.assertRaises(ValueError):
+                data.aggregate(by, metrics)
+
+    # the csv file is written from aggregates main() already computed
+    def test_to_csv_aggregates(self):
+        data = AutoMPGData()
+        aggregates = data.aggregate(['make'], ['count', 'mpg:max'])
+        csv_file = os.path.join(self.directory.name, 'aggregate.csv')
+        with mock.patch.object(AutoMPGData, 'aggregate') as aggregate:
+            data._to_csv(csv_file, 'aggregate', by = ['make'], metrics = ['count', 'mpg:max'],
+                         aggregates = aggregates)
+        aggregate.assert_not_called()
+        with open(csv_file) as f:
+            self.assertEqual(['"Make","count","mpg:max"', '"ford","4","30.0"', '"volkswagen","2","35.0"'],
+                             f.read().splitlines())
+
+class TestAggregateDataSet(unittest.TestCase):
+
+    # one field against numpy on the cars of each group
+    def test_single_field(self):
+        data = AutoMPGData()
+        years, mpgs = data.columns.years, data.columns.mpgs
+        aggregates = data.aggregate(['year'], ['mpg:mean', 'mpg:std', 'count'])
+        self.assertEqual([(year,) for year in np.unique(years).tolist()], list(aggregates))
+        for (year,), values in aggregates.items():
+            group = mpgs[years == year]
+            np.testing.assert_allclose([group.mean(), group.std(), len(group)], values)
+        self.assertEqual({year: mean for (year,), (mean, std, count) in aggregates.items()}, data.mpg_by_year())
+
+    # several fields against numpy, leaving out the missing horsepowers
+    def test_multiple_fields(self):
+        data = AutoMPGData()
+        columns = data.columns
+        makes = columns.makes[columns.make_codes]
+        aggregates = data.aggregate(['make', 'cylinders'], ['horsepower:mean', 'horsepower:median', 'weight:max'])
+        self.assertEqual(sorted(set(zip(makes.tolist(), columns.cylinders.tolist()))), list(aggregates))
+        for (make, cylinders), values in aggregates.items():
+            group = (makes == make) & (columns.cylinders == cylinders)
+            horsepowers = columns.horsepowers[group & ~np.isnan(columns.horsepowers)]
+            if len(horsepowers):
+                expected = [horsepowers.mean(), np.median(horsepowers)]
+            else:
+                expected = [np.nan, np.nan]
+            np.testing.assert_allclose(expected + [columns.weights[group].max()], values)
+
+if __name__ == '__main__':
+    unittest.main()